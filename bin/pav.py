@@ -5,6 +5,7 @@ from logging.handlers import RotatingFileHandler
 from pavilion import arguments
 from pavilion import commands
 from pavilion import config
+from pavilion import lockfile
 from pavilion import plugins
 import logging
 import os
@@ -23,6 +24,12 @@ except Exception as err:
     print(err, file=sys.stderr)
     sys.exit(-1)
 
+# Use the configured lock backend for all locks.
+lockfile.set_default_backend(pav_cfg.lock_backend)
+if pav_cfg.lock_stats == 'true':
+    lockfile.enable_stats(os.path.join(pav_cfg.working_dir,
+                                       lockfile.STATS_FN))
+
 root_logger = logging.getLogger()
 
 # Set up a directory for tracebacks.
@@ -0,0 +1,160 @@
+"""Attach a finished build to a test, by populating the test's build
+directory from the original build.
+
+The modes are:
+
+- symlink: Recreate the directory structure, with an (absolute) symlink
+  to each file in the original build. This is the classic behavior.
+- lazy: Only symlink the top level entries of the build. This is
+  (nearly) constant cost regardless of the size of the build, but anything
+  a test writes below the top level of its build directory ends up in the
+  original build.
+- hardlink: Recreate the directory structure, with a hard link to each
+  file. Hard links don't dangle if the original build is evicted, and
+  don't require a symlink lookup on every access. Where hard links aren't
+  possible (across filesystems, for instance), symlinks are used instead.
+
+Overlay or bind mounts aren't an option, as the mount would only exist on
+the host that created the test, not on the nodes it runs on.
+
+In both full tree modes, the directories at each level of the tree are
+scanned and populated in parallel.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import logging
+import os
+import time
+
+LOGGER = logging.getLogger('pav.' + __name__)
+
+MODES = ('symlink', 'lazy', 'hardlink')
+
+# How many threads to populate directories with.
+ATTACH_WORKERS = 8
+
+# Errors that mean hard links aren't possible here.
+_HARDLINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP}
+
+
+class AttachStats:
+    """How long attaching a build took, and how much it did."""
+
+    def __init__(self, origin, mode):
+        self.origin = origin
+        self.mode = mode
+        self.dirs = 0
+        self.links = 0
+        self.start = time.time()
+        self.elapsed = None
+
+    def done(self):
+        self.elapsed = time.time() - self.start
+
+    def __str__(self):
+        return ("Attached build '{}' ({} mode, {} directories, {} links) in "
+                "{:.3f}s.".format(self.origin, self.mode, self.dirs,
+                                  self.links, self.elapsed or 0))
+
+
+class _Linker:
+    """Makes the link for each file, falling back from hard links to
+    symlinks (for good) the first time a hard link isn't possible."""
+
+    def __init__(self, mode):
+        self.hardlink = mode == 'hardlink'
+
+    def link(self, src, dest):
+        if self.hardlink:
+            try:
+                os.link(src, dest)
+                return
+            except OSError as err:
+                if err.errno not in _HARDLINK_ERRNOS:
+                    raise
+                LOGGER.info("Can't hard link '{}' to '{}', using symlinks "
+                            "instead: {}".format(src, dest, err))
+                self.hardlink = False
+
+        os.symlink(src, dest)
+
+
+def _attach_dir(src_dir, dest_dir, linker):
+    """Populate dest_dir (which must exist) with the contents of src_dir.
+    Subdirectories are created, but not populated.
+    :returns: A list of (src, dest) subdirectory pairs, and the number of
+        links made.
+    """
+
+    sub_dirs = []
+    links = 0
+    with os.scandir(src_dir) as scan:
+        for entry in scan:
+            dest_path = os.path.join(dest_dir, entry.name)
+            if entry.is_symlink():
+                # Symlinks are copied as is.
+                os.symlink(os.readlink(entry.path), dest_path)
+            elif entry.is_dir():
+                os.mkdir(dest_path)
+                sub_dirs.append((entry.path, dest_path))
+                continue
+            else:
+                linker.link(entry.path, dest_path)
+            links += 1
+
+    return sub_dirs, links
+
+
+def attach(origin, dest, mode='symlink', max_workers=ATTACH_WORKERS):
+    """Attach the build at origin to dest.
+    :param str origin: The original build directory.
+    :param str dest: The test's build directory. It must not exist.
+    :param str mode: One of MODES.
+    :param int max_workers: The maximum number of threads to populate
+        directories with.
+    :rtype: AttachStats
+    :raises OSError: When the build can't be attached.
+    :raises ValueError: For an invalid mode.
+    """
+
+    if mode not in MODES:
+        raise ValueError("Invalid build attach mode '{}'. Must be one of {}."
+                         .format(mode, MODES))
+
+    origin = os.path.realpath(origin)
+    stats = AttachStats(origin, mode)
+    linker = _Linker(mode)
+
+    os.mkdir(dest)
+    stats.dirs += 1
+
+    if mode == 'lazy':
+        with os.scandir(origin) as scan:
+            for entry in scan:
+                dest_path = os.path.join(dest, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), dest_path)
+                else:
+                    os.symlink(entry.path, dest_path)
+                stats.links += 1
+
+        stats.done()
+        return stats
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # Each level of the tree is populated in parallel. The directories
+        # for the next level are created along the way.
+        level = [(origin, dest)]
+        while level:
+            results = pool.map(lambda pair: _attach_dir(pair[0], pair[1],
+                                                        linker),
+                               level)
+            level = []
+            for sub_dirs, links in results:
+                level.extend(sub_dirs)
+                stats.dirs += len(sub_dirs)
+                stats.links += links
+
+    stats.done()
+    return stats
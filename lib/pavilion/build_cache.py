@@ -0,0 +1,343 @@
+"""Manages the working_dir/builds directory as a cache, evicting the least
+recently used builds when it gets too large or builds get too old.
+
+A build's last use is the mtime of its directory, which PavTest.build()
+updates every time a test uses the build. Build sizes are computed once (
+builds never change after they're created) and remembered in
+'builds/.build_sizes'.
+
+Tests lease the build they use (an empty file under 'builds/.users/<build>/')
+when they attach it, and release it when their run is done. Leased builds
+are never evicted, so finding the builds in use only means looking at the
+leases, not every test. Leases older than LEASE_MAX_AGE are assumed to
+belong to tests that died or were abandoned, and are ignored (and removed).
+Builds are only evicted while holding their '<build>.lock', the same lock
+used when creating them. The build is renamed out of the way under the
+lock, and deleted after.
+
+Extracted source archives in 'src_cache' (see source_cache) are cached and
+evicted along with the builds, under the same limits. They're never in use
+by a test once the build they were extracted for is done.
+
+Eviction also prunes the working_dir hash cache (see hash_cache) of entries
+that haven't been used within the build max age (or hash_cache.PRUNE_AGE,
+if builds don't expire).
+"""
+
+from pavilion import hash_cache
+from pavilion import lockfile
+from pavilion import utils
+import json
+import logging
+import os
+import shutil
+import time
+
+LOGGER = logging.getLogger('pav.' + __name__)
+
+
+class BuildInfo:
+    """The size and last use time of a build (or cached source)."""
+
+    def __init__(self, name, path, size, last_used, source=False):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.last_used = last_used
+        # Whether this is a source cache entry rather than a build.
+        self.source = source
+
+
+class BuildCache:
+    """The build cache for a working directory."""
+
+    SIZES_FN = '.build_sizes'
+    LOCK_FN = '.build_cache.lock'
+    # Never evict builds used more recently than this (in seconds). Tests
+    # copy their build without holding the build's lock, so this protects
+    # builds that are in the middle of being used.
+    EVICT_GRACE = 15*60
+    EVICTING_EXT = '.evicting'
+    USERS_DIR = '.users'
+    # Leases older than this (in seconds) are considered abandoned.
+    LEASE_MAX_AGE = 7*24*60*60
+
+    def __init__(self, pav_cfg):
+        """
+        :param pav_cfg: The pavilion config. The max_size and max_age
+            limits come from 'build_cache_max_size' (MiB) and
+            'build_cache_max_age' (days); zero means no limit.
+        """
+
+        self.pav_cfg = pav_cfg
+        self.path = os.path.join(pav_cfg.working_dir, 'builds')
+        self.src_path = os.path.join(pav_cfg.working_dir, 'src_cache')
+        self.max_size = pav_cfg.build_cache_max_size * 1024**2
+        self.max_age = pav_cfg.build_cache_max_age * 24*60*60
+
+    @property
+    def limited(self):
+        """Whether there are any limits set on the cache."""
+        return bool(self.max_size or self.max_age)
+
+    @staticmethod
+    def _dir_size(path):
+        """Get the total (apparent) size of all the files under path."""
+
+        total = 0
+        for dir_path, dir_names, file_names in os.walk(path):
+            for name in dir_names + file_names:
+                try:
+                    total += os.lstat(os.path.join(dir_path, name)).st_size
+                except OSError:
+                    pass
+
+        return total
+
+    def _load_sizes(self, base_path=None):
+        base_path = self.path if base_path is None else base_path
+        try:
+            with open(os.path.join(base_path, self.SIZES_FN)) as sizes_file:
+                return json.load(sizes_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_sizes(self, sizes, base_path=None):
+        base_path = self.path if base_path is None else base_path
+        sizes_path = os.path.join(base_path, self.SIZES_FN)
+        tmp_path = '{}.{}'.format(sizes_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as sizes_file:
+                json.dump(sizes, sizes_file)
+            os.rename(tmp_path, sizes_path)
+        except (IOError, OSError) as err:
+            LOGGER.warning("Could not save build sizes to '{}': {}"
+                           .format(sizes_path, err))
+
+    def builds(self):
+        """Get info on every build in the cache.
+        :returns: A list of BuildInfo objects, least recently used first.
+        """
+
+        if not os.path.isdir(self.path):
+            return []
+
+        return self._entries(self.path, utils.list_build_dirs(self.path))
+
+    def sources(self):
+        """Get info on every extracted source archive in the source cache.
+        :returns: A list of BuildInfo objects, least recently used first.
+        """
+
+        if not os.path.isdir(self.src_path):
+            return []
+
+        # Only complete entries are named for just their digest.
+        entries = [(name, os.path.join(self.src_path, name))
+                   for name in os.listdir(self.src_path)
+                   if '.' not in name]
+
+        return self._entries(self.src_path, entries, source=True)
+
+    def _entries(self, base_path, entries, source=False):
+        """Get the BuildInfo for each of the given (name, path) entries,
+        least recently used first."""
+
+        sizes = self._load_sizes(base_path)
+        new_sizes = {}
+
+        infos = []
+        for name, path in entries:
+            try:
+                last_used = os.stat(path).st_mtime
+            except OSError:
+                # It was removed out from under us.
+                continue
+
+            if name not in sizes:
+                sizes[name] = self._dir_size(path)
+            new_sizes[name] = sizes[name]
+
+            infos.append(BuildInfo(name, path, sizes[name], last_used,
+                                   source=source))
+
+        if new_sizes != self._load_sizes(base_path):
+            self._save_sizes(new_sizes, base_path)
+
+        infos.sort(key=lambda b: b.last_used)
+        return infos
+
+    def _lease_path(self, build_name, test_id):
+        return os.path.join(self.path, self.USERS_DIR, build_name,
+                            str(test_id))
+
+    def lease(self, build_name, test_id):
+        """Note that the given test is using the given build, so it won't be
+        evicted. Leasing a build again refreshes the lease.
+        :raises OSError: When the lease can't be created.
+        """
+
+        lease_path = self._lease_path(build_name, test_id)
+        os.makedirs(os.path.dirname(lease_path), exist_ok=True)
+        with open(lease_path, 'a'):
+            pass
+        os.utime(lease_path, None)
+
+    def release(self, build_name, test_id):
+        """Note that the given test is done with the given build."""
+
+        try:
+            os.unlink(self._lease_path(build_name, test_id))
+        except OSError:
+            pass
+
+    def in_use(self, clean=False):
+        """Get the names of all builds with current leases.
+        :param bool clean: Remove abandoned leases (and lease directories)
+            along the way.
+        :returns: A set of build names.
+        """
+
+        users_dir = os.path.join(self.path, self.USERS_DIR)
+        if not os.path.isdir(users_dir):
+            return set()
+
+        now = time.time()
+        used = set()
+        for build_name in os.listdir(users_dir):
+            lease_dir = os.path.join(users_dir, build_name)
+            try:
+                leases = os.listdir(lease_dir)
+            except OSError:
+                continue
+
+            for lease in leases:
+                lease_path = os.path.join(lease_dir, lease)
+                try:
+                    leased = os.stat(lease_path).st_mtime
+                except OSError:
+                    continue
+
+                if now - leased < self.LEASE_MAX_AGE:
+                    used.add(build_name)
+                elif clean:
+                    try:
+                        os.unlink(lease_path)
+                    except OSError:
+                        pass
+
+            if clean and build_name not in used:
+                try:
+                    os.rmdir(lease_dir)
+                except OSError:
+                    pass
+
+        return used
+
+    def evict(self, dry_run=False, pending=()):
+        """Evict builds until the cache is within its limits. Leased builds,
+        those about to be used, and those used within EVICT_GRACE seconds are
+        never evicted.
+        :param bool dry_run: Only figure out what would be evicted.
+        :param pending: The names of builds that tests are about to use, but
+            haven't leased yet.
+        :returns: The list of BuildInfo objects for the evicted builds.
+        """
+
+        if not dry_run:
+            self.prune_hashes()
+
+        if not self.limited or not os.path.isdir(self.path):
+            return []
+
+        # Only one evictor at a time.
+        try:
+            with lockfile.LockFile(os.path.join(self.path, self.LOCK_FN),
+                                   group=self.pav_cfg.shared_group):
+                return self._evict(dry_run, pending)
+        except lockfile.TimeoutError:
+            LOGGER.info("Build cache eviction already in progress.")
+            return []
+
+    def prune_hashes(self):
+        """Prune the hash cache of entries that haven't been used within the
+        build max age. This happens at most once per
+        hash_cache.PRUNE_PERIOD."""
+
+        cache = hash_cache.get_cache(self.pav_cfg.working_dir)
+        removed = cache.prune(self.max_age or hash_cache.PRUNE_AGE)
+        if removed:
+            LOGGER.info("Pruned {} old entries from the hash cache."
+                        .format(removed))
+
+    def _evict(self, dry_run, pending):
+
+        builds = self.builds() + self.sources()
+        builds.sort(key=lambda b: b.last_used)
+        used = self.in_use(clean=not dry_run) | set(pending)
+        now = time.time()
+
+        total = sum(build.size for build in builds)
+        evicted = []
+
+        for build in builds:
+            expired = self.max_age and now - build.last_used > self.max_age
+            too_big = self.max_size and total > self.max_size
+
+            if not (expired or too_big):
+                # Builds are in LRU order, so nothing after this will be
+                # expired either.
+                break
+
+            if ((build.name in used and not build.source) or
+                    now - build.last_used < self.EVICT_GRACE):
+                continue
+
+            if dry_run or self._evict_build(build):
+                total -= build.size
+                evicted.append(build)
+
+        if evicted and not dry_run:
+            for base_path, source in (self.path, False), (self.src_path, True):
+                gone = [b.name for b in evicted if b.source == source]
+                if gone:
+                    sizes = self._load_sizes(base_path)
+                    for name in gone:
+                        sizes.pop(name, None)
+                    self._save_sizes(sizes, base_path)
+
+        return evicted
+
+    def _evict_build(self, build):
+        """Remove a single build, under its build lock.
+        :returns: True if the build was removed."""
+
+        evict_path = build.path + self.EVICTING_EXT
+
+        try:
+            with lockfile.LockFile(build.path + '.lock',
+                                   group=self.pav_cfg.shared_group):
+                # Make sure it wasn't used while we were deciding to evict it.
+                if os.stat(build.path).st_mtime != build.last_used:
+                    return False
+
+                os.rename(build.path, evict_path)
+        except lockfile.TimeoutError:
+            # Someone is building or evicting it.
+            return False
+        except OSError as err:
+            LOGGER.warning("Could not evict build '{}': {}"
+                           .format(build.path, err))
+            return False
+
+        # Once renamed, the build is gone as far as tests are concerned,
+        # so we don't need the lock to delete it.
+        def handle_error(_, path, exc_info):
+            LOGGER.warning("Error removing evicted build '{}': {}"
+                           .format(path, exc_info[1]))
+
+        shutil.rmtree(evict_path, onerror=handle_error)
+        LOGGER.info("Evicted build '{}' ({} bytes)."
+                    .format(build.name, build.size))
+
+        return True
@@ -167,6 +167,100 @@ class PavilionConfigLoader(yc.YamlConfigLoader):
             "log_level", default="info", post_validator=log_level_validate,
             help_text="The minimum log level for messages sent to the pavilion "
                       "logfile."),
+        yc.StrElem(
+            "lock_backend", default="file", choices=["file", "flock"],
+            help_text="How Pavilion locks shared files (like test id and "
+                      "build directories). 'file' is the classic NFS safe "
+                      "lockfile protocol, where waiting processes poll for "
+                      "the lock. 'flock' uses kernel locks, so waiters are "
+                      "woken as soon as the lock is free; it falls back to "
+                      "'file' where the filesystem doesn't support flock. "
+                      "Every Pavilion instance sharing a working_dir must use "
+                      "the same lock backend."),
+        yc.StrElem(
+            "lock_stats", default="false", choices=["true", "false"],
+            help_text="Record how long every lock acquisition waited and was "
+                      "held in 'lock_stats.jsonl' in the working_dir. Use "
+                      "'pav lock_stats' to summarize them."),
+        yc.StrElem(
+            "status_index", default="true", choices=["true", "false"],
+            help_text="Also record every test status change in a working_dir "
+                      "wide index ('status_index/'), so that status queries "
+                      "don't have to open every test's status file. Tests "
+                      "missing from the index fall back to their status "
+                      "file."),
+        yc.IntElem(
+            "build_cache_max_size", default=0,
+            help_text="The maximum total size (in MiB) of the builds in the "
+                      "working_dir. When exceeded, the least recently used "
+                      "builds that no unfinished test is using are deleted. "
+                      "Zero means no limit."),
+        yc.IntElem(
+            "build_cache_max_age", default=0,
+            help_text="Delete builds (that no unfinished test is using) that "
+                      "haven't been used in this many days. Zero means no "
+                      "limit."),
+        yc.StrElem(
+            "source_cache", default="reflink",
+            choices=["off", "reflink", "hardlink"],
+            help_text="Extracted source archives are cached in the "
+                      "working_dir ('src_cache/'), by archive content, so "
+                      "each archive is only extracted once. Build directories "
+                      "are populated from the cache with reflinks where the "
+                      "filesystem supports them, and copies otherwise. "
+                      "'hardlink' also allows hard links, which is faster on "
+                      "filesystems without reflinks, but build scripts must "
+                      "never modify source files in place. 'off' extracts "
+                      "every archive directly. Cached sources count towards "
+                      "(and are evicted under) the build cache limits."),
+        yc.StrElem(
+            "build_attach", default="symlink",
+            choices=["symlink", "lazy", "hardlink"],
+            help_text="How each test's build directory is populated from the "
+                      "original build, unless the test config says otherwise "
+                      "('build.attach'). 'symlink' recreates the build's "
+                      "directories, with a symlink to each file. 'lazy' only "
+                      "symlinks the build's top level entries, which is much "
+                      "faster for large builds, but tests must only write to "
+                      "the top level of their build directory. 'hardlink' is "
+                      "like 'symlink', but with hard links where possible."),
+        yc.IntElem(
+            "max_parallel_builds", default=4,
+            help_text="'pav run' performs every unique build its tests need "
+                      "before any of them are scheduled. This is the "
+                      "maximum number of those builds to run at once."),
+        yc.IntElem(
+            "build_lock_timeout", default=3*60*60,
+            help_text="How long (in seconds) 'pav run' waits for another "
+                      "Pavilion instance that's performing the same build. "
+                      "Tests whose build is still locked after this long get "
+                      "a BUILD_ERROR, and aren't scheduled."),
+        yc.StrElem(
+            "log_compress", default="false", choices=["true", "false"],
+            help_text="Gzip test build and run logs as they're written. "
+                      "Pavilion's log readers (like the regex result parser) "
+                      "read compressed logs transparently."),
+        yc.IntElem(
+            "log_head_size", default=0,
+            help_text="Keep only this much (in KiB) of the start of each "
+                      "build and run log, plus the end given by "
+                      "'log_tail_size'. The output in between is dropped. If "
+                      "both are zero, logs aren't limited."),
+        yc.IntElem(
+            "log_tail_size", default=0,
+            help_text="Keep this much (in KiB) of the end of each build and "
+                      "run log. See 'log_head_size'."),
+        yc.StrElem(
+            "config_cache", default="true", choices=["true", "false"],
+            help_text="Cache loaded and validated host, mode and test suite "
+                      "configs in the working_dir ('config_cache/'), so they "
+                      "only need to be parsed again when they change."),
+        yc.IntElem(
+            "download_ttl", default=0,
+            help_text="Downloaded test sources (from urls) that were checked "
+                      "for updates less than this many seconds ago aren't "
+                      "checked again. Otherwise they're checked every time "
+                      "they're used, with a single conditional request."),
         yc.IntElem(
             "wget_timeout", default=5,
             help_text="How long to wait on web requests before timing out. On"
@@ -0,0 +1,148 @@
+"""A cache of loaded and validated configs, so that unchanged host, mode
+and suite configs don't have to be parsed and validated on every run.
+
+Entries are keyed by the (realpath, size, mtime_ns) of every file a config
+was built from, a description of the config schema (which plugins can add
+to), and CACHE_VERSION. Anything that changes any of those simply misses
+the cache. Each entry is a pickle file under '<working_dir>/config_cache/',
+written atomically (via rename). Entries that can't be read for any reason
+are treated as misses.
+
+Like builds, entries are trusted because they're in the working_dir; anyone
+who can write there can already change what tests run.
+"""
+
+from pavilion import hash_cache
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+
+LOGGER = logging.getLogger('pav.' + __name__)
+
+# Bump this whenever how configs are loaded changes in a way that the cache
+# key wouldn't otherwise notice.
+CACHE_VERSION = 1
+
+# Caches by cache directory.
+_CACHES = {}
+
+
+class ConfigCache:
+    """A persistent cache of loaded configs."""
+
+    def __init__(self, path):
+        """
+        :param str path: The cache directory. It's created as needed.
+        """
+
+        self.path = path
+
+    @staticmethod
+    def _file_key(path):
+        """Get the key parts for the given file.
+        :raises OSError: If the file can't be stat'ed.
+        """
+
+        real_path = os.path.realpath(path)
+        file_stat = os.stat(real_path)
+        return [real_path, file_stat.st_size, file_stat.st_mtime_ns]
+
+    def _entry_path(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name[:2], name)
+
+    @staticmethod
+    def _load(entry_path, key):
+        """Read an entry, returning (True, value) on a hit, and (False, None)
+        otherwise."""
+
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                entry_key, value = pickle.load(entry_file)
+        except FileNotFoundError:
+            return False, None
+        # Unpickling can fail in all sorts of ways on a bad entry.
+        except Exception as err:
+            LOGGER.debug("Ignoring bad config cache entry '{}': {}"
+                         .format(entry_path, err))
+            return False, None
+
+        if entry_key != key:
+            return False, None
+
+        return True, value
+
+    @staticmethod
+    def _save(entry_path, key, value):
+        tmp_path = '{}.{}.tmp'.format(entry_path, os.getpid())
+
+        try:
+            data = pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as err:
+            LOGGER.debug("Could not pickle config for '{}': {}"
+                         .format(entry_path, err))
+            return
+
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            with open(tmp_path, 'wb') as entry_file:
+                entry_file.write(data)
+            os.rename(tmp_path, entry_path)
+        except (IOError, OSError) as err:
+            LOGGER.warning("Could not save config cache entry '{}': {}"
+                           .format(entry_path, err))
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def get(self, kind, paths, schema, build):
+        """Get a loaded config from the cache, or build it (and cache it).
+        A fresh copy is returned every time (as long as build() makes a new
+        one), so callers are free to modify it.
+        :param str kind: What kind of config this is.
+        :param list paths: The files the config is built from.
+        :param str schema: A description of the structure the config is
+            validated against.
+        :param build: A function (of no arguments) that builds the config.
+        :returns: The config.
+        """
+
+        try:
+            file_keys = [self._file_key(path) for path in paths]
+        except OSError:
+            # Let build() report problems with the files.
+            return build()
+
+        key = json.dumps([CACHE_VERSION, kind, schema, file_keys])
+        entry_path = self._entry_path(key)
+
+        hit, value = self._load(entry_path, key)
+        if hit:
+            return value
+
+        value = build()
+
+        # Files modified very recently could change again without their
+        # mtime changing.
+        now = time.time()
+        racy = any(now - mtime_ns/10**9 < hash_cache.RACY_PERIOD
+                   for _, _, mtime_ns in file_keys)
+        if not racy:
+            self._save(entry_path, key, value)
+
+        return value
+
+
+def get_cache(working_dir):
+    """Get the config cache for the given working directory."""
+
+    path = os.path.join(working_dir, 'config_cache')
+
+    if path not in _CACHES:
+        _CACHES[path] = ConfigCache(path)
+
+    return _CACHES[path]
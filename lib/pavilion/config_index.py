@@ -0,0 +1,203 @@
+"""An index of what's in each of the config directories: the host, mode and
+test suite configs by name, and the directories that hold plugins.
+
+The index is built from a scan of each directory involved. Scans are saved
+in '<working_dir>/config_index.json' along with the directory's mtime, and
+reused as long as the mtime hasn't changed (adding, removing or renaming
+an entry always changes it). So finding configs normally takes just a stat
+per directory, and at worst a single scandir.
+
+Configs are found in config_dirs order, so the first config directory with
+a config of a given type and name wins, just as when probing each directory
+for the file.
+"""
+
+from pavilion import hash_cache
+import json
+import logging
+import os
+import time
+
+LOGGER = logging.getLogger('pav.' + __name__)
+
+INDEX_FN = 'config_index.json'
+
+# The config types (and the subdirectory they live in), and their extension.
+CONFIG_TYPES = ('hosts', 'modes', 'tests')
+CONFIG_EXT = '.yaml'
+
+PLUGIN_DIR = 'plugins'
+PLUGIN_EXT = '.yapsy-plugin'
+
+# Indexes by (working_dir, config_dirs).
+_INDEXES = {}
+
+
+class ConfigIndex:
+    """The configs (and plugin directories) in a set of config
+    directories."""
+
+    def __init__(self, config_dirs, index_path=None):
+        """
+        :param list config_dirs: The config directories, in order of
+            precedence.
+        :param str index_path: Where to save directory scans between
+            invocations. Nothing is saved if this is None.
+        """
+
+        self.config_dirs = list(config_dirs)
+        self.index_path = index_path
+
+        self._saved_scans = self._load_scans()
+        self._scans = {}
+
+        # (type, name) -> path
+        self.configs = {}
+        self.plugin_dirs = []
+
+        for conf_dir in self.config_dirs:
+            self._index_dir(conf_dir)
+
+        self._save_scans()
+
+    def _load_scans(self):
+        """Load the saved directory scans.
+        :returns: A dict of path -> [mtime_ns, entries].
+        """
+
+        if self.index_path is None:
+            return {}
+
+        try:
+            with open(self.index_path) as index_file:
+                scans = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        return scans if isinstance(scans, dict) else {}
+
+    def _save_scans(self):
+        """Save our directory scans, if any changed. Directories modified
+        very recently could change again without their mtime changing, so
+        their scans aren't saved."""
+
+        if self.index_path is None:
+            return
+
+        now = time.time()
+        scans = {path: scan for path, scan in self._scans.items()
+                 if now - scan[0]/10**9 >= hash_cache.RACY_PERIOD}
+        if scans == self._saved_scans:
+            return
+
+        tmp_path = '{}.{}'.format(self.index_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as index_file:
+                json.dump(scans, index_file)
+            os.rename(tmp_path, self.index_path)
+        except (IOError, OSError) as err:
+            LOGGER.warning("Could not save the config index '{}': {}"
+                           .format(self.index_path, err))
+
+    def _scan(self, path):
+        """List the given directory, using the saved scan if the directory
+        hasn't changed since.
+        :returns: A sorted list of [name, is_dir] pairs. Empty if the
+            directory doesn't exist or can't be read.
+        """
+
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+
+        saved = self._saved_scans.get(path)
+        if saved is not None and saved[0] == mtime_ns:
+            entries = saved[1]
+        else:
+            entries = []
+            try:
+                with os.scandir(path) as scan:
+                    for entry in scan:
+                        try:
+                            entries.append([entry.name, entry.is_dir()])
+                        except OSError:
+                            continue
+            except OSError as err:
+                LOGGER.warning("Could not scan config directory '{}': {}"
+                               .format(path, err))
+                return []
+            entries.sort()
+
+        self._scans[path] = [mtime_ns, entries]
+        return entries
+
+    def _index_dir(self, conf_dir):
+        """Add the configs and plugin directories in the given config
+        directory to the index."""
+
+        subdirs = {name for name, is_dir in self._scan(conf_dir) if is_dir}
+
+        for conf_type in CONFIG_TYPES:
+            if conf_type not in subdirs:
+                continue
+
+            type_dir = os.path.join(conf_dir, conf_type)
+            for name, is_dir in self._scan(type_dir):
+                if is_dir or not name.endswith(CONFIG_EXT):
+                    continue
+                key = (conf_type, name[:-len(CONFIG_EXT)])
+                # The first config dir with a given config wins.
+                if key not in self.configs:
+                    self.configs[key] = os.path.join(type_dir, name)
+
+        if PLUGIN_DIR in subdirs:
+            # Plugins can be nested at any depth.
+            dirs = [os.path.join(conf_dir, PLUGIN_DIR)]
+            seen = set()
+            while dirs:
+                dir_path = dirs.pop(0)
+                real_path = os.path.realpath(dir_path)
+                if real_path in seen:
+                    continue
+                seen.add(real_path)
+
+                entries = self._scan(dir_path)
+                if any(name.endswith(PLUGIN_EXT) and not is_dir
+                       for name, is_dir in entries):
+                    self.plugin_dirs.append(dir_path)
+                dirs.extend(os.path.join(dir_path, name)
+                            for name, is_dir in entries
+                            if is_dir and name != '__pycache__')
+
+    def find(self, conf_type, conf_name):
+        """Get the path to the config of the given type and name.
+        :param str conf_type: 'hosts', 'modes', or 'tests'
+        :param str conf_name: The name of the config (without extension).
+        :returns: The path, or None if there's no such config.
+        """
+
+        return self.configs.get((conf_type, conf_name))
+
+    def names(self, conf_type):
+        """Get the paths to all the configs of the given type.
+        :returns: A dict of config name -> path.
+        """
+
+        return {name: path for (c_type, name), path in self.configs.items()
+                if c_type == conf_type}
+
+
+def get_index(pav_cfg):
+    """Get the config index for the given pavilion config. It's built once
+    per process."""
+
+    key = (pav_cfg.working_dir, tuple(pav_cfg.config_dirs))
+
+    if key not in _INDEXES:
+        index_path = None
+        if os.path.isdir(pav_cfg.working_dir):
+            index_path = os.path.join(pav_cfg.working_dir, INDEX_FN)
+        _INDEXES[key] = ConfigIndex(pav_cfg.config_dirs, index_path)
+
+    return _INDEXES[key]
@@ -0,0 +1,258 @@
+"""Streaming extraction of (compressed) source archives and files.
+
+Archives are decompressed and extracted in a single pass, with large
+buffers. Where a parallel (or just faster) decompressor is installed (pigz,
+pbzip2/lbzip2, multi-threaded xz, zstd), it's used in place of the python
+library.
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Read and write in chunks this big.
+BUFFER_SIZE = 4*1024**2
+
+# The python library to decompress each compression (mime sub)type with.
+LIBRARIES = {
+    'gzip': gzip,
+    'x-gzip': gzip,
+    'x-bzip2': bz2,
+    'x-xz': lzma,
+    'x-lzma': lzma,
+}
+
+# External decompressors to use when available, in order of preference.
+# Each should write the decompressed data to stdout.
+DECOMPRESSORS = {
+    'gzip': [['pigz', '-dc']],
+    'x-gzip': [['pigz', '-dc']],
+    'x-bzip2': [['lbzip2', '-dc'], ['pbzip2', '-dc']],
+    'x-xz': [['xz', '-T0', '-dc']],
+    'zstd': [['zstd', '-dc']],
+    'x-zstd': [['zstd', '-dc']],
+}
+
+# Compression subtypes that we can handle.
+SUBTYPES = tuple(sorted(set(LIBRARIES.keys()) | set(DECOMPRESSORS.keys())))
+
+
+class ExtractError(RuntimeError):
+    """Raised when extraction fails for any reason."""
+    pass
+
+
+class ExtractStats:
+    """How long an extraction took, and how much it extracted."""
+
+    def __init__(self, src_path, method):
+        self.src_path = src_path
+        self.method = method
+        self.bytes_in = os.path.getsize(src_path)
+        self.bytes_out = 0
+        self.start = time.time()
+        self.elapsed = None
+
+    def done(self):
+        self.elapsed = time.time() - self.start
+
+    def __str__(self):
+        elapsed = max(self.elapsed or 0, 1e-6)
+        return ("Extracted {:.1f} MiB ({:.1f} MiB compressed) from '{}' in "
+                "{:.2f}s ({:.1f} MiB/s) using {}."
+                .format(self.bytes_out/1024**2, self.bytes_in/1024**2,
+                        self.src_path, elapsed,
+                        self.bytes_out/1024**2/elapsed, self.method))
+
+
+class _Decompressed:
+    """A readable stream of the decompressed contents of a file."""
+
+    def __init__(self, path, subtype):
+        self._proc = None
+        self._file = None
+
+        for cmd in DECOMPRESSORS.get(subtype, []):
+            if shutil.which(cmd[0]) is not None:
+                self._proc = subprocess.Popen(
+                    cmd + [path], stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE, bufsize=BUFFER_SIZE)
+                self.stream = self._proc.stdout
+                self.method = cmd[0]
+                return
+
+        if subtype in LIBRARIES:
+            self._file = LIBRARIES[subtype].open(path, 'rb')
+            self.stream = self._file
+            self.method = 'python ' + LIBRARIES[subtype].__name__
+        elif subtype in ('zstd', 'x-zstd') and zstandard is not None:
+            self._file = open(path, 'rb')
+            self.stream = zstandard.ZstdDecompressor().stream_reader(
+                self._file, read_size=BUFFER_SIZE)
+            self.method = 'python zstandard'
+        elif subtype == 'x-tar':
+            self._file = open(path, 'rb', buffering=BUFFER_SIZE)
+            self.stream = self._file
+            self.method = 'no decompression'
+        else:
+            raise ExtractError("No way to decompress '{}' files."
+                               .format(subtype))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(check=exc_type is None)
+
+    def close(self, check=True):
+        """Close the stream, and make sure the decompressor (if any) was
+        successful."""
+
+        if self._file is not None:
+            self.stream.close()
+            self._file.close()
+
+        if self._proc is not None:
+            if check:
+                # Read anything left (like tar padding), so the decompressor
+                # can finish normally.
+                while self._proc.stdout.read(BUFFER_SIZE):
+                    pass
+            else:
+                # Don't wait on a decompressor that's blocked writing to us.
+                self._proc.kill()
+            self._proc.stdout.close()
+            stderr = self._proc.stderr.read()
+            self._proc.stderr.close()
+            result = self._proc.wait()
+            if check and result != 0:
+                raise ExtractError("Decompressor '{}' failed: {}"
+                                   .format(self.method,
+                                           stderr.decode(errors='replace')))
+
+
+def is_tar(src_path, subtype):
+    """Check whether the given (possibly compressed) file is a tar archive,
+    by decompressing just the first block."""
+
+    try:
+        decomp = _Decompressed(src_path, subtype)
+        try:
+            block = decomp.stream.read(tarfile.BLOCKSIZE)
+        finally:
+            # We don't care about the rest of the file.
+            decomp.close(check=False)
+    except (OSError, EOFError, lzma.LZMAError, ExtractError):
+        return False
+
+    try:
+        tarfile.TarInfo.frombuf(block, tarfile.ENCODING, 'surrogateescape')
+        return True
+    except tarfile.HeaderError:
+        return False
+
+
+def extract_tar(src_path, subtype, dest):
+    """Extract the given tar archive into dest, in a single streaming pass.
+    If the archive consists of a single top level directory, that directory
+    becomes dest.
+    :param str src_path: The archive.
+    :param str subtype: The mime subtype of the archive.
+    :param str dest: Where to extract to. This must not exist.
+    :returns: The stats for the extraction.
+    :rtype: ExtractStats
+    :raises ExtractError: When anything goes wrong.
+    """
+
+    tmp_dir = '{}.extract'.format(dest)
+    top_level = set()
+    extracted = False
+
+    try:
+        with _Decompressed(src_path, subtype) as decomp:
+            stats = ExtractStats(src_path, decomp.method)
+
+            def members(tar):
+                """Note the top level entries as they go by."""
+                for member in tar:
+                    name = member.name
+                    while name.startswith('./'):
+                        name = name[2:]
+                    top_level.add(name.lstrip('/').split('/', 1)[0])
+                    stats.bytes_out += member.size
+                    yield member
+
+            # Clean up after any extraction that died part way through.
+            if os.path.lexists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+            os.mkdir(tmp_dir)
+            with tarfile.open(fileobj=decomp.stream, mode='r|',
+                              bufsize=BUFFER_SIZE) as tar:
+                kwargs = {}
+                if hasattr(tarfile, 'tar_filter'):
+                    kwargs['filter'] = 'tar'
+                tar.extractall(tmp_dir, members=members(tar), **kwargs)
+
+        top_level.discard('')
+        top_level.discard('.')
+        if len(top_level) == 1:
+            top_path = os.path.join(tmp_dir, top_level.pop())
+        else:
+            top_path = None
+
+        if top_path is not None and os.path.isdir(top_path) \
+                and not os.path.islink(top_path):
+            # Make the archive's root directory the build dir.
+            os.rename(top_path, dest)
+            os.rmdir(tmp_dir)
+        else:
+            os.rename(tmp_dir, dest)
+        extracted = True
+    except (OSError, EOFError, lzma.LZMAError, tarfile.TarError) as err:
+        raise ExtractError("Could not extract tarfile '{}' into '{}': {}"
+                           .format(src_path, dest, err))
+    finally:
+        # Don't leave a partial extraction in the way of the next attempt.
+        if not extracted:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    stats.done()
+    return stats
+
+
+def decompress(src_path, subtype, dest_file):
+    """Decompress a (non-archive) compressed file.
+    :param str src_path: The compressed file.
+    :param str subtype: The mime subtype of the file.
+    :param str dest_file: The file to write the decompressed data to.
+    :returns: The stats for the decompression.
+    :rtype: ExtractStats
+    :raises ExtractError: When anything goes wrong.
+    """
+
+    try:
+        with _Decompressed(src_path, subtype) as decomp, \
+                open(dest_file, 'wb') as outfile:
+            stats = ExtractStats(src_path, decomp.method)
+
+            chunk = decomp.stream.read(BUFFER_SIZE)
+            while chunk:
+                outfile.write(chunk)
+                stats.bytes_out += len(chunk)
+                chunk = decomp.stream.read(BUFFER_SIZE)
+    except (OSError, EOFError, lzma.LZMAError) as err:
+        raise ExtractError("Error decompressing compressed file '{}' into "
+                           "'{}': {}".format(src_path, dest_file, err))
+
+    stats.done()
+    return stats
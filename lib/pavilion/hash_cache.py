@@ -0,0 +1,386 @@
+"""A persistent cache of file content hashes, so that large source archives
+and extra files are only hashed once per change, no matter how many tests
+(or Pavilion invocations) use them.
+
+Entries are keyed by the hash algorithm and the file's (realpath, inode,
+size, mtime_ns). Each entry is a small file under '<working_dir>/hash_cache/',
+written atomically (via rename), so the cache can be shared by any number of
+processes and hosts without locking.
+
+Directories are hashed Merkle style: a directory's hash is the hash of the
+names, types and hashes of its entries. A manifest of the (size, mtime_ns,
+digest) of every file in each directory is kept in the cache, so only files
+that changed since the last time are re-read.
+
+Every change to a file gets a new entry, so old entries have to be pruned
+(see prune()). An entry's mtime is when it was last used, give or take
+TOUCH_PERIOD.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import time
+
+LOGGER = logging.getLogger('pav.' + __name__)
+
+# Files modified this recently (in seconds) could be modified again without
+# changing their mtime, so their hashes aren't saved.
+RACY_PERIOD = 2
+
+# How many threads to scan directories and hash files with.
+DIR_WORKERS = 8
+
+# The hash algorithm (as named by hashlib) callers use, unless they say
+# otherwise.
+DEFAULT_ALG = 'sha256'
+
+# Entries (and manifests) are marked as used at most this often (in
+# seconds).
+TOUCH_PERIOD = 24*60*60
+# Entries that haven't been used in this long (in seconds) are pruned, by
+# default.
+PRUNE_AGE = 30*24*60*60
+# Only prune this often (in seconds). The last time is the mtime of this
+# file in the cache directory.
+PRUNE_PERIOD = 24*60*60
+PRUNED_FN = '.pruned'
+
+# Caches by cache directory.
+_CACHES = {}
+
+
+class HashCache:
+    """A persistent file hash cache."""
+
+    def __init__(self, path):
+        """
+        :param str path: The cache directory. It's created as needed.
+        """
+
+        self.path = path
+        # Hashes we've already looked up or computed in this process.
+        self._memo = {}
+
+    @staticmethod
+    def _key(path, alg=DEFAULT_ALG):
+        """Get the cache key for the given file and hash algorithm.
+        :raises OSError: If the file can't be stat'ed.
+        """
+
+        real_path = os.path.realpath(path)
+        file_stat = os.stat(real_path)
+
+        key = '{}\0{}\0{}\0{}\0{}'.format(
+            alg, real_path, file_stat.st_ino, file_stat.st_size,
+            file_stat.st_mtime_ns)
+        return key, file_stat
+
+    @staticmethod
+    def _mark_used(path, file):
+        """Update the mtime of the given (open) cache file, if it hasn't been
+        in a while, so it isn't pruned."""
+
+        try:
+            if time.time() - os.fstat(file.fileno()).st_mtime > TOUCH_PERIOD:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def _entry_path(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name[:2], name)
+
+    def _load(self, entry_path, key):
+        """Read an entry, returning the digest or None."""
+
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                data = entry_file.read()
+                # The entry holds the full key, just to be sure, then the
+                # digest.
+                entry_key, _, digest = data.partition(b'\n')
+                if entry_key != key.encode('utf-8') or not digest:
+                    return None
+                self._mark_used(entry_path, entry_file)
+        except (IOError, OSError):
+            return None
+
+        return bytes.fromhex(digest.decode().strip())
+
+    def _save(self, entry_path, key, digest):
+        tmp_path = '{}.{}.tmp'.format(entry_path, os.getpid())
+
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            with open(tmp_path, 'wb') as entry_file:
+                entry_file.write(key.encode('utf-8') + b'\n' +
+                                 digest.hex().encode() + b'\n')
+            os.rename(tmp_path, entry_path)
+        except (IOError, OSError) as err:
+            LOGGER.warning("Could not save hash cache entry '{}': {}"
+                           .format(entry_path, err))
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def hash_file(self, path, hash_func, alg=DEFAULT_ALG):
+        """Get the hash of the given file, from the cache if possible.
+        :param str path: The file to hash.
+        :param hash_func: A function that takes the path and returns its
+            hash digest (bytes), used when the file isn't in the cache.
+        :param str alg: The (hashlib) name of the algorithm hash_func uses.
+        :returns: The hash digest.
+        """
+
+        key, before = self._key(path, alg)
+
+        if key in self._memo:
+            return self._memo[key]
+
+        entry_path = self._entry_path(key)
+        digest = self._load(entry_path, key)
+
+        if digest is None:
+            digest = hash_func(path)
+
+            # Only save the hash if the file didn't change while we hashed it,
+            # and isn't so new that it could change without its mtime
+            # changing.
+            after_key, _ = self._key(path, alg)
+            racy = time.time() - before.st_mtime < RACY_PERIOD
+            if after_key != key:
+                return digest
+            elif not racy:
+                self._save(entry_path, key, digest)
+
+        self._memo[key] = digest
+        return digest
+
+    def add(self, path, digest, alg=DEFAULT_ALG):
+        """Record the hash of a file that was computed some other way (like
+        while it was downloaded). Files too new to be safely saved are only
+        remembered by this process.
+        :param str path: The file.
+        :param bytes digest: Its hash digest.
+        :param str alg: The (hashlib) name of the algorithm digest is from.
+        """
+
+        key, file_stat = self._key(path, alg)
+        self._memo[key] = digest
+
+        if time.time() - file_stat.st_mtime >= RACY_PERIOD:
+            self._save(self._entry_path(key), key, digest)
+
+    def _manifest_path(self, dir_path, alg):
+        name = hashlib.sha256('{}\0{}'.format(alg, dir_path)
+                              .encode('utf-8')).hexdigest()
+        return os.path.join(self.path, 'manifests', name[:2], name)
+
+    def _load_manifest(self, dir_path, alg):
+        """Load the manifest for the given (real) directory path.
+        :returns: A dict of file name -> [size, mtime_ns, hex digest].
+        """
+
+        manifest_path = self._manifest_path(dir_path, alg)
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+                self._mark_used(manifest_path, manifest_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        if (not isinstance(manifest, dict) or
+                manifest.get('path') != dir_path or
+                manifest.get('alg') != alg):
+            return {}
+
+        return manifest.get('files', {})
+
+    def _save_manifest(self, dir_path, alg, files):
+        manifest_path = self._manifest_path(dir_path, alg)
+        tmp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+
+        try:
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            with open(tmp_path, 'w') as manifest_file:
+                json.dump({'path': dir_path, 'alg': alg, 'files': files},
+                          manifest_file)
+            os.rename(tmp_path, manifest_path)
+        except (IOError, OSError) as err:
+            LOGGER.warning("Could not save directory manifest '{}': {}"
+                           .format(manifest_path, err))
+
+    @staticmethod
+    def _scan(dir_path):
+        """List a directory's entries.
+        :returns: A sorted list of (name, kind, stat, link target) tuples,
+            where kind is 'd', 'f' or 'l'. Stat is only given for files, and
+            the link target only for symlinks. Other file types are skipped.
+        """
+
+        entries = []
+        with os.scandir(dir_path) as scan:
+            for entry in scan:
+                if entry.is_symlink():
+                    entries.append((entry.name, 'l', None,
+                                    os.readlink(entry.path)))
+                elif entry.is_dir():
+                    entries.append((entry.name, 'd', None, None))
+                elif entry.is_file():
+                    entries.append((entry.name, 'f', entry.stat(), None))
+
+        entries.sort()
+        return entries
+
+    def hash_dir(self, path, hash_func, max_workers=DIR_WORKERS,
+                 alg=DEFAULT_ALG):
+        """Hash a directory tree by its contents. Symlinks are hashed by
+        their target, not followed.
+        :param str path: The directory to hash.
+        :param hash_func: A function that takes a file path and returns its
+            hash digest (bytes), used for files that changed.
+        :param str alg: The (hashlib) name of the algorithm hash_func uses.
+            The tree is hashed with it as well.
+        :param int max_workers: The maximum number of threads to scan
+            directories and hash files with.
+        :returns: The hash digest of the tree.
+        :raises OSError: If the tree can't be read.
+        """
+
+        root = os.path.realpath(path)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # Scan the tree a level at a time, scanning every directory at
+            # each level in parallel.
+            scans = {}
+            level = [root]
+            while level:
+                level_scans = dict(zip(level, pool.map(self._scan, level)))
+                scans.update(level_scans)
+                level = [os.path.join(dir_path, name)
+                         for dir_path, entries in level_scans.items()
+                         for name, kind, _, _ in entries if kind == 'd']
+
+            # Figure out which files need to be (re)hashed.
+            manifests = {}
+            to_hash = []
+            for dir_path, entries in scans.items():
+                old_files = self._load_manifest(dir_path, alg)
+                files = {}
+                for name, kind, file_stat, _ in entries:
+                    if kind != 'f':
+                        continue
+
+                    old = old_files.get(name)
+                    if old is not None and old[:2] == [file_stat.st_size,
+                                                       file_stat.st_mtime_ns]:
+                        files[name] = old
+                    else:
+                        to_hash.append((dir_path, name, file_stat))
+
+                manifests[dir_path] = (old_files, files)
+
+            file_paths = [os.path.join(d, n) for d, n, _ in to_hash]
+            digests = pool.map(hash_func, file_paths)
+
+            now = time.time()
+            for (dir_path, name, file_stat), digest in zip(to_hash, digests):
+                entry = [file_stat.st_size, file_stat.st_mtime_ns, digest.hex()]
+                manifests[dir_path][1][name] = entry
+                if now - file_stat.st_mtime < RACY_PERIOD:
+                    # Mark it so it's never matched when loaded again.
+                    entry[1] = None
+
+        # Compute the directory hashes from the bottom up, and save any
+        # manifests that changed.
+        dir_digests = {}
+        for dir_path in sorted(scans.keys(), key=lambda p: p.count(os.sep),
+                               reverse=True):
+            old_files, files = manifests[dir_path]
+            if old_files != files:
+                self._save_manifest(dir_path, alg, files)
+
+            hash_obj = hashlib.new(alg)
+            for name, kind, _, link in scans[dir_path]:
+                if kind == 'f':
+                    digest = bytes.fromhex(files[name][2])
+                elif kind == 'd':
+                    digest = dir_digests[os.path.join(dir_path, name)]
+                else:
+                    digest = hashlib.new(alg, link.encode('utf-8')).digest()
+
+                hash_obj.update(kind.encode() + name.encode('utf-8') + b'\0' +
+                                digest)
+
+            dir_digests[dir_path] = hash_obj.digest()
+
+        return dir_digests[root]
+
+    def prune(self, max_age=PRUNE_AGE, force=False):
+        """Remove the entries and manifests that haven't been used in
+        max_age seconds (and any temp files left behind). Unless forced,
+        this only happens once every PRUNE_PERIOD.
+        :param float max_age: The age (in seconds) to prune at.
+        :param bool force: Prune even if we did so recently.
+        :returns: The number of files removed.
+        """
+
+        if not os.path.isdir(self.path):
+            return 0
+
+        stamp_path = os.path.join(self.path, PRUNED_FN)
+        now = time.time()
+        try:
+            if not force and now - os.stat(stamp_path).st_mtime < PRUNE_PERIOD:
+                return 0
+        except FileNotFoundError:
+            pass
+
+        try:
+            # Mark this first, so others don't prune at the same time.
+            with open(stamp_path, 'a'):
+                pass
+            os.utime(stamp_path)
+        except OSError as err:
+            LOGGER.warning("Could not prune the hash cache '{}': {}"
+                           .format(self.path, err))
+            return 0
+
+        removed = 0
+        for base_path in self.path, os.path.join(self.path, 'manifests'):
+            try:
+                with os.scandir(base_path) as scan:
+                    shards = [entry.path for entry in scan
+                              if len(entry.name) == 2 and entry.is_dir()]
+            except OSError:
+                continue
+
+            for shard in shards:
+                try:
+                    with os.scandir(shard) as scan:
+                        for entry in scan:
+                            try:
+                                if now - entry.stat().st_mtime > max_age:
+                                    os.unlink(entry.path)
+                                    removed += 1
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
+
+        return removed
+
+
+def get_cache(working_dir):
+    """Get the hash cache for the given working directory."""
+
+    path = os.path.join(working_dir, 'hash_cache')
+
+    if path not in _CACHES:
+        _CACHES[path] = HashCache(path)
+
+    return _CACHES[path]
@@ -1,6 +1,12 @@
+import atexit
+import fcntl
+import getpass
 import grp
+import json
 import logging
 import os
+import signal
+import threading
 import time
 import uuid
 
@@ -10,6 +16,229 @@ LOGGER = logging.getLogger('pav.' + __name__)
 # Expires after a silly long time.
 NEVER = 10**10
 
+# Lock backends.
+# The original O_EXCL lockfile protocol. This works on just about any
+# filesystem (including old NFS), but waiting on a lock means sleep-polling.
+BACKEND_FILE = 'file'
+# Kernel (flock) locks on the lockfile. Waiters block in the kernel and are
+# woken as soon as the lock is released. Falls back to the 'file' backend
+# on filesystems that don't support flock. All processes sharing a lock must
+# use the same backend.
+BACKEND_FLOCK = 'flock'
+BACKENDS = (BACKEND_FILE, BACKEND_FLOCK)
+
+_DEFAULT_BACKEND = BACKEND_FILE
+
+
+def set_default_backend(backend):
+    """Set the lock backend used by locks that don't specify one. This is
+    normally set once, from the pavilion config.
+    :param str backend: One of BACKENDS.
+    """
+
+    global _DEFAULT_BACKEND
+
+    if backend not in BACKENDS:
+        raise ValueError("Invalid lock backend '{}'. Must be one of {}"
+                         .format(backend, BACKENDS))
+
+    _DEFAULT_BACKEND = backend
+
+
+# Whether flock works, by filesystem device id.
+_FLOCK_SUPPORT = {}
+
+
+def _flock_supported(path):
+    """Check (once per filesystem) whether flock works in the directory of
+    the given path.
+    :param str path: The path to the lock file.
+    :rtype: bool
+    """
+
+    lock_dir = os.path.dirname(os.path.abspath(path))
+    dev = os.stat(lock_dir).st_dev
+
+    if dev not in _FLOCK_SUPPORT:
+        probe_path = os.path.join(lock_dir, '.flock_probe.{}.{}'
+                                  .format(os.uname()[1], os.getpid()))
+        fd = os.open(probe_path, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            _FLOCK_SUPPORT[dev] = True
+        except OSError as err:
+            LOGGER.warning("Filesystem at '{}' doesn't support flock, "
+                           "falling back to file locks: {}"
+                           .format(lock_dir, err))
+            _FLOCK_SUPPORT[dev] = False
+        finally:
+            os.close(fd)
+            os.unlink(probe_path)
+
+    return _FLOCK_SUPPORT[dev]
+
+
+# Locks held by (or being waited on within) this process, by path. The flock
+# backend needs these, as flock over NFS won't block other locks from
+# within the same process.
+_LOCAL_LOCKS = {}
+_LOCAL_LOCKS_LOCK = threading.Lock()
+
+
+def _local_lock(path):
+    """Get the in-process lock for the given lock path."""
+
+    with _LOCAL_LOCKS_LOCK:
+        if path not in _LOCAL_LOCKS:
+            _LOCAL_LOCKS[path] = threading.Lock()
+        return _LOCAL_LOCKS[path]
+
+
+# Lock statistics. When enabled, every lock acquisition (or timeout) is
+# recorded in a per-process buffer, which is periodically appended to a
+# shared JSONL file. Each record has the lock path, backend, host, pid, when
+# we started waiting, the wait and hold times (seconds), how many extra
+# attempts we made, whether we broke an expired lock, and whether the lock
+# was acquired at all.
+STATS_FN = 'lock_stats.jsonl'
+
+_STATS_PATH = None
+_STATS_BUFFER = []
+_STATS_LOCK = threading.Lock()
+# Flush the buffer after this many records.
+STATS_BUFFER_MAX = 64
+
+
+def enable_stats(path):
+    """Start recording lock statistics to the given JSONL file.
+    :param str path: The stats file. It will be appended to.
+    """
+
+    global _STATS_PATH
+
+    if _STATS_PATH is None:
+        atexit.register(flush_stats)
+
+    _STATS_PATH = path
+
+
+def disable_stats():
+    """Flush and stop recording lock statistics."""
+
+    global _STATS_PATH
+
+    flush_stats()
+    _STATS_PATH = None
+
+
+def _record_stats(record):
+    """Add a record to the stats buffer, flushing it if it's full."""
+
+    with _STATS_LOCK:
+        _STATS_BUFFER.append(record)
+        full = len(_STATS_BUFFER) >= STATS_BUFFER_MAX
+
+    if full:
+        flush_stats()
+
+
+def flush_stats():
+    """Append all buffered lock statistics to the stats file. Like status
+    files, this relies on small appends being atomic, so it doesn't need a
+    lock of its own. Errors are only logged."""
+
+    with _STATS_LOCK:
+        if _STATS_PATH is None or not _STATS_BUFFER:
+            return
+
+        data = ''.join(json.dumps(rec) + '\n' for rec in _STATS_BUFFER)
+        del _STATS_BUFFER[:]
+
+        try:
+            fd = os.open(_STATS_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+            try:
+                os.write(fd, data.encode('utf8'))
+            finally:
+                os.close(fd)
+        except OSError as err:
+            LOGGER.warning("Could not write lock stats to '{}': {}"
+                           .format(_STATS_PATH, err))
+
+
+def load_stats(path):
+    """Read lock statistics records from the given file. Bad lines are
+    skipped.
+    :param str path: The stats file.
+    :rtype: list
+    :raises OSError: When the file can't be read.
+    """
+
+    records = []
+    with open(path) as stats_file:
+        for line in stats_file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return records
+
+
+# The upper bounds of each wait time histogram bucket, in seconds.
+STATS_BUCKETS = (0.001, 0.01, 0.1, 1, 10, float('inf'))
+
+
+def summarize_stats(records):
+    """Aggregate lock statistics records by lock path.
+    :param list records: Records, as from load_stats().
+    :returns: A dictionary by lock path of summary dicts. Each has the
+        'count' of attempts, 'timeouts', 'total_wait', 'mean_wait',
+        'median_wait', 'max_wait', 'total_hold', 'mean_hold', 'retries',
+        'expired_broken', and 'histogram', a list of wait time counts for each
+        of the STATS_BUCKETS.
+    """
+
+    by_path = {}
+    for rec in records:
+        by_path.setdefault(rec['path'], []).append(rec)
+
+    summaries = {}
+    for path, recs in by_path.items():
+        waits = sorted(rec['wait'] for rec in recs)
+        holds = [rec['hold'] for rec in recs if rec.get('hold') is not None]
+
+        histogram = [0] * len(STATS_BUCKETS)
+        for wait in waits:
+            for i, bound in enumerate(STATS_BUCKETS):
+                if wait < bound:
+                    histogram[i] += 1
+                    break
+
+        summaries[path] = {
+            'count': len(recs),
+            'timeouts': sum(1 for rec in recs if not rec['acquired']),
+            'total_wait': sum(waits),
+            'mean_wait': sum(waits)/len(waits),
+            'median_wait': waits[len(waits)//2],
+            'max_wait': waits[-1],
+            'total_hold': sum(holds),
+            'mean_hold': sum(holds)/len(holds) if holds else 0,
+            'retries': sum(rec['retries'] for rec in recs),
+            'expired_broken': sum(1 for rec in recs if rec['broke_expired']),
+            'histogram': histogram,
+        }
+
+    return summaries
+
+
+class _WaitTimeout(Exception):
+    """Raised by our SIGALRM handler to interrupt a blocking flock."""
+    pass
+
+
+def _alarm_handler(signum, frame):
+    raise _WaitTimeout()
+
 
 class TimeoutError(RuntimeError):
     """Error raised when the lockfile times out."""
@@ -19,6 +248,7 @@ class TimeoutError(RuntimeError):
 class LockFile(object):
     """An NFS friendly way to create a lock file. Locks contain information on what host and user
     created the lock, and have a built in expiration date. To be used in a 'with' context.
+    Locks with the flock backend never expire; the kernel releases them if the holder dies.
     :cvar DEFAULT_EXPIRE: How long it takes for a lock to expire."""
 
     # Time till file is considered stale, in seconds. (5 minute default)
@@ -32,7 +262,8 @@ class LockFile(object):
     # Default lock permissions
     LOCK_PERMS = 0o774
 
-    def __init__(self, lockfile_path, group=None, timeout=None, expires_after=DEFAULT_EXPIRE):
+    def __init__(self, lockfile_path, group=None, timeout=None, expires_after=DEFAULT_EXPIRE,
+                 backend=None):
         """Initialize the lock file. The resulting class can be reused multiple times.
         :param unicode lockfile_path: The path to the lockfile. Should probably start with a '.',
         and end with '.lock', but that's up to the user.
@@ -41,9 +272,20 @@ class LockFile(object):
         non-blocking mode.
         :param expires_after: When to consider the lock dead, and overwritable (in seconds). The
         NEVER module variable is provided as easily named long time. (10^10 secs, 317 years)
+        :param str backend: The lock backend to use (one of BACKENDS). Defaults to the backend
+        set with set_default_backend().
         """
 
+        if backend is None:
+            backend = _DEFAULT_BACKEND
+        elif backend not in BACKENDS:
+            raise ValueError("Invalid lock backend '{}'. Must be one of {}"
+                             .format(backend, BACKENDS))
+
         self._lock_path = lockfile_path
+        self._backend = backend
+        # The open lockfile, when held with the flock backend.
+        self._fd = None
         self._timeout = timeout
         self._expire_period = expires_after
         self._group = None
@@ -60,12 +302,42 @@ class LockFile(object):
 
         self._id = str(uuid.uuid4())
 
+        # Stats for the current/last acquisition.
+        self._retries = 0
+        self._broke_expired = False
+        self._acquired_at = None
+        self._wait = None
+
     def __enter__(self):
         """Try to create and lock the lockfile."""
 
         if self._open:
             raise RuntimeError("Trying to open a lock multiple times.")
 
+        self._retries = 0
+        self._broke_expired = False
+        start = time.time()
+
+        try:
+            if self._backend == BACKEND_FLOCK and _flock_supported(self._lock_path):
+                self._acquire_flock()
+            else:
+                self._acquire_file()
+        except TimeoutError:
+            if _STATS_PATH is not None:
+                self._record_stats(start, time.time() - start, None, False)
+            raise
+
+        self._acquired_at = time.time()
+        self._wait = self._acquired_at - start
+        self._open = True
+
+        return self
+
+    def _acquire_file(self):
+        """Acquire the lock using the O_EXCL lockfile protocol.
+        :raises TimeoutError: When we can't get the lock in time."""
+
         start = time.time()
         acquired = False
         expires = None
@@ -85,6 +357,8 @@ class LockFile(object):
                 if self._timeout is None:
                     raise TimeoutError("Could not acquire lock (non-blocking).")
 
+                self._retries += 1
+
                 if expires is None:
                     _, _, expires, _ = self.read_lockfile()
 
@@ -95,9 +369,11 @@ class LockFile(object):
                     # The file is expired. Try to delete it.
                     try:
 
-                        with LockFile(self._lock_path + '.expired', expires_after=NEVER):
+                        with LockFile(self._lock_path + '.expired', expires_after=NEVER,
+                                      backend=BACKEND_FILE):
                             try:
                                 os.unlink(self._lock_path)
+                                self._broke_expired = True
                             except OSError:
                                 pass
                     except TimeoutError:
@@ -111,7 +387,111 @@ class LockFile(object):
         if not acquired:
             raise TimeoutError("Lock on file '{}' could not be acquired.".format(self._lock_path))
 
-        return self
+    def _acquire_flock(self):
+        """Acquire the lock by holding a kernel lock on the lockfile. The lockfile is deleted
+        on release (so its existence still means the lock is held), so after getting the kernel
+        lock we have to make sure the file we locked is still the lockfile.
+        :raises TimeoutError: When we can't get the lock in time."""
+
+        deadline = None if self._timeout is None else time.time() + self._timeout
+
+        local_lock = _local_lock(self._lock_path)
+        if deadline is None:
+            got_local = local_lock.acquire(blocking=False)
+        else:
+            got_local = local_lock.acquire(timeout=max(self._timeout, 0))
+
+        if not got_local:
+            raise TimeoutError("Lock on file '{}' could not be acquired (held within this "
+                               "process).".format(self._lock_path))
+
+        try:
+            while True:
+                fd = os.open(self._lock_path, os.O_CREAT | os.O_RDWR, self.LOCK_PERMS)
+
+                try:
+                    self._flock(fd, deadline)
+
+                    try:
+                        path_stat = os.stat(self._lock_path)
+                    except FileNotFoundError:
+                        path_stat = None
+                    fd_stat = os.fstat(fd)
+                except BaseException:
+                    os.close(fd)
+                    raise
+
+                if (path_stat is None or
+                        (path_stat.st_dev, path_stat.st_ino) != (fd_stat.st_dev, fd_stat.st_ino)):
+                    # The previous holder deleted the file we were waiting on. Try again.
+                    os.close(fd)
+                    self._retries += 1
+                    continue
+
+                break
+
+            # Fill out the lockfile so it looks just like one from the file backend.
+            os.ftruncate(fd, 0)
+            os.write(fd, self._lock_note(NEVER, self._id))
+            self._set_perms(self._lock_path, self._group)
+        except BaseException:
+            local_lock.release()
+            raise
+
+        self._fd = fd
+
+    def _flock(self, fd, deadline):
+        """Get an exclusive flock on fd, waiting until the deadline.
+        :param int fd: The open lockfile.
+        :param float deadline: When to give up (None for non-blocking).
+        :raises TimeoutError: When the deadline passes.
+        """
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            if deadline is None:
+                raise TimeoutError("Could not acquire lock (non-blocking).")
+
+        self._retries += 1
+
+        # Only the main thread can be interrupted by an alarm, and we shouldn't clobber any
+        # alarm that's already set.
+        use_alarm = (threading.current_thread() is threading.main_thread() and
+                     signal.getitimer(signal.ITIMER_REAL)[0] == 0)
+
+        if use_alarm:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError("Lock on file '{}' could not be acquired."
+                                   .format(self._lock_path))
+
+            old_handler = signal.signal(signal.SIGALRM, _alarm_handler)
+            try:
+                signal.setitimer(signal.ITIMER_REAL, remaining)
+                # Block in the kernel until the lock is released or the alarm goes off.
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except _WaitTimeout:
+                raise TimeoutError("Lock on file '{}' could not be acquired."
+                                   .format(self._lock_path))
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, old_handler)
+        else:
+            # Poll, but with a short, growing sleep rather than a full SLEEP_PERIOD.
+            sleep = 0.001
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return
+                except BlockingIOError:
+                    if time.time() >= deadline:
+                        raise TimeoutError("Lock on file '{}' could not be acquired."
+                                           .format(self._lock_path))
+                time.sleep(min(sleep, max(deadline - time.time(), 0)))
+                sleep = min(sleep * 2, self.SLEEP_PERIOD)
+                self._retries += 1
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Delete the lockfile, thereby releasing the lock.
@@ -138,6 +518,49 @@ class LockFile(object):
                     LOGGER.error("Lockfile '{}' mysteriously disappeared."
                                  .format(self._lock_path))
 
+        if self._fd is not None:
+            # Closing the file releases the kernel lock. This has to happen after the unlink,
+            # so that waiters notice the file they were waiting on is gone.
+            os.close(self._fd)
+            self._fd = None
+            _local_lock(self._lock_path).release()
+
+        self._open = False
+
+        if _STATS_PATH is not None:
+            released = time.time()
+            self._record_stats(self._acquired_at - self._wait, self._wait,
+                               released - self._acquired_at, True)
+
+    def _record_stats(self, start, wait, hold, acquired):
+        """Record the stats for an acquisition attempt of this lock."""
+
+        _record_stats({
+            'path': self._lock_path,
+            'backend': self._backend,
+            'host': os.uname()[1],
+            'pid': os.getpid(),
+            'start': start,
+            'wait': wait,
+            'hold': hold,
+            'retries': self._retries,
+            'broke_expired': self._broke_expired,
+            'acquired': acquired,
+        })
+
+    @staticmethod
+    def _lock_note(expires, lock_id):
+        """Get the contents of a lockfile.
+        :param int expires: How far in the future the lockfile expires.
+        :param str lock_id: The unique identifier for this lockfile.
+        :rtype: bytes
+        """
+
+        expiration = time.time() + expires
+        # os.getlogin() fails for processes without a controlling terminal (like batch jobs).
+        file_note = ",".join([os.uname()[1], getpass.getuser(), str(expiration), lock_id])
+        return file_note.encode('utf8')
+
     @classmethod
     def _create_lockfile(cls, path, expires, lock_id, group_id=None):
         """Create and fill out a lockfile at the given path.
@@ -152,12 +575,16 @@ class LockFile(object):
         # the standard mechanisms for testing purposes.
 
         fd = os.open(path, os.O_EXCL | os.O_CREAT | os.O_RDWR)
-        expiration = time.time() + expires
-        file_note = ",".join([os.uname()[1], os.getlogin(), str(expiration), lock_id])
-        file_note = file_note.encode('utf8')
-        os.write(fd, file_note)
+        os.write(fd, cls._lock_note(expires, lock_id))
         os.close(fd)
 
+        cls._set_perms(path, group_id)
+
+    @classmethod
+    def _set_perms(cls, path, group_id):
+        """Set the permissions and (optionally) group of the given lockfile. Failures are only
+        logged."""
+
         try:
             os.chmod(path, cls.LOCK_PERMS)
         except OSError as err:
@@ -0,0 +1,284 @@
+"""Bounded, optionally compressed, log files for build and run output.
+
+A LogSink keeps the first 'head' bytes of the output and the last 'tail'
+bytes (in a ring buffer), and drops everything in between, leaving a note
+of how much was dropped. It can also gzip the log as it's written, in
+which case the log is '<path>.gz'. Either way, the total byte and line
+counts of the output are recorded in '<path>.summary' (as json).
+
+The tail is only added to the log when the sink is closed. Until then, each
+flush() saves it (along with the note and summary) to '<path>.tail', so
+that it isn't lost if the process is killed before it can close the log.
+
+Log readers should use open_log(), which reads compressed and plain logs
+alike, includes any '.tail' left behind, and reads compressed logs that were
+never finished as far as they go.
+"""
+
+import gzip
+import io
+import json
+import os
+
+# The gzip level for compressed logs. Logs compress well even at the
+# lowest levels, and speed matters more here.
+COMPRESS_LEVEL = 1
+
+COMPRESSED_EXT = '.gz'
+SUMMARY_EXT = '.summary'
+TAIL_EXT = '.tail'
+
+OMITTED_MSG = '\n[pav: {bytes} bytes ({lines} lines) of output omitted]\n'
+
+
+class LogSink:
+    """A file-like object for writing (binary) log output."""
+
+    def __init__(self, path, compress=False, head=0, tail=0):
+        """
+        :param str path: The log path (without any compression extension).
+        :param bool compress: Whether to gzip the log.
+        :param int head: Bytes of output to keep from the start.
+        :param int tail: Bytes of output to keep from the end. If both head
+            and tail are zero, everything is kept.
+        """
+
+        self.path = path
+        self.bounded = bool(head or tail)
+        self.head = head
+        self.tail = tail
+
+        if compress:
+            self.log_path = path + COMPRESSED_EXT
+            self._file = gzip.open(self.log_path, 'wb',
+                                   compresslevel=COMPRESS_LEVEL)
+        else:
+            self.log_path = path
+            self._file = open(path, 'wb')
+
+        self.total_bytes = 0
+        self.total_lines = 0
+        self._head_written = 0
+        self._tail = bytearray()
+        self._omitted_bytes = 0
+        self._omitted_lines = 0
+        # Whether the tail has changed since it was last saved.
+        self._tail_dirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data):
+        """Write the given bytes to the log."""
+
+        size = len(data)
+        self.total_bytes += size
+        self.total_lines += data.count(b'\n')
+
+        if not self.bounded:
+            self._file.write(data)
+            return size
+
+        if self._head_written < self.head:
+            head_part = data[:self.head - self._head_written]
+            self._file.write(head_part)
+            self._head_written += len(head_part)
+            data = data[len(head_part):]
+
+        if data:
+            self._tail.extend(data)
+            self._tail_dirty = True
+            # Trim the tail buffer in batches, rather than on every write.
+            if len(self._tail) > 2*self.tail + 4096:
+                self._drop(len(self._tail) - self.tail)
+
+        return size
+
+    def _drop(self, size):
+        """Drop size bytes from the front of the tail buffer."""
+
+        self._omitted_bytes += size
+        self._omitted_lines += self._tail.count(b'\n', 0, size)
+        del self._tail[:size]
+
+    def flush(self):
+        """Flush the log, and save the current tail to '<path>.tail'."""
+
+        self._file.flush()
+
+        if self._tail_dirty:
+            self._save_tail()
+
+    def _tail_data(self):
+        """Get the omission note (if any) and the tail, as they should
+        appear at the end of the log."""
+
+        if len(self._tail) > self.tail:
+            self._drop(len(self._tail) - self.tail)
+
+        data = bytearray()
+        if self._omitted_bytes:
+            data.extend(OMITTED_MSG.format(
+                bytes=self._omitted_bytes,
+                lines=self._omitted_lines).encode())
+        data.extend(self._tail)
+        return data
+
+    def _save_tail(self):
+        """Atomically replace '<path>.tail' with the current tail, and
+        update the summary."""
+
+        tail_path = self.path + TAIL_EXT
+        tmp_path = tail_path + '.tmp'
+        with open(tmp_path, 'wb') as tail_file:
+            tail_file.write(self._tail_data())
+        os.rename(tmp_path, tail_path)
+        self._tail_dirty = False
+
+        self._write_summary()
+
+    def close(self):
+        """Write the tail and the summary, and close the log."""
+
+        if self._file.closed:
+            return
+
+        self._file.write(self._tail_data())
+        self._tail = bytearray()
+        self._file.close()
+
+        self._write_summary()
+
+        try:
+            os.unlink(self.path + TAIL_EXT)
+        except FileNotFoundError:
+            pass
+
+    def _write_summary(self):
+        """Write the byte and line counts so far to '<path>.summary'."""
+
+        summary = {
+            'log': os.path.basename(self.log_path),
+            'bytes': self.total_bytes,
+            'lines': self.total_lines,
+            'omitted_bytes': self._omitted_bytes,
+            'omitted_lines': self._omitted_lines,
+        }
+        with open(self.path + SUMMARY_EXT, 'w') as summary_file:
+            json.dump(summary, summary_file)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+
+def from_config(pav_cfg, path):
+    """Create a log sink for path, according to the pavilion config's
+    'log_compress', 'log_head_size' and 'log_tail_size' (KiB)."""
+
+    return LogSink(path,
+                   compress=pav_cfg.log_compress == 'true',
+                   head=pav_cfg.log_head_size*1024,
+                   tail=pav_cfg.log_tail_size*1024)
+
+
+def find_log(path):
+    """Find the actual log file for the given log path, which may have been
+    compressed.
+    :returns: The path, or None if there's no such log.
+    """
+
+    for log_path in path, path + COMPRESSED_EXT:
+        if os.path.exists(log_path):
+            return log_path
+
+    return None
+
+
+class _LogReader(io.RawIOBase):
+    """Reads a series of (binary) files as one. Compressed files that were
+    never finished (because the process writing them was killed) end where
+    their data does, rather than raising an EOFError."""
+
+    def __init__(self, files):
+        super().__init__()
+        self._files = list(files)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._files:
+            try:
+                # A single read1() of a gzip file only raises EOFError once
+                # all of the data it could decompress has been returned.
+                data = self._files[0].read1(len(buffer))
+            except EOFError:
+                data = b''
+
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+
+            self._files.pop(0).close()
+
+        return 0
+
+    def close(self):
+        for file in self._files:
+            file.close()
+        self._files = []
+        super().close()
+
+
+def open_log(path, mode='r'):
+    """Open the log at path for reading, whether it was compressed or not.
+    If the log was never closed, the tail saved alongside it is included.
+    :param str path: The log path, with or without the compression extension.
+    :param str mode: 'r' for text, 'rb' for bytes.
+    :raises OSError: When the log doesn't exist or can't be opened.
+    """
+
+    log_path = find_log(path)
+    if log_path is None:
+        raise FileNotFoundError("No such log file: '{}'".format(path))
+
+    compressed = log_path.endswith(COMPRESSED_EXT)
+    tail_path = log_path[:-len(COMPRESSED_EXT)] if compressed else log_path
+    tail_path += TAIL_EXT
+
+    files = []
+    try:
+        if compressed:
+            files.append(gzip.GzipFile(log_path, 'rb'))
+        else:
+            files.append(open(log_path, 'rb'))
+
+        try:
+            files.append(open(tail_path, 'rb'))
+        except FileNotFoundError:
+            pass
+    except OSError:
+        for file in files:
+            file.close()
+        raise
+
+    log_file = io.BufferedReader(_LogReader(files))
+    if mode == 'r':
+        return io.TextIOWrapper(log_file)
+    return log_file
+
+
+def summary(path):
+    """Get the byte and line counts for the log at path.
+    :returns: The summary dict, or None if there isn't one.
+    """
+
+    try:
+        with open(path + SUMMARY_EXT) as summary_file:
+            return json.load(summary_file)
+    except (IOError, OSError, ValueError):
+        return None
@@ -1,10 +1,10 @@
 from yapsy import PluginManager
+from pavilion import config_index
 from pavilion.module_wrapper import ModuleWrapper
 from pavilion.commands import Command
 from pavilion.system_variables import SystemPlugin as System
 from pavilion.schedulers import SchedulerPlugin
 from pavilion.result_parsers import ResultParser
-import os
 import logging
 
 LOGGER = logging.getLogger('plugins')
@@ -42,13 +42,16 @@ def initialize_plugins(pav_cfg):
         LOGGER.warning("Tried to initialize plugins multiple times.")
         return
 
-    plugin_dirs = [os.path.join(cfg_dir, 'plugins')
-                   for cfg_dir in pav_cfg.config_dirs]
+    # Only the directories that actually have plugins in them (according to
+    # the config index) are given to yapsy, so it doesn't need to walk the
+    # plugin directory trees itself.
+    plugin_dirs = config_index.get_index(pav_cfg).plugin_dirs
 
     try:
         pman = PluginManager.PluginManager(directories_list=plugin_dirs,
                                            categories_filter=PLUGIN_CATEGORIES)
 
+        pman.getPluginLocator().disableRecursiveScan()
         pman.locatePlugins()
         pman.collectPlugins()
     except Exception as err:
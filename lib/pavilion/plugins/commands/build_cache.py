@@ -0,0 +1,71 @@
+from pavilion import build_cache
+from pavilion import commands
+import datetime
+
+
+class BuildCacheCommand(commands.Command):
+
+    def __init__(self):
+
+        super().__init__('build_cache', 'Show the builds in the working '
+                                        'directory build cache, and evict '
+                                        'old builds.')
+
+    def _setup_arguments(self, parser):
+
+        parser.add_argument(
+            '--evict', action='store_true', default=False,
+            help="Evict builds until the cache is within the limits set by "
+                 "'build_cache_max_size' and 'build_cache_max_age' in the "
+                 "pavilion config. This also happens automatically at the "
+                 "start of 'pav run'.")
+        parser.add_argument(
+            '--dry-run', action='store_true', default=False,
+            help='With --evict, only show what would be evicted.')
+
+    def run(self, pav_config, args):
+
+        cache = build_cache.BuildCache(pav_config)
+
+        if args.evict:
+            if not cache.limited:
+                msg = "No build cache limits are set in the pavilion config."
+                self.logger.error(msg)
+                raise commands.CommandError(msg)
+
+            evicted = cache.evict(dry_run=args.dry_run)
+            action = 'Would evict' if args.dry_run else 'Evicted'
+            for build in evicted:
+                name = 'src:' + build.name if build.source else build.name
+                print("{} {} ({:.1f} MiB)"
+                      .format(action, name, build.size/1024**2))
+            print("{} {} builds, {:.1f} MiB total."
+                  .format(action, len(evicted),
+                          sum(b.size for b in evicted)/1024**2))
+            return 0
+
+        builds = cache.builds()
+        sources = cache.sources()
+        used = cache.in_use()
+
+        print("{:32s} {:>10s} {:19s} {}"
+              .format('build', 'size(MiB)', 'last used', 'in use'))
+        for build in builds:
+            last_used = datetime.datetime.fromtimestamp(build.last_used)
+            print("{:32s} {:10.1f} {:19s} {}"
+                  .format(build.name, build.size/1024**2,
+                          last_used.strftime('%Y-%m-%d %H:%M:%S'),
+                          'yes' if build.name in used else ''))
+        for source in sources:
+            last_used = datetime.datetime.fromtimestamp(source.last_used)
+            print("{:32s} {:10.1f} {:19s}"
+                  .format('src:' + source.name[:28], source.size/1024**2,
+                          last_used.strftime('%Y-%m-%d %H:%M:%S')))
+
+        total = sum(build.size for build in builds + sources)
+        print("{} builds, {} cached sources, {:.1f} MiB total."
+              .format(len(builds), len(sources), total/1024**2))
+        if cache.max_size:
+            print("Limit: {:.1f} MiB".format(cache.max_size/1024**2))
+
+        return 0
@@ -0,0 +1,71 @@
+from pavilion import commands
+from pavilion import utils
+from pavilion.lockfile import TimeoutError
+import os
+
+
+class LayoutCommand(commands.Command):
+
+    def __init__(self):
+
+        super().__init__('layout', 'Convert the working directory between '
+                                   'the flat and sharded layouts.')
+
+    def _setup_arguments(self, parser):
+
+        parser.add_argument(
+            'layout', choices=utils.LAYOUTS,
+            help="The layout to convert to. In the 'sharded' layout, test, "
+                 "suite, and build directories are spread across fan-out "
+                 "sub-directories rather than kept in one huge directory. "
+                 "No other Pavilion commands should be running against "
+                 "the working directory while this runs.")
+
+    def run(self, pav_config, args):
+        """Convert the tests, suites and builds directories in place, and fix
+        any symlinks that pointed to their old locations."""
+
+        working_dir = os.path.realpath(pav_config.working_dir)
+        tests_dir = os.path.join(working_dir, 'tests')
+        suites_dir = os.path.join(working_dir, 'suites')
+        builds_dir = os.path.join(working_dir, 'builds')
+
+        moved = {}
+        try:
+            for id_dir in tests_dir, suites_dir:
+                if os.path.isdir(id_dir):
+                    moved.update(utils.convert_id_dir(id_dir, args.layout))
+
+            if os.path.isdir(builds_dir):
+                moved.update(utils.convert_build_dir(builds_dir, args.layout))
+        except (OSError, TimeoutError, ValueError) as err:
+            msg = "Error converting working directory '{}' to the {} " \
+                  "layout: {}".format(working_dir, args.layout, err)
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+        # Suites link to their tests, and test build directories are full of
+        # links into the original build.
+        relinked = 0
+        try:
+            if os.path.isdir(suites_dir):
+                for _, suite_path in utils.list_id_dirs(suites_dir):
+                    relinked += utils.repoint_symlinks(suite_path, moved)
+
+            if os.path.isdir(tests_dir):
+                for _, test_path in utils.list_id_dirs(tests_dir):
+                    for name in 'build', 'build_origin':
+                        build_path = os.path.join(test_path, name)
+                        if os.path.lexists(build_path):
+                            relinked += utils.repoint_symlinks(build_path,
+                                                               moved)
+        except OSError as err:
+            msg = "Error updating links in working directory '{}': {}" \
+                  .format(working_dir, err)
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+        print("Moved {} directories and updated {} links in '{}'."
+              .format(len(moved), relinked, working_dir))
+
+        return 0
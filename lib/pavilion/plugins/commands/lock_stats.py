@@ -0,0 +1,74 @@
+from pavilion import commands
+from pavilion import lockfile
+import os
+
+
+class LockStatsCommand(commands.Command):
+
+    def __init__(self):
+
+        super().__init__('lock_stats', 'Summarize lock contention, by lock '
+                                       'path. Lock stats are only recorded '
+                                       'when \'lock_stats\' is enabled in the '
+                                       'pavilion config.')
+
+    def _setup_arguments(self, parser):
+
+        parser.add_argument(
+            '-n', '--top', action='store', type=int, default=20,
+            help='Show only this many of the locks with the most total wait '
+                 'time. Defaults to 20; 0 shows them all.')
+        parser.add_argument(
+            '--histogram', action='store_true', default=False,
+            help='Show a histogram of wait times for each lock.')
+        parser.add_argument(
+            '--file', action='store', default=None,
+            help='The stats file to read. Defaults to the one in the '
+                 'working_dir.')
+
+    def run(self, pav_config, args):
+
+        stats_path = args.file
+        if stats_path is None:
+            stats_path = os.path.join(pav_config.working_dir,
+                                      lockfile.STATS_FN)
+
+        try:
+            records = lockfile.load_stats(stats_path)
+        except (IOError, OSError) as err:
+            msg = "Could not read lock stats file '{}': {}"\
+                  .format(stats_path, err)
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+        summaries = lockfile.summarize_stats(records)
+        paths = sorted(summaries.keys(),
+                       key=lambda p: summaries[p]['total_wait'],
+                       reverse=True)
+        if args.top:
+            paths = paths[:args.top]
+
+        print("{:>7s} {:>8s} {:>10s} {:>9s} {:>9s} {:>9s} {:>9s} {:>7s} "
+              "{:>7s}  {}"
+              .format('count', 'timeouts', 'wait(tot)', 'wait(avg)',
+                      'wait(p50)', 'wait(max)', 'hold(avg)', 'retries',
+                      'expired', 'lock'))
+
+        for path in paths:
+            summ = summaries[path]
+            print("{count:7d} {timeouts:8d} {total_wait:10.3f} "
+                  "{mean_wait:9.4f} {median_wait:9.4f} {max_wait:9.3f} "
+                  "{mean_hold:9.4f} {retries:7d} {expired_broken:7d}  {path}"
+                  .format(path=path, **summ))
+
+            if args.histogram:
+                buckets = lockfile.STATS_BUCKETS
+                for i, count in enumerate(summ['histogram']):
+                    if i < len(buckets) - 1:
+                        label = '< {}s'.format(buckets[i])
+                    else:
+                        label = '>= {}s'.format(buckets[i - 1])
+                    print("{:>18s} {:7d} {}"
+                          .format(label, count, '#' * min(count, 60)))
+
+        return 0
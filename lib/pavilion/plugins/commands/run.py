@@ -1,8 +1,14 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pavilion import build_cache
 from pavilion import commands
 from test import config_utils, PavTest
 from pavilion import schedulers
+from pavilion import utils
+from pavilion.lockfile import TimeoutError
+from pavilion.status_file import STATES
 from pavilion.string_parser import ResolveError
+import os
 
 
 class RunCommand(commands.Command):
@@ -53,11 +59,113 @@ class RunCommand(commands.Command):
 
         test_configs = self.get_tests(pav_config, args)
 
+        # Make room for any new builds. The builds our new tests are about
+        # to use are kept, since those tests haven't leased them yet.
+        cache = build_cache.BuildCache(pav_config)
+        if cache.limited:
+            pending = {test.build_name for tests in test_configs.values()
+                       for test in tests if test.build_name is not None}
+            for build in cache.evict(pending=pending):
+                self.logger.info("Evicted build '{}' from the build cache."
+                                 .format(build.name))
+
+        # Build everything up front, so that tests don't wait on builds (or
+        # each other's builds) inside their allocations.
+        test_configs = self.build_tests(pav_config, test_configs)
+
         for sched_name, tests in test_configs.items():
+            if not tests:
+                continue
+
             sched = schedulers.get_scheduler_plugin(sched_name)
 
             sched.run_tests(tests)
 
+    def build_tests(self, pav_config, tests_by_sched):
+        """Build each unique build needed by the given tests, in parallel,
+        and then give each test its copy of its build.
+        :param pav_config: The pavilion config. 'max_parallel_builds' sets
+            how many builds happen at once.
+        :param dict tests_by_sched: A dictionary (by scheduler type name) of
+            lists of tests.
+        :returns: The same dictionary, minus any tests whose build failed
+            (or couldn't be performed, because someone else held the build's
+            lock too long). Those tests are marked BUILD_FAILED (or
+            BUILD_ERROR).
+        """
+
+        # Group the tests by the build they use. The first test in each group
+        # performs the build.
+        builds = defaultdict(lambda: [])
+        for tests in tests_by_sched.values():
+            for test in tests:
+                if test.build_path is not None:
+                    builds[test.build_origin].append(test)
+
+        if not builds:
+            return tests_by_sched
+
+        def build(test):
+            """Build the test, returning whether that succeeded. If another
+            Pavilion instance is already performing the build, this waits
+            (up to 'build_lock_timeout') for it to finish."""
+
+            try:
+                return test.build()
+            except OSError as err:
+                msg = "Error building test: {}".format(err)
+                test.status.set(STATES.BUILD_ERROR, msg)
+                self.logger.error(msg)
+                return False
+
+        max_builds = max(pav_config.max_parallel_builds, 1)
+        with ThreadPoolExecutor(max_workers=max_builds) as pool:
+            origins = list(builds.keys())
+            results = pool.map(build, [builds[o][0] for o in origins])
+            build_results = dict(zip(origins, results))
+
+            # Now that the builds exist, the rest of the tests just need
+            # their (symlink) copy of it.
+            copies = []
+            for origin, result in build_results.items():
+                if result:
+                    copies.extend(builds[origin][1:])
+            copy_results = dict(zip(copies, pool.map(build, copies)))
+
+        failed = set()
+        for origin, result in build_results.items():
+            builder = builds[origin][0]
+            if not result:
+                failed.add(builder)
+                # Builds that were never attempted are errors, not failures.
+                state = STATES.BUILD_FAILED
+                if builder.status.current().state == STATES.BUILD_ERROR:
+                    state = STATES.BUILD_ERROR
+                for test in builds[origin][1:]:
+                    test.status.set(
+                        state,
+                        "Build '{}' failed; see test {}."
+                        .format(os.path.basename(origin), builder.id))
+                    failed.add(test)
+        failed.update(test for test, result in copy_results.items()
+                      if not result)
+
+        attached = [test.attach_stats for tests in builds.values()
+                    for test in tests if test.attach_stats is not None]
+        if attached:
+            self.logger.info("Attached builds to {} tests in {:.2f}s total "
+                             "(slowest {:.2f}s)."
+                             .format(len(attached),
+                                     sum(a.elapsed for a in attached),
+                                     max(a.elapsed for a in attached)))
+
+        if failed:
+            self.logger.warning("{} tests were not started because their "
+                                "build failed.".format(len(failed)))
+
+        return {sched_name: [test for test in tests if test not in failed]
+                for sched_name, tests in tests_by_sched.items()}
+
     def get_tests(self, pav_config, args):
         """Translate a general set of pavilion test configs into the final,
         resolved configuration objects. These objects will be organized in a
@@ -117,6 +225,7 @@ class RunCommand(commands.Command):
 
         # Get the schedulers for the tests, and the scheduler variables. 
         # The scheduler variables are based on all of the
+        resolved_configs = []
         for sched_name in raw_tests_by_sched.keys():
             try:
                 sched = schedulers.get_scheduler_plugin(sched_name)
@@ -146,8 +255,33 @@ class RunCommand(commands.Command):
                     self.logger.error(msg)
                     raise commands.CommandError(msg)
 
-                test = PavTest(pav_config, resolved_config)
+                resolved_configs.append((sched.name, resolved_config))
+
+        # Download every test's url sources at once. Tests that share a
+        # source share the download.
+        failed = PavTest.prefetch_sources(
+            pav_config, [config for _, config in resolved_configs])
+        for url, err in failed.items():
+            self.logger.warning("Could not download '{}': {}".format(url, err))
+
+        # Reserve ids for all of the tests at once, rather than taking the
+        # id lock for each one.
+        tests_path = os.path.join(pav_config.working_dir, 'tests')
+        try:
+            id_block = utils.reserve_ids(tests_path, len(resolved_configs))
+        except (OSError, TimeoutError) as err:
+            msg = "Could not reserve test ids in '{}': {}"\
+                  .format(tests_path, err)
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+        try:
+            for sched_name, resolved_config in resolved_configs:
+                test = PavTest(pav_config, resolved_config, id_block=id_block)
 
-                tests_by_scheduler[sched.name].append(test)
+                tests_by_scheduler[sched_name].append(test)
+        finally:
+            # Don't leave empty test directories behind if something failed.
+            id_block.release()
 
         return tests_by_scheduler
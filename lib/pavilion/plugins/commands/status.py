@@ -0,0 +1,160 @@
+from pavilion import commands
+from pavilion import status_index
+from pavilion import status_watch
+from pavilion import suite
+from pavilion import utils
+from pavilion.status_file import STATES, StatusFile, TestStatusError
+import os
+
+
+class StatusCommand(commands.Command):
+
+    def __init__(self):
+
+        super().__init__('status', 'Show the current status of tests.')
+
+    def _setup_arguments(self, parser):
+
+        parser.add_argument(
+            'tests', nargs='*',
+            help='The ids of the tests to show the status of. If no tests '
+                 'or suite are given, the tests in your last suite are '
+                 'shown. Alternatively, \'<test_id> update <state> <note>\' '
+                 'sets the status of a test (as used by test scripts).')
+        parser.add_argument(
+            '-s', '--suite', action='store', type=int, default=None,
+            help='Show the status of every test in this suite.')
+        parser.add_argument(
+            '-f', '--follow', action='store_true', default=False,
+            help='After showing the current status, print each status '
+                 'change as it happens, along with the number of tests in '
+                 'each state. This exits when every test has finished, or '
+                 'on Ctrl-C.')
+        parser.add_argument(
+            '--interval', action='store', type=float, default=5,
+            help='When following, how often (in seconds) to check for '
+                 'status changes that can\'t be watched with inotify (such '
+                 'as those on network filesystems). Defaults to 5.')
+
+    def _suite_tests(self, pav_config, suite_id):
+        """Get the test ids in the given suite, or in the user's last suite
+        if suite_id is None."""
+
+        try:
+            return suite.get_test_ids(pav_config, suite_id)
+        except suite.SuiteError as err:
+            msg = str(err)
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+    def run(self, pav_config, args):
+
+        if len(args.tests) >= 3 and args.tests[1] == 'update':
+            return self._update(pav_config, args.tests[0], args.tests[2],
+                                ' '.join(args.tests[3:]))
+
+        try:
+            test_ids = [int(test_id) for test_id in args.tests]
+        except ValueError as err:
+            msg = "Invalid test id: {}".format(err)
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+        if args.suite is not None or not test_ids:
+            test_ids.extend(self._suite_tests(pav_config, args.suite))
+
+        tests_dir = os.path.join(pav_config.working_dir, 'tests')
+        tests = {test_id: utils.make_id_path(tests_dir, test_id)
+                 for test_id in test_ids}
+
+        index = None
+        if pav_config.status_index == 'true':
+            index = status_index.StatusIndex.from_working_dir(
+                pav_config.working_dir)
+
+        statuses = status_index.get_current(index, tests)
+
+        print("{:>7s} {:15s} {:26s} {}"
+              .format('test', 'state', 'time', 'note'))
+        for test_id in sorted(statuses.keys()):
+            self._print_status(test_id, statuses[test_id])
+
+        if args.follow:
+            status_files = {test_id: os.path.join(path, 'status')
+                            for test_id, path in tests.items()}
+            self._follow(status_files, args.interval, index)
+
+        return 0
+
+    def _update(self, pav_config, test_id, state, note):
+        """Set the status of the given test."""
+
+        try:
+            test_id = int(test_id)
+        except ValueError:
+            msg = "Invalid test id '{}'.".format(test_id)
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+        test_path = utils.make_id_path(
+            os.path.join(pav_config.working_dir, 'tests'), test_id)
+
+        index = None
+        if pav_config.status_index == 'true':
+            index = status_index.StatusIndex.from_working_dir(
+                pav_config.working_dir)
+
+        try:
+            StatusFile(os.path.join(test_path, 'status'), index=index,
+                       index_key=test_id, create=False).set(state, note)
+        except TestStatusError as err:
+            msg = "Could not update the status of test {}: {}".format(
+                test_id, err)
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+        return 0
+
+    # States that are always included in the rolling counts.
+    COUNT_STATES = (STATES.SCHEDULED, STATES.BUILD_DONE, STATES.RUN_DONE,
+                    STATES.RUN_FAILED)
+
+    def _follow(self, status_files, interval, index=None):
+        """Print status changes as they happen, until all the tests are
+        done."""
+
+        with status_watch.StatusWatcher(status_files, poll_interval=interval,
+                                        index=index) as watcher:
+            if watcher.indexed:
+                self.logger.info("Following {} of {} tests through the "
+                                 "status index every {}s."
+                                 .format(watcher.indexed, len(status_files),
+                                         interval))
+            if watcher.polled:
+                self.logger.info("Polling {} of {} status files every {}s."
+                                 .format(watcher.polled, len(status_files),
+                                         interval))
+            self._print_counts(watcher.counts)
+
+            try:
+                while not watcher.done():
+                    updates = watcher.wait()
+                    for test_id, status in updates:
+                        self._print_status(test_id, status)
+                    if updates:
+                        self._print_counts(watcher.counts)
+            except KeyboardInterrupt:
+                pass
+
+    @staticmethod
+    def _print_status(test_id, status):
+        when = '' if status.when is None else \
+            status.when.strftime('%Y-%m-%d %H:%M:%S.%f')
+        print("{:7d} {:15s} {:26s} {}"
+              .format(test_id, status.state, when, status.note), flush=True)
+
+    def _print_counts(self, counts):
+        states = list(self.COUNT_STATES)
+        states.extend(sorted(state for state in counts if state not in states))
+        print('  ' + ', '.join('{}: {}'.format(state, counts.get(state, 0))
+                               for state in states), flush=True)
@@ -0,0 +1,67 @@
+from pavilion import commands
+from pavilion import suite
+from pavilion import timings
+from pavilion import utils
+import os
+
+
+class TimingsCommand(commands.Command):
+
+    def __init__(self):
+
+        super().__init__('timings', 'Summarize how long each phase of the '
+                                    'given tests took, to see where the time '
+                                    'is going.')
+
+    def _setup_arguments(self, parser):
+
+        parser.add_argument(
+            'tests', nargs='*', type=int,
+            help='The ids of the tests to summarize. If no tests or suite '
+                 'are given, the tests in your last suite are used.')
+        parser.add_argument(
+            '-s', '--suite', action='store', type=int, default=None,
+            help='Summarize every test in this suite.')
+
+    def run(self, pav_config, args):
+
+        test_ids = list(args.tests)
+        if args.suite is not None or not test_ids:
+            try:
+                test_ids.extend(suite.get_test_ids(pav_config, args.suite))
+            except suite.SuiteError as err:
+                self.logger.error(str(err))
+                raise commands.CommandError(str(err))
+
+        tests_dir = os.path.join(pav_config.working_dir, 'tests')
+        all_times = [timings.load(utils.make_id_path(tests_dir, test_id))
+                     for test_id in test_ids]
+        all_times = [times for times in all_times if times]
+
+        if not all_times:
+            msg = "None of the {} given tests have any timings."\
+                  .format(len(test_ids))
+            self.logger.error(msg)
+            raise commands.CommandError(msg)
+
+        summary = timings.aggregate(all_times)
+
+        print("{:14s} {:>6s} {:>9s} {:>9s} {:>9s} {:>9s} {:>10s}"
+              .format('phase', 'count', 'p50(s)', 'p90(s)', 'p99(s)',
+                      'max(s)', 'total(s)'))
+        for phase, stats in summary.items():
+            print("{:14s} {:6d} {:9.3f} {:9.3f} {:9.3f} {:9.3f} {:10.3f}"
+                  .format(phase, stats['count'], stats['p50'], stats['p90'],
+                          stats['p99'], stats['max'], stats['total']))
+
+        test_time = sum(stats['total'] for phase, stats in summary.items()
+                        if phase in timings.TEST_PHASES)
+        overhead = sum(stats['total'] for phase, stats in summary.items()
+                       if phase not in timings.TEST_PHASES)
+        total = max(test_time + overhead, 1e-9)
+        print("{} tests. Pavilion overhead: {:.3f}s ({:.1f}%), test build "
+              "and run: {:.3f}s ({:.1f}%)."
+              .format(len(all_times), overhead, overhead/total*100,
+                      test_time, test_time/total*100))
+
+        return 0
@@ -1,3 +1,4 @@
+from pavilion import log_sink
 from pavilion import result_parsers
 import yaml_config as yc
 import re
@@ -49,13 +50,14 @@ class Regex(result_parsers.ResultParser):
         matches = []
 
         try:
-            with open(file, "r") as infile:
-                for line in infile.readlines():
+            # Logs may have been compressed.
+            with log_sink.open_log(file) as infile:
+                for line in infile:
                     match = regex.search(line)
 
                     if match is not None:
                         matches.append(match.group())
-        except (IOError, OSError) as err:
+        except (IOError, OSError, EOFError) as err:
             raise result_parsers.ResultParserError(
                 "Regex result parser could not read input file '{}': {}"
                 .format(file, err)
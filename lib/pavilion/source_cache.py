@@ -0,0 +1,246 @@
+"""A content addressed cache of extracted source archives, so that an
+archive is only decompressed and extracted once no matter how many builds
+use it.
+
+Entries live in '<working_dir>/src_cache/<digest>', where the digest is the
+hash of the archive's contents (from the hash cache). Entries are extracted
+into '<entry>.tmp' under '<entry>.lock' and renamed into place, so a complete
+entry never changes. The write bits are masked out of the files in each
+entry, for the same reason they're masked out of builds.
+
+Build directories are populated from an entry by cloning each file
+(reflinks, on filesystems that support copy-on-write), hard linking them
+(only when 'source_cache' is set to 'hardlink'), or by plain copying, in
+that order of preference.
+
+An entry's last use is the mtime of its directory. The entries are evicted
+along with the builds (see build_cache), and under the same limits.
+"""
+
+from pavilion import extract
+from pavilion import lockfile
+from pavilion import utils
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import stat
+import time
+
+LOGGER = logging.getLogger('pav.' + __name__)
+
+# The Linux ioctl to clone (reflink) one file into another.
+FICLONE = 0x40049409
+
+# Errors that mean a way of linking files doesn't work here (at all), and
+# the next method should be tried.
+_FALLBACK_ERRNOS = {
+    'reflink': {errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV,
+                errno.EBADF, errno.EPERM},
+    'hardlink': {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP},
+}
+
+# Values for the 'source_cache' config option.
+MODES = ('off', 'reflink', 'hardlink')
+
+
+class SourceCacheError(RuntimeError):
+    """Raised when a cache entry can't be created or used."""
+    pass
+
+
+class LinkStats:
+    """How a directory was populated from a cache entry."""
+
+    def __init__(self, entry_path):
+        self.entry_path = entry_path
+        self.methods = set()
+        self.files = 0
+        self.start = time.time()
+        self.elapsed = None
+
+    def done(self):
+        self.elapsed = time.time() - self.start
+
+    def __str__(self):
+        return ("Populated {} files from source cache entry '{}' in {:.2f}s "
+                "using {}."
+                .format(self.files, self.entry_path, self.elapsed or 0,
+                        ', '.join(sorted(self.methods)) or 'nothing'))
+
+
+class _Linker:
+    """Links (or copies) files, remembering which methods don't work so
+    they're only tried once."""
+
+    def __init__(self, mode, stats):
+        self.methods = ['reflink']
+        if mode == 'hardlink':
+            self.methods.append('hardlink')
+        self.methods.append('copy')
+        self.stats = stats
+
+    @staticmethod
+    def _reflink(src, dest):
+        with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+
+    def link(self, src, dest, mode):
+        """Link or copy src to dest. Cloned and copied files get their owner
+        write bit back, since they're independent of the cache entry.
+        :param str src: The file to link.
+        :param str dest: Where to put it.
+        :param int mode: The mode of src.
+        """
+
+        while True:
+            method = self.methods[0]
+            try:
+                if method == 'reflink':
+                    self._reflink(src, dest)
+                    os.chmod(dest, stat.S_IMODE(mode) | stat.S_IWUSR)
+                elif method == 'hardlink':
+                    os.link(src, dest)
+                else:
+                    shutil.copyfile(src, dest)
+                    os.chmod(dest, stat.S_IMODE(mode) | stat.S_IWUSR)
+            except OSError as err:
+                if err.errno not in _FALLBACK_ERRNOS.get(method, ()):
+                    raise
+
+                LOGGER.debug("Can't {} '{}' to '{}', falling back: {}"
+                             .format(method, src, dest, err))
+                self.methods.pop(0)
+                try:
+                    os.unlink(dest)
+                except OSError:
+                    pass
+                continue
+
+            self.stats.methods.add(method)
+            self.stats.files += 1
+            return
+
+
+def link_tree(src, dest, mode='reflink', stats=None):
+    """Recreate the directory tree at src at dest, linking or copying each
+    file.
+    :param str src: The directory to link from.
+    :param str dest: The directory to create. It must not exist.
+    :param str mode: 'hardlink' to allow hard links, otherwise only
+        reflinks (or copies) are made.
+    :param LinkStats stats: Stats to update. One is created if not given.
+    :rtype: LinkStats
+    :raises OSError: When the tree can't be copied.
+    """
+
+    if stats is None:
+        stats = LinkStats(src)
+
+    linker = _Linker(mode, stats)
+
+    dirs = [(src, dest)]
+    while dirs:
+        src_dir, dest_dir = dirs.pop()
+        os.mkdir(dest_dir)
+        with os.scandir(src_dir) as scan:
+            for entry in scan:
+                dest_path = os.path.join(dest_dir, entry.name)
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), dest_path)
+                elif entry.is_dir():
+                    dirs.append((entry.path, dest_path))
+                elif entry.is_file():
+                    linker.link(entry.path, dest_path, entry.stat().st_mode)
+
+    stats.done()
+    return stats
+
+
+class SourceCache:
+    """The extracted source cache for a working directory."""
+
+    # How long to wait (in seconds) for someone else to finish extracting
+    # an archive.
+    EXTRACT_TIMEOUT = 60*60
+
+    def __init__(self, pav_cfg):
+        """
+        :param pav_cfg: The pavilion config. Entries are linked according to
+            its 'source_cache' setting.
+        """
+
+        self.pav_cfg = pav_cfg
+        self.path = os.path.join(pav_cfg.working_dir, 'src_cache')
+        self.mode = pav_cfg.source_cache
+
+    @property
+    def enabled(self):
+        """Whether the cache should be used at all."""
+        return self.mode != 'off'
+
+    def entry_path(self, digest):
+        """The path to the entry for the archive with the given digest."""
+        return os.path.join(self.path, digest.hex())
+
+    def _extract(self, src_path, subtype, entry_path):
+        """Extract the archive into the cache, unless someone beat us to it.
+        :returns: The extraction stats, or None if the entry already existed.
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+
+        lock = lockfile.LockFile(entry_path + '.lock',
+                                 group=self.pav_cfg.shared_group,
+                                 timeout=self.EXTRACT_TIMEOUT)
+        with lock:
+            if os.path.exists(entry_path):
+                return None
+
+            tmp_path = entry_path + '.tmp'
+            # Clean up after any extraction that died part way through.
+            for path in tmp_path, tmp_path + '.extract':
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+
+            stats = extract.extract_tar(src_path, subtype, tmp_path)
+            utils.mask_file_perms(tmp_path, 0o7555)
+            os.rename(tmp_path, entry_path)
+
+        return stats
+
+    def populate(self, src_path, subtype, digest, dest):
+        """Extract the given archive into dest, via the cache.
+        :param str src_path: The archive.
+        :param str subtype: The mime subtype of the archive.
+        :param bytes digest: The hash of the archive's contents.
+        :param str dest: The directory to populate. It must not exist.
+        :returns: The extraction stats (None if the archive was already in
+            the cache) and the link stats.
+        :raises SourceCacheError: When anything goes wrong.
+        """
+
+        entry_path = self.entry_path(digest)
+
+        try:
+            extract_stats = None
+            if not os.path.exists(entry_path):
+                extract_stats = self._extract(src_path, subtype, entry_path)
+
+            # Mark the entry as used before linking from it, so it won't be
+            # evicted out from under us.
+            now = time.time()
+            os.utime(entry_path, (now, now))
+
+            link_stats = link_tree(entry_path, dest, self.mode)
+        except lockfile.TimeoutError:
+            raise SourceCacheError(
+                "Timed out waiting for '{}' to be extracted into the source "
+                "cache.".format(src_path))
+        except (OSError, extract.ExtractError) as err:
+            raise SourceCacheError(
+                "Could not populate '{}' from the source cache: {}"
+                .format(dest, err))
+
+        return extract_stats, link_stats
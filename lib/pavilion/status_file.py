@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import logging
 import os
@@ -82,6 +83,20 @@ class TestStatesStruct:
 # There is one predefined, global status object defined at module load time.
 STATES = TestStatesStruct()
 
+# Looking up the local timezone is slow, so it's only done once per process.
+_LOCAL_TZ = None
+
+
+def get_local_tz():
+    """Get the local timezone (cached)."""
+
+    global _LOCAL_TZ
+
+    if _LOCAL_TZ is None:
+        _LOCAL_TZ = tzlocal.get_localzone()
+
+    return _LOCAL_TZ
+
 
 class StatusInfo:
     def __init__(self, when=None, state='', note=''):
@@ -99,30 +114,53 @@ class StatusFile:
     NOTE: The status file does not perform any locking to ensure that it's created in an
     atomic manner. It does, however, limit it's writes to appends of a size such that those
     writes should be atomic.
+
+    Each status line is '<timestamp> <epoch> <state> <note>'. The epoch is the same time as the
+    (human readable) timestamp, but is much faster to parse. Lines without the epoch (from older
+    versions of Pavilion) are still understood.
+
+    While used as a context manager, the status file is kept open for appending, rather than
+    being reopened for every status change.
     """
 
     STATES = STATES
 
     TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f%z'
     TS_LEN = 5 + 3 + 3 + 3 + 3 + 3 + 6 + 14
+    EPOCH_FORMAT = '{:.6f}'
+    EPOCH_LEN = 10 + 1 + 6
 
     LOGGER = logging.getLogger('pav.{}'.format(__file__))
 
     LINE_MAX = 4096
-    # Maximum length of a note. They can use every byte minux the timestamp and status sizes,
-    # the spaces in-between, and the trailing newline.
-    NOTE_MAX = LINE_MAX - TS_LEN - 1 - STATES.max_length - 1 - 1
+    # Maximum length of a note. They can use every byte minux the timestamp, epoch and status
+    # sizes, the spaces in-between, and the trailing newline.
+    NOTE_MAX = LINE_MAX - TS_LEN - 1 - EPOCH_LEN - 1 - STATES.max_length - 1 - 1
 
-    def __init__(self, path):
+    def __init__(self, path, index=None, index_key=None, create=True):
         """Create the status file object.
         :param path: The path to the status file.
+        :param index: A status_index.StatusIndex to also record status
+            changes in.
+        :param index_key: The key (test id) to record this file's status
+            changes under in the index.
+        :param bool create: Create the status file if it doesn't exist. When False, reading
+            a missing status file will raise a TestStatusError.
         """
 
         self.path = path
+        self.index = index
+        self.index_key = index_key
+
+        self.tz = get_local_tz()
 
-        self.tz = tzlocal.get_localzone()
+        # The append file descriptor, while we're keeping the file open.
+        self._fd = None
+        # The last result from current(), and the (inode, size, mtime) of the file at the time.
+        self._current = None
+        self._current_key = None
 
-        if not os.path.isfile(self.path):
+        if create and not os.path.isfile(self.path):
             # Make sure we can open the file, and create it if it doesn't exist.
             self.set(STATES.CREATED, '')
 
@@ -133,9 +171,19 @@ class StatusFile:
 
         status = StatusInfo(None, '', '')
 
-        if parts:
+        timestamp = parts.pop(0) if parts else None
+
+        if parts and parts[0][:1].isdigit():
+            epoch = parts.pop(0)
+            parts = parts[0].split(" ", 1) if parts else []
+            try:
+                status.when = datetime.datetime.fromtimestamp(float(epoch), self.tz)
+            except (ValueError, OverflowError, OSError):
+                pass
+
+        if status.when is None and timestamp is not None:
             try:
-                status.when = datetime.datetime.strptime(parts.pop(0), self.TIME_FORMAT)
+                status.when = datetime.datetime.strptime(timestamp, self.TIME_FORMAT)
             except ValueError as err:
                 self.LOGGER.warning("Bad date in log line '{}' in file '{}': {}"
                                     .format(line, self.path, err))
@@ -159,15 +207,19 @@ class StatusFile:
         return [self._parse_status_line(line) for line in lines]
 
     def current(self):
+        """Get the most recent status. This is cached until the status file changes."""
 
         # We read a bit extra to avoid off-by-one errors
         end_read_len = self.LINE_MAX + 16
 
         try:
             with open(self.path, 'rb') as status_file:
-                status_file.seek(0, os.SEEK_END)
-                file_len = status_file.tell()
-                if file_len < end_read_len:
+                file_stat = os.fstat(status_file.fileno())
+                key = (file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+                if key == self._current_key:
+                    return self._current
+
+                if file_stat.st_size < end_read_len:
                     status_file.seek(0)
                 else:
                     status_file.seek(-end_read_len, os.SEEK_END)
@@ -175,12 +227,14 @@ class StatusFile:
                 # Get the last line.
                 line = status_file.readlines()[-1]
 
-                return self._parse_status_line(line)
-
         except (OSError, IOError) as err:
             raise TestStatusError("Error reading status file '{}': {}"
                                   .format(self.path, err))
 
+        self._current = self._parse_status_line(line)
+        self._current_key = key
+        return self._current
+
     def set(self, status, note):
         """Set the status.
         :param status:
@@ -189,6 +243,7 @@ class StatusFile:
         """
 
         when = self.tz.localize(datetime.datetime.now())
+        epoch = when.timestamp()
         when = when.strftime(self.TIME_FORMAT)
 
         # If we were given an invalid status, make the status invalid but add what was given to
@@ -200,16 +255,105 @@ class StatusFile:
         # Truncate the note such that, even when encoded in utf-8, it is shorter than NOTE_MAX
         note = note.encode('utf-8')[:self.NOTE_MAX].decode('utf-8', 'ignore')
 
-        status_line = '{} {} {}\n'.format(when, status, note).encode('utf-8')
+        status_line = '{} {} {} {}\n'.format(when, self.EPOCH_FORMAT.format(epoch),
+                                            status, note).encode('utf-8')
         try:
-            with open(self.path, 'ab') as status_file:
-                status_file.write(status_line)
+            if self._fd is not None:
+                os.write(self._fd, status_line)
+                file_stat = os.fstat(self._fd)
+            else:
+                with open(self.path, 'ab') as status_file:
+                    status_file.write(status_line)
+                    status_file.flush()
+                    file_stat = os.fstat(status_file.fileno())
         except (IOError, OSError) as err:
             raise TestStatusError("Could not write status line '{}' to status file '{}': {}"
                                   .format(status_line, self.path, err))
 
+        if self.index is not None:
+            # The status file is the authority; failing to update the index just makes
+            # status queries slower for this test. The file's size and mtime are recorded too,
+            # so readers can tell when the index entry is out of date.
+            try:
+                self.index.append(self.index_key, epoch, status, note,
+                                  file_stat.st_size, file_stat.st_mtime_ns)
+            except TestStatusError as err:
+                self.LOGGER.warning(err)
+
+    def open(self):
+        """Keep the status file open for appending until close() is called."""
+
+        if self._fd is not None:
+            return
+
+        try:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        except OSError as err:
+            raise TestStatusError("Could not open status file '{}': {}"
+                                  .format(self.path, err))
+
+    def close(self):
+        """Close the status file, if it was kept open."""
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def __eq__(self, other):
         return (
             type(self) == type(other) and
             self.path == other.path
         )
+
+
+# How many threads to read status files with, by default. Reading status files is almost
+# entirely I/O wait, so this can be much more than the number of cores.
+BULK_WORKERS = 32
+
+
+def bulk_current(paths, max_workers=BULK_WORKERS, errors=None):
+    """Get the current status from each of the given status files, reading them in parallel.
+    Status files that can't be read get an UNKNOWN status with the error as the note, rather
+    than stopping the whole query.
+    :param list paths: The status file paths.
+    :param int max_workers: The maximum number of threads to read with.
+    :param list errors: If given, a (path, TestStatusError) tuple is appended to this list for
+        each status file that couldn't be read.
+    :returns: A dict of path -> StatusInfo.
+    """
+
+    def read_current(path):
+        try:
+            return StatusFile(path, create=False).current()
+        except TestStatusError as err:
+            return err
+
+    paths = list(paths)
+    if len(paths) > 1 and max_workers > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as pool:
+            results = list(pool.map(read_current, paths))
+    else:
+        results = [read_current(path) for path in paths]
+
+    statuses = {}
+    error_count = 0
+    for path, result in zip(paths, results):
+        if isinstance(result, TestStatusError):
+            error_count += 1
+            if errors is not None:
+                errors.append((path, result))
+            result = StatusInfo(None, STATES.UNKNOWN, str(result))
+        statuses[path] = result
+
+    if error_count:
+        StatusFile.LOGGER.warning("Could not read {} of {} status files."
+                                  .format(error_count, len(paths)))
+
+    return statuses
@@ -0,0 +1,316 @@
+"""The status index is a working_dir wide record of the latest status of
+every test, so that status queries don't have to open every test's status
+file.
+
+The index is a directory containing a compacted 'snapshot' and an append
+only log per host ('<hostname>.log'). Appends across hosts aren't atomic on
+NFS, so each host only ever appends to its own log. Each line of both the
+snapshot and logs is '<test_id> <epoch> <size> <mtime_ns> <state> <note>',
+where size and mtime_ns are those of the test's status file just after the
+status was written. When reading, the line with the latest timestamp for
+each test wins, so duplicate or out-of-order lines are harmless. An entry
+is only trusted while the status file still has the recorded size and
+mtime; otherwise the status file was changed without the index (or the
+index update was lost), and the file itself is read instead.
+
+Readers and the compactor share a lock; writers never lock. Compaction moves
+each log aside before reading it, and writers re-append to the new log if
+the log they wrote to was moved while they were writing.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pavilion import lockfile
+from pavilion.status_file import StatusInfo, TestStatusError
+from pavilion.status_file import BULK_WORKERS, bulk_current, get_local_tz
+import datetime
+import logging
+import os
+
+LOGGER = logging.getLogger('pav.' + __name__)
+
+
+class StatusIndex:
+    """Manages the status index directory for a working_dir."""
+
+    SNAPSHOT_FN = 'snapshot'
+    LOG_EXT = '.log'
+    LOCK_FN = '.lock'
+    # Compact the index when the logs get bigger than this (in bytes).
+    COMPACT_SIZE = 4*1024**2
+    # Notes are truncated to this length (in bytes) in the index.
+    NOTE_MAX = 256
+    LOCK_TIMEOUT = 5
+
+    def __init__(self, path):
+        """
+        :param str path: The path to the index directory. It will be created
+            as needed.
+        """
+
+        self.path = path
+        self._log_path = os.path.join(path, os.uname()[1] + self.LOG_EXT)
+        self._lock_path = os.path.join(path, self.LOCK_FN)
+        self._tz = get_local_tz()
+
+    @classmethod
+    def from_working_dir(cls, working_dir):
+        """Get the status index for the given working directory."""
+
+        return cls(os.path.join(working_dir, 'status_index'))
+
+    def append(self, test_id, when, state, note, size, mtime_ns):
+        """Add a status entry to this host's log.
+        :param int test_id: The test the status is for.
+        :param float when: The unix timestamp of the status change.
+        :param str state: The new state.
+        :param str note: The status note. It will be truncated.
+        :param int size: The size of the status file after the change.
+        :param int mtime_ns: The mtime of the status file after the change.
+        :raises TestStatusError: When we can't write to the index.
+        """
+
+        note = note.replace('\n', ' ')
+        note = note.encode('utf-8')[:self.NOTE_MAX].decode('utf-8', 'ignore')
+        line = self._format(test_id, (when, size, mtime_ns, state, note))
+        line = line.encode('utf-8')
+
+        try:
+            for _ in range(2):
+                try:
+                    fd = os.open(self._log_path,
+                                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+                except FileNotFoundError:
+                    os.makedirs(self.path, exist_ok=True)
+                    fd = os.open(self._log_path,
+                                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+
+                try:
+                    os.write(fd, line)
+                    fd_stat = os.fstat(fd)
+                finally:
+                    os.close(fd)
+
+                # Make sure the log wasn't moved aside for compaction while we
+                # were writing to it. If it was, write again to the new log.
+                try:
+                    path_stat = os.stat(self._log_path)
+                except FileNotFoundError:
+                    continue
+
+                if (path_stat.st_dev, path_stat.st_ino) == \
+                        (fd_stat.st_dev, fd_stat.st_ino):
+                    break
+        except OSError as err:
+            raise TestStatusError("Could not write to status index '{}': {}"
+                                  .format(self._log_path, err))
+
+    def current(self, test_ids=None, status_paths=None):
+        """Get the latest status of the given tests from the index. Tests
+        not in the index are simply left out. This will also compact the
+        index if the logs have gotten too large.
+        :param test_ids: The test ids to get the status of, or None for all.
+        :param dict status_paths: A dict of test_id -> status file path. If
+            given, tests whose status file doesn't match what the index
+            recorded for it are left out too.
+        :returns: A dict of test id to StatusInfo objects.
+        :raises TestStatusError: When the index can't be read.
+        """
+
+        if not os.path.isdir(self.path):
+            return {}
+
+        try:
+            with lockfile.LockFile(self._lock_path, timeout=self.LOCK_TIMEOUT):
+                entries, log_size = self._read()
+
+                if log_size > self.COMPACT_SIZE:
+                    self._compact(entries)
+        except (OSError, lockfile.TimeoutError) as err:
+            raise TestStatusError("Could not read status index '{}': {}"
+                                  .format(self.path, err))
+
+        if test_ids is not None:
+            test_ids = set(test_ids)
+
+        entries = {test_id: entry for test_id, entry in entries.items()
+                   if test_ids is None or test_id in test_ids}
+
+        if status_paths is not None:
+            stats = _stat_files({test_id: status_paths.get(test_id)
+                                 for test_id in entries})
+            entries = {test_id: entry for test_id, entry in entries.items()
+                       if stats[test_id] == (entry[1], entry[2])}
+
+        status = {}
+        for test_id, (when, _, _, state, note) in entries.items():
+            when = datetime.datetime.fromtimestamp(when, self._tz)
+            status[test_id] = StatusInfo(when, state, note)
+
+        return status
+
+    def compact(self):
+        """Merge all the logs into the snapshot.
+        :raises TestStatusError: When the index can't be compacted.
+        """
+
+        if not os.path.isdir(self.path):
+            return
+
+        try:
+            with lockfile.LockFile(self._lock_path, timeout=self.LOCK_TIMEOUT):
+                entries, _ = self._read()
+                self._compact(entries)
+        except (OSError, lockfile.TimeoutError) as err:
+            raise TestStatusError("Could not compact status index '{}': {}"
+                                  .format(self.path, err))
+
+    def log_paths(self):
+        """List all the (host) logs, including any left mid-compaction."""
+
+        return [os.path.join(self.path, fn) for fn in os.listdir(self.path)
+                if fn.endswith(self.LOG_EXT) or
+                fn.endswith(self.LOG_EXT + '.compacting')]
+
+    def _read(self):
+        """Read the snapshot and all the logs. This must be done while
+        holding the lock.
+        :returns: A dict of test_id -> (when, size, mtime_ns, state, note),
+            and the total size of the logs.
+        """
+
+        entries = {}
+        log_size = 0
+
+        paths = [os.path.join(self.path, self.SNAPSHOT_FN)]
+        paths.extend(self.log_paths())
+
+        for path in paths:
+            try:
+                with open(path, 'rb') as index_file:
+                    data = index_file.read()
+            except FileNotFoundError:
+                continue
+
+            if path != paths[0]:
+                log_size += len(data)
+
+            self._parse(data, entries)
+
+        return entries, log_size
+
+    @staticmethod
+    def _format(test_id, entry):
+        """Format an index line for the given entry."""
+
+        return '{} {:.6f} {} {} {} {}\n'.format(test_id, *entry)
+
+    @staticmethod
+    def _parse(data, entries):
+        """Parse index lines into the entries dict, keeping the latest entry
+        for each test."""
+
+        for line in data.decode('utf-8', 'ignore').split('\n'):
+            parts = line.split(' ', 5)
+            if len(parts) < 5:
+                continue
+
+            try:
+                test_id = int(parts[0])
+                when = float(parts[1])
+                size = int(parts[2])
+                mtime_ns = int(parts[3])
+            except ValueError:
+                continue
+
+            if test_id not in entries or entries[test_id][0] <= when:
+                note = parts[5] if len(parts) > 5 else ''
+                entries[test_id] = (when, size, mtime_ns, parts[4], note)
+
+    def _compact(self, entries):
+        """Write a new snapshot, given the entries read from the current one
+        and the logs. This must be done while holding the lock."""
+
+        # Move the logs aside first, so that any writes that happen while
+        # we're compacting go to new logs. Then pick up anything that was
+        # written to the old logs since we read them.
+        moved = []
+        for path in self.log_paths():
+            if path.endswith('.compacting'):
+                moved.append(path)
+            else:
+                os.rename(path, path + '.compacting')
+                moved.append(path + '.compacting')
+
+        for path in moved:
+            with open(path, 'rb') as log_file:
+                self._parse(log_file.read(), entries)
+
+        snapshot_path = os.path.join(self.path, self.SNAPSHOT_FN)
+        tmp_path = snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as snapshot:
+            for test_id in sorted(entries.keys()):
+                snapshot.write(self._format(test_id, entries[test_id]))
+        os.rename(tmp_path, snapshot_path)
+
+        for path in moved:
+            os.unlink(path)
+
+
+def _stat_files(paths, max_workers=BULK_WORKERS):
+    """Get the (size, mtime_ns) of each of the given files, in parallel.
+    :param dict paths: A dict of key -> path (or None).
+    :returns: A dict of key -> (size, mtime_ns), or None for files that
+        can't be stat'ed.
+    """
+
+    def stat_file(path):
+        if path is None:
+            return None
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+        return file_stat.st_size, file_stat.st_mtime_ns
+
+    keys = list(paths.keys())
+    if len(keys) > 1 and max_workers > 1:
+        with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(keys))) as pool:
+            results = list(pool.map(stat_file,
+                                    [paths[key] for key in keys]))
+    else:
+        results = [stat_file(paths[key]) for key in keys]
+
+    return dict(zip(keys, results))
+
+
+def get_current(index, tests):
+    """Get the current status of each of the given tests, from the index
+    where possible. Tests missing from the index, those whose status file
+    changed since the index entry was written (or all of them, if the index
+    can't be read) fall back to reading the test's status file, in parallel.
+    :param StatusIndex index: The status index. If None, the status files are
+        always used.
+    :param dict tests: A dictionary of test_id -> test path.
+    :returns: A dictionary of test_id -> StatusInfo.
+    """
+
+    status = {}
+
+    if index is not None:
+        status_paths = {test_id: os.path.join(test_path, 'status')
+                        for test_id, test_path in tests.items()}
+        try:
+            status = index.current(tests.keys(), status_paths)
+        except TestStatusError as err:
+            LOGGER.warning("Falling back to test status files: {}"
+                           .format(err))
+
+    missing = {os.path.join(test_path, 'status'): test_id
+               for test_id, test_path in tests.items()
+               if test_id not in status}
+
+    for path, status_info in bulk_current(missing.keys()).items():
+        status[missing[path]] = status_info
+
+    return status
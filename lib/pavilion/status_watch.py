@@ -0,0 +1,495 @@
+"""Watch a set of test status files, and report status changes as they
+happen. On Linux, local status files are watched with inotify, so that
+watching costs nothing while nothing is changing. Status files on network
+filesystems (which don't deliver inotify events for changes made by other
+hosts), or that can't be watched for other reasons, are followed through
+the status index instead, when it's enabled: only the index's (per host)
+logs are polled, and just the status files of the tests that show up in them
+are read. Status files that aren't in the index are polled directly.
+"""
+
+from pavilion.status_file import StatusFile, STATES, TestStatusError
+from pavilion.status_file import bulk_current
+from pavilion.status_index import StatusIndex
+import collections
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+LOGGER = logging.getLogger('pav.' + __name__)
+
+# Filesystems that won't tell us about changes made from other hosts.
+NETWORK_FS = ('nfs', 'nfs4', 'lustre', 'gpfs', 'cifs', 'smb3', 'smbfs',
+              'panfs', 'beegfs', 'ceph', 'fuse', '9p', 'afs')
+
+# States that a test won't (normally) move on from.
+FINAL_STATES = (STATES.COMPLETE, STATES.FAILED, STATES.RUN_DONE,
+                STATES.RUN_FAILED, STATES.RUN_ERROR, STATES.BUILD_FAILED,
+                STATES.BUILD_ERROR)
+
+# Inotify constants, from sys/inotify.h
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_MOVE_SELF = 0x800
+IN_DELETE_SELF = 0x400
+IN_IGNORED = 0x8000
+IN_Q_OVERFLOW = 0x4000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """A minimal inotify wrapper, using ctypes."""
+
+    _libc = None
+
+    def __init__(self):
+        """
+        :raises OSError: When inotify isn't available.
+        """
+
+        if Inotify._libc is None:
+            libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+            Inotify._libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "Inotify is not available.")
+
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=IN_MODIFY | IN_MOVE_SELF | IN_DELETE_SELF):
+        """Watch the given path.
+        :returns: The watch descriptor.
+        :raises OSError: When the path can't be watched (including when
+            we're out of watches).
+        """
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+
+        return wd
+
+    def read(self, timeout):
+        """Wait up to timeout seconds for events.
+        :returns: A list of (watch descriptor, mask) tuples.
+        """
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 64*1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size + name_len
+            events.append((wd, mask))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def fs_type(path):
+    """Get the filesystem type of the given path, according to
+    /proc/mounts. Returns None if it can't be determined."""
+
+    path = os.path.realpath(path)
+
+    best = None
+    best_type = None
+    try:
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point = parts[1].replace('\\040', ' ')
+                if (path == mount_point or
+                        path.startswith(mount_point.rstrip('/') + '/')):
+                    if best is None or len(mount_point) >= len(best):
+                        best = mount_point
+                        best_type = parts[2]
+    except (IOError, OSError):
+        return None
+
+    return best_type
+
+
+class IndexTail:
+    """Follows the logs of a status index, to find the tests whose status
+    has changed. Each check costs a stat of the index directory and of each
+    log, plus reading whatever was added to the logs."""
+
+    def __init__(self, index):
+        """
+        :param StatusIndex index: The index to follow. Changes from before
+            this was created aren't reported.
+        """
+
+        self.index = index
+        self._dir_key = None
+        self._log_paths = []
+        # Where we've read each log up to, by (device, inode), as compaction
+        # renames logs.
+        self._offsets = {}
+
+        self._list_logs()
+        for path in self._log_paths:
+            try:
+                log_stat = os.stat(path)
+            except OSError:
+                continue
+            self._offsets[(log_stat.st_dev, log_stat.st_ino)] = \
+                log_stat.st_size
+
+        self._snapshot_key = self._snapshot_stat()
+
+    def _list_logs(self):
+        """Update the list of logs, if the index directory changed."""
+
+        try:
+            dir_stat = os.stat(self.index.path)
+            dir_key = (dir_stat.st_ino, dir_stat.st_mtime_ns)
+            if dir_key != self._dir_key:
+                self._log_paths = self.index.log_paths()
+                self._dir_key = dir_key
+        except OSError:
+            self._log_paths = []
+            self._dir_key = None
+
+    def _snapshot_stat(self):
+        try:
+            snap_stat = os.stat(os.path.join(self.index.path,
+                                             StatusIndex.SNAPSHOT_FN))
+        except OSError:
+            return None
+        return snap_stat.st_ino, snap_stat.st_mtime_ns
+
+    def changed(self):
+        """Get the ids of the tests with new index entries since the last
+        check.
+        :returns: A set of test ids, or None if the index was compacted since
+            the last check (in which case some changes may have been missed).
+        """
+
+        self._list_logs()
+
+        test_ids = set()
+        offsets = {}
+        for path in self._log_paths:
+            try:
+                log_stat = os.stat(path)
+            except OSError:
+                # Compacted away.
+                continue
+
+            log_key = (log_stat.st_dev, log_stat.st_ino)
+            # Logs we haven't seen before are entirely new.
+            offset = self._offsets.get(log_key, 0)
+            if log_stat.st_size > offset:
+                try:
+                    with open(path, 'rb') as log_file:
+                        log_file.seek(offset)
+                        data = log_file.read()
+                except (IOError, OSError):
+                    data = b''
+
+                # Only take complete lines.
+                end = data.rfind(b'\n') + 1
+                offset += end
+                for line in data[:end].splitlines():
+                    try:
+                        test_ids.add(int(line.split(b' ', 1)[0]))
+                    except ValueError:
+                        continue
+
+            offsets[log_key] = offset
+
+        self._offsets = offsets
+
+        snapshot_key = self._snapshot_stat()
+        if snapshot_key != self._snapshot_key:
+            self._snapshot_key = snapshot_key
+            return None
+
+        return test_ids
+
+
+class StatusWatcher:
+    """Watches a set of status files, tracking the current state of each
+    and a count of tests in each state."""
+
+    def __init__(self, status_files, poll_interval=5, use_inotify=True,
+                 index=None):
+        """
+        :param dict status_files: A dict of key (test id) -> status file path.
+        :param float poll_interval: How often to check status files that
+            are polled rather than watched with inotify.
+        :param bool use_inotify: Whether to try to use inotify at all.
+        :param StatusIndex index: The status index, if it's enabled. Tests
+            that aren't watched with inotify are followed through it, as
+            long as the index is up to date for them.
+        """
+
+        self.poll_interval = poll_interval
+
+        # This has to start before we read the current status, so no
+        # changes are missed in between.
+        self._index_tail = None
+        if index is not None:
+            self._index_tail = IndexTail(index)
+
+        self._files = {key: StatusFile(path, create=False)
+                       for key, path in status_files.items()}
+        # Where we've read each file up to, and the file's
+        # (inode, size, mtime) when we last polled it.
+        self._offsets = {}
+        self._poll_keys = {}
+
+        self.current = {}
+        self.counts = collections.Counter()
+
+        by_path = {path: key for key, path in status_files.items()}
+        statuses = bulk_current(by_path.keys())
+        for path, status in statuses.items():
+            key = by_path[path]
+            self.current[key] = status
+            self.counts[status.state] += 1
+            try:
+                self._offsets[key] = os.stat(path).st_size
+            except OSError:
+                self._offsets[key] = 0
+
+        self._inotify = None
+        self._watches = {}
+        self._polled = set(self._files.keys())
+
+        if use_inotify:
+            self._setup_inotify()
+
+        # Tests followed through the status index.
+        self._indexed = set()
+        if self._index_tail is not None and self._polled:
+            self._setup_index(status_files)
+
+        self._last_poll = time.time()
+
+    def _setup_index(self, status_files):
+        """Follow the polled tests that are in the index (and whose index
+        entry is current) through the index instead."""
+
+        index = self._index_tail.index
+        try:
+            indexed = index.current(
+                self._polled,
+                {key: status_files[key] for key in self._polled})
+        except TestStatusError as err:
+            LOGGER.warning("Could not use the status index; polling status "
+                           "files instead: {}".format(err))
+            self._index_tail = None
+            return
+
+        self._indexed = set(indexed.keys())
+        self._polled -= self._indexed
+
+    def _setup_inotify(self):
+        """Watch every status file we can with inotify, leaving the rest
+        to be polled."""
+
+        fs_types = {}
+        for key, status_file in self._files.items():
+            dir_name = os.path.dirname(status_file.path)
+            # Tests generally share a few parent directories, so look up
+            # the filesystem type by the parent's parent.
+            parent = os.path.dirname(dir_name)
+            if parent not in fs_types:
+                fs_types[parent] = fs_type(dir_name)
+
+            fs_name = fs_types[parent]
+            if fs_name is None or fs_name.split('.')[0] in NETWORK_FS:
+                continue
+
+            try:
+                if self._inotify is None:
+                    self._inotify = Inotify()
+                wd = self._inotify.add_watch(status_file.path)
+            except OSError as err:
+                if err.errno == errno.ENOSPC:
+                    LOGGER.warning("Out of inotify watches; polling the "
+                                   "remaining status files.")
+                    break
+                elif self._inotify is None:
+                    # No inotify at all.
+                    LOGGER.info("Could not use inotify: {}".format(err))
+                    break
+                continue
+
+            self._watches[wd] = key
+            self._polled.discard(key)
+
+    @property
+    def polled(self):
+        """The number of status files that are polled directly."""
+        return len(self._polled)
+
+    @property
+    def indexed(self):
+        """The number of status files followed through the status index."""
+        return len(self._indexed)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def done(self, final_states=FINAL_STATES):
+        """Return True if every test is in one of the final states."""
+
+        return all(status.state in final_states
+                   for status in self.current.values())
+
+    def wait(self, timeout=None):
+        """Wait for status changes.
+        :param float timeout: How long to wait for changes. None waits until
+            there are changes.
+        :returns: A list of (key, StatusInfo) tuples for each new status,
+            in the order they happened (per test).
+        """
+
+        end = None if timeout is None else time.time() + timeout
+
+        while True:
+            changed = set()
+
+            polling = self._polled or self._indexed
+
+            wait_time = None
+            if polling:
+                wait_time = max(0, self._last_poll + self.poll_interval
+                                - time.time())
+            if end is not None:
+                remaining = max(0, end - time.time())
+                wait_time = remaining if wait_time is None \
+                    else min(wait_time, remaining)
+
+            if self._inotify is not None and self._watches:
+                events = self._inotify.read(wait_time)
+                for wd, mask in events:
+                    if mask & IN_Q_OVERFLOW:
+                        # We lost events; check everything.
+                        changed.update(self._watches.values())
+                    elif wd in self._watches:
+                        changed.add(self._watches[wd])
+                        if mask & IN_IGNORED:
+                            # The file was removed or moved; poll it instead.
+                            key = self._watches.pop(wd)
+                            self._polled.add(key)
+            elif wait_time is None:
+                raise RuntimeError("Nothing to wait on.")
+            else:
+                time.sleep(wait_time)
+
+            if polling and \
+                    time.time() >= self._last_poll + self.poll_interval:
+                changed.update(self._poll())
+                self._last_poll = time.time()
+
+            updates = []
+            for key in changed:
+                updates.extend(self._read_updates(key))
+
+            if updates or (end is not None and time.time() >= end):
+                return updates
+
+    def _poll(self):
+        """Return the keys of the polled (or indexed) files that have
+        changed."""
+
+        changed = self._poll_files(self._polled)
+
+        if self._indexed:
+            test_ids = self._index_tail.changed()
+            if test_ids is None:
+                # The index was compacted, so we may have missed entries.
+                changed.extend(self._poll_files(self._indexed))
+            else:
+                changed.extend(test_ids & self._indexed)
+
+        return changed
+
+    def _poll_files(self, keys):
+        """Return the given keys whose status files have changed."""
+
+        changed = []
+        for key in keys:
+            try:
+                stat = os.stat(self._files[key].path)
+            except OSError:
+                continue
+
+            poll_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if self._poll_keys.get(key) != poll_key:
+                self._poll_keys[key] = poll_key
+                if stat.st_size != self._offsets[key]:
+                    changed.append(key)
+
+        return changed
+
+    def _read_updates(self, key):
+        """Read any new complete status lines from the given status file,
+        and update the current state and counts accordingly."""
+
+        status_file = self._files[key]
+        offset = self._offsets[key]
+
+        try:
+            with open(status_file.path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size < offset:
+                    # The file was truncated or replaced; start over.
+                    offset = 0
+                file.seek(offset)
+                data = file.read()
+        except (IOError, OSError):
+            return []
+
+        # Only take complete lines.
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return []
+        self._offsets[key] = offset + end
+
+        updates = []
+        for line in data[:end].splitlines():
+            status = status_file._parse_status_line(line)
+            updates.append((key, status))
+
+            self.counts[self.current[key].state] -= 1
+            if not self.counts[self.current[key].state]:
+                del self.counts[self.current[key].state]
+            self.current[key] = status
+            self.counts[status.state] += 1
+
+        return updates
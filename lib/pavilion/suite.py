@@ -1,5 +1,6 @@
 from pavilion.test_config import PavTest
 from pavilion.lockfile import TimeoutError
+from pavilion import status_index
 from pavilion import utils
 
 import logging
@@ -11,18 +12,47 @@ class SuiteError(RuntimeError):
     pass
 
 
+def get_test_ids(pav_cfg, suite_id=None):
+    """Get the ids of the tests in the given suite, or in the user's last
+    suite if suite_id is None.
+    :raises SuiteError: When the suite can't be found or read.
+    """
+
+    if suite_id is None:
+        last_suite_fn = os.path.expanduser('~/.pavilion/last_suite')
+        try:
+            with open(last_suite_fn) as last_suite_file:
+                suite_id = int(last_suite_file.read().strip())
+        except (IOError, OSError, ValueError) as err:
+            raise SuiteError("Could not find your last suite in '{}': {}"
+                             .format(last_suite_fn, err))
+
+    suites_dir = os.path.join(pav_cfg.working_dir, 'suites')
+    suite_path = utils.make_id_path(suites_dir, suite_id)
+
+    # Suites are directories of symlinks to their tests, named by test id.
+    try:
+        return [int(name) for name in os.listdir(suite_path)
+                if name.isdigit()]
+    except OSError as err:
+        raise SuiteError("Could not read suite '{}' at '{}': {}"
+                         .format(suite_id, suite_path, err))
+
+
 class Suite:
     """Suites are a collection of tests. Every time """
 
     SUITE_ID_DIGITS = 7
     LOGGER_FMT = 'suite({})'
 
-    def __init__(self, pav_cfg, tests, _id=None):
+    def __init__(self, pav_cfg, tests, _id=None, id_block=None):
         """Initialize the suite.
         :param pav_cfg: The pavilion configuration object.
         :param list tests: The list of test objects that belong to this suite.
         :param int _id: The test id number. If this is given, it implies that
             we're regenerating this suite from saved files.
+        :param utils.IdReservation id_block: A block of reserved suite ids
+            to take this suite's id from, rather than allocating one.
         """
 
         self.pav_cfg = pav_cfg
@@ -37,8 +67,11 @@ class Suite:
         if _id is None:
             # Get the suite id and path.
             try:
-                self.id, self.path = utils.create_id_dir(suites_path)
-            except (OSError, TimeoutError) as err:
+                if id_block is not None:
+                    self.id, self.path = id_block.take()
+                else:
+                    self.id, self.path = utils.create_id_dir(suites_path)
+            except (OSError, TimeoutError, IndexError) as err:
                 raise SuiteError(
                     "Could not get id or suite directory in '{}': {}"
                     .format(suites_path, err))
@@ -114,3 +147,18 @@ class Suite:
         modified date for the test directory."""
         # Leave it up to the caller to deal with time properly.
         return os.stat(self.path).st_mtime
+
+    def status(self):
+        """Get the current status of every test in the suite. This uses the
+        status index when enabled, and otherwise reads the test status files
+        in parallel.
+        :returns: A dict of test_id -> StatusInfo.
+        """
+
+        index = None
+        if self.pav_cfg.status_index == 'true':
+            index = status_index.StatusIndex.from_working_dir(
+                self.pav_cfg.working_dir)
+
+        return status_index.get_current(
+            index, {test_id: test.path for test_id, test in self.tests.items()})
@@ -0,0 +1,229 @@
+"""Run a process while supervising its output.
+
+The process's stdout and stderr are read (through a single pipe, so their
+order is kept) and written to a log file in large chunks. The time of the
+last output is tracked in memory, so enforcing the 'silent' timeout never
+requires stat'ing the log, and both the silent and wall clock timeouts are
+enforced as soon as they pass rather than on the next polling interval.
+
+The process is started in its own session, so that when it's killed,
+everything it started (make, mpirun, etc.) is killed along with it.
+"""
+
+import errno
+import os
+import selectors
+import signal
+import subprocess
+import time
+
+# Read at most this much of the process's output at a time.
+READ_SIZE = 64*1024
+
+# Write buffered output to the log once there's this much of it...
+FLUSH_SIZE = 1024**2
+# ... or it's been buffered this long (in seconds), so the log is still
+# reasonably current for anyone watching it.
+FLUSH_INTERVAL = 1.0
+
+# Without a pidfd to wait on, check whether the process has exited this
+# often (in seconds), in case something it started is holding the output
+# pipe open.
+EXIT_POLL = 1.0
+
+TIMEOUT_SILENT = 'silent'
+TIMEOUT_WALL = 'wall'
+
+
+class ProcResult:
+    """How a supervised process went."""
+
+    def __init__(self):
+        self.returncode = None
+        # Which timeout (if any) the process was killed for.
+        self.timeout = None
+        self.output_bytes = 0
+        self.elapsed = None
+
+
+def _pidfd(proc):
+    """Get a pidfd for the process, if the OS supports it."""
+
+    if not hasattr(os, 'pidfd_open'):
+        return None
+
+    try:
+        return os.pidfd_open(proc.pid)
+    except OSError:
+        return None
+
+
+def _kill(proc):
+    """Kill the process, and everything it started, via its process
+    group."""
+
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # Everything in the group is already gone.
+        pass
+
+
+def supervise(cmd, log_file, cwd=None, silent_timeout=None,
+              wall_timeout=None):
+    """Run the given command, writing all of its output to log_file.
+    The process is killed if it goes silent_timeout seconds without
+    any output, or runs for more than wall_timeout seconds.
+    :param list cmd: The command to run.
+    :param log_file: A file object (opened in binary mode) to write the
+        output to.
+    :param str cwd: The directory to run the command in.
+    :param float silent_timeout: Seconds without output before giving up.
+    :param float wall_timeout: Total seconds before giving up.
+    :rtype: ProcResult
+    :raises OSError: When the process can't be started, or the log can't be
+        written.
+    """
+
+    result = ProcResult()
+    start = time.time()
+
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, start_new_session=True)
+    out_fd = proc.stdout.fileno()
+    os.set_blocking(out_fd, False)
+
+    pidfd = _pidfd(proc)
+
+    selector = selectors.DefaultSelector()
+    selector.register(out_fd, selectors.EVENT_READ, 'out')
+    if pidfd is not None:
+        selector.register(pidfd, selectors.EVENT_READ, 'exit')
+
+    buffer = bytearray()
+    last_output = start
+    last_flush = start
+    reading = True
+
+    try:
+        while reading:
+            now = time.time()
+
+            # Figure out how long we can wait for something to happen.
+            deadlines = []
+            if silent_timeout is not None:
+                deadlines.append(last_output + silent_timeout)
+            if wall_timeout is not None:
+                deadlines.append(start + wall_timeout)
+            if buffer:
+                deadlines.append(last_flush + FLUSH_INTERVAL)
+            if pidfd is None:
+                deadlines.append(now + EXIT_POLL)
+            wait = max(min(deadlines) - now, 0) if deadlines else None
+
+            exited = False
+            for key, _ in selector.select(wait):
+                if key.data == 'exit':
+                    exited = True
+                    continue
+
+                try:
+                    chunk = os.read(out_fd, READ_SIZE)
+                except OSError as err:
+                    if err.errno in (errno.EAGAIN, errno.EINTR):
+                        continue
+                    raise
+
+                if not chunk:
+                    # The process (and everything it started) closed its
+                    # output.
+                    reading = False
+                else:
+                    buffer.extend(chunk)
+                    result.output_bytes += len(chunk)
+                    last_output = time.time()
+
+            now = time.time()
+            if buffer and (len(buffer) >= FLUSH_SIZE or not reading or
+                           now - last_flush >= FLUSH_INTERVAL):
+                log_file.write(buffer)
+                log_file.flush()
+                buffer.clear()
+                last_flush = now
+
+            if not reading:
+                break
+
+            if exited or (pidfd is None and proc.poll() is not None):
+                # The process is done, but something it left running still
+                # has the pipe open. Grab whatever output is ready, and kill
+                # whatever is left.
+                _drain(out_fd, buffer, result)
+                _kill(proc)
+                break
+
+            if (wall_timeout is not None and
+                    now - start >= wall_timeout):
+                result.timeout = TIMEOUT_WALL
+            elif (silent_timeout is not None and
+                  now - last_output >= silent_timeout):
+                result.timeout = TIMEOUT_SILENT
+
+            if result.timeout is not None:
+                _kill(proc)
+                break
+    except BaseException:
+        # Don't leave anything running if we're interrupted. In its own
+        # session, the process won't get a Ctrl-C from the terminal.
+        _kill(proc)
+        raise
+    finally:
+        if buffer:
+            log_file.write(buffer)
+            log_file.flush()
+        selector.close()
+        proc.stdout.close()
+        if pidfd is not None:
+            os.close(pidfd)
+
+    # The output is closed, but the process itself may not be done yet. It
+    # can't produce any more output, so it's still subject to both timeouts.
+    while result.returncode is None:
+        deadlines = []
+        if result.timeout is None:
+            if silent_timeout is not None:
+                deadlines.append((last_output + silent_timeout,
+                                  TIMEOUT_SILENT))
+            if wall_timeout is not None:
+                deadlines.append((start + wall_timeout, TIMEOUT_WALL))
+
+        remaining = None
+        timeout_kind = None
+        if deadlines:
+            deadline, timeout_kind = min(deadlines)
+            remaining = max(deadline - time.time(), 0)
+
+        try:
+            result.returncode = proc.wait(timeout=remaining)
+        except subprocess.TimeoutExpired:
+            result.timeout = timeout_kind
+            _kill(proc)
+
+    result.elapsed = time.time() - start
+    return result
+
+
+def _drain(out_fd, buffer, result):
+    """Add whatever output is immediately available to the buffer."""
+
+    while True:
+        try:
+            chunk = os.read(out_fd, READ_SIZE)
+        except OSError:
+            return
+
+        if not chunk:
+            return
+
+        buffer.extend(chunk)
+        result.output_bytes += len(chunk)
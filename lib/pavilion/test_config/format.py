@@ -90,6 +90,11 @@ class TestConfigLoader(yc.YamlConfigLoader):
                           'of the url if is no suitable name. Use this '
                           'parameter to override behavior with a pre-defined '
                           'filename.'),
+            yc.StrElem(
+                'source_sha256',
+                help_text="The expected SHA-256 checksum (in hex) of the "
+                          "source file. Downloads that don't match are "
+                          "discarded, and the test fails to build."),
             yc.ListElem(
                 'modules', sub_elem=yc.StrElem(),
                 help_text="Modules to load into the build environment."),
@@ -113,7 +118,18 @@ class TestConfigLoader(yc.YamlConfigLoader):
                           "compiled on the host that launches the test."),
             yc.ListElem('cmds', sub_elem=yc.StrElem(),
                         help_text='The sequence of commands to run to perform '
-                                  'the build.')
+                                  'the build.'),
+            yc.StrElem(
+                'timeout',
+                help_text="The maximum time (in seconds) the build may take. "
+                          "Builds are also stopped if they go "
+                          "too long without producing any output."),
+            yc.StrElem(
+                'attach', choices=['symlink', 'lazy', 'hardlink'],
+                help_text="How to populate this test's build directory from "
+                          "the original build. Defaults to the 'build_attach' "
+                          "setting in the pavilion config. See there for "
+                          "details."),
             ],
             help_text="The test build configuration. This will be used to "
                       "dynamically generate a build script for building "
@@ -127,7 +143,11 @@ class TestConfigLoader(yc.YamlConfigLoader):
                                       "environment."),
             yc.ListElem('cmds', sub_elem=yc.StrElem(),
                         help_text='The sequence of commands to run to run the '
-                                  'test.')
+                                  'test.'),
+            yc.StrElem('timeout',
+                       help_text="The maximum time (in seconds) the test run "
+                                 "may take. Runs are also stopped if they go "
+                                 "too long without producing any output."),
         ],
                      help_text="The test run configuration. This will be used "
                                "to dynamically generate a run script for the "
@@ -226,6 +246,28 @@ class TestConfigLoader(yc.YamlConfigLoader):
                 del cls._RESULT_PARSERS.config_elems[section.name]
                 return
 
+    @classmethod
+    def schema_key(cls):
+        """Describe the structure of the config, including any sections
+        added by plugins, so loaded configs can be cached against it.
+        :rtype: str
+        """
+
+        return repr([cls._describe(elem) for elem in cls.ELEMENTS])
+
+    @classmethod
+    def _describe(cls, elem):
+        """Describe the given element and its sub-elements."""
+
+        desc = [type(elem).__name__, elem.name]
+        if hasattr(elem, 'config_elems'):
+            desc.append([cls._describe(sub_elem)
+                         for sub_elem in elem.config_elems.values()])
+        elif getattr(elem, '_sub_elem', None) is not None:
+            desc.append(cls._describe(elem._sub_elem))
+
+        return desc
+
     @classmethod
     def check_leaves(cls, elem):
         """
@@ -1,20 +1,24 @@
 from . import variables
+from pavilion import build_attach
+from pavilion import build_cache
+from pavilion import extract
+from pavilion import hash_cache
 from pavilion import lockfile
+from pavilion import log_sink
 from pavilion import scriptcomposer
+from pavilion import source_cache
+from pavilion import supervisor
+from pavilion import timings
 from pavilion import utils
 from pavilion import wget
 from pavilion.status_file import StatusFile, STATES
-import bz2
-import gzip
+from pavilion.status_index import StatusIndex
 import hashlib
 import json
 import logging
-import lzma
 import os
 import shutil
 import stat
-import subprocess
-import tarfile
 import time
 import urllib.parse
 import zipfile
@@ -31,10 +35,6 @@ class PavTestNotFoundError(RuntimeError):
     pass
 
 
-# Keep track of files we've already hashed and updated before.
-__HASHED_FILES = {}
-
-
 class PavTest:
     """The central pavilion test object. Handle saving, monitoring and running
     tests.
@@ -56,12 +56,15 @@ class PavTest:
 
     LOGGER = logging.getLogger('pav.PavTest')
 
-    def __init__(self, pav_cfg, config, test_id=None):
+    def __init__(self, pav_cfg, config, test_id=None, id_block=None):
         """Create an new PavTest object. If loading an existing test instance,
         use the PavTest.from_id method.
         :param pav_cfg: The pavilion configuration.
         :param config: The test configuration dictionary.
         :param test_id: The test id (for an existing test).
+        :param utils.IdReservation id_block: A block of reserved test ids
+            (from utils.reserve_ids) to take this test's id from. Otherwise
+            a new id is allocated on its own.
         """
 
         # Just about every method needs this
@@ -79,14 +82,23 @@ class PavTest:
 
         # Get an id for the test, if we weren't given one.
         if test_id is None:
-            self.id, self.path = utils.create_id_dir(tests_path)
-            self._save_config()
+            id_start = timings.now()
+            if id_block is not None:
+                self.id, self.path = id_block.take()
+            else:
+                self.id, self.path = utils.create_id_dir(tests_path)
+            self.timings = timings.Timings(self.path)
+            self.timings.record('id_alloc', id_start)
+
+            with self.timings.timer('config_save'):
+                self._save_config()
         else:
             self.id = test_id
             self.path = utils.make_id_path(tests_path, self.id)
             if not os.path.isdir(self.path):
                 raise PavTestNotFoundError(
                     "No test with id '{}' could be found.".format(self.id))
+            self.timings = timings.Timings(self.path)
 
         # Set a logger more specific to this test.
         self.LOGGER = logging.getLogger('pav.PavTest.{}'.format(self.id))
@@ -95,14 +107,23 @@ class PavTest:
         self._job_id = None
 
         # Setup the initial status file.
-        self.status = StatusFile(os.path.join(self.path, 'status'))
-        self.status.set(STATES.CREATED,
-                        "Test directory and status file created.")
+        status_index = None
+        if pav_cfg.status_index == 'true':
+            status_index = StatusIndex.from_working_dir(pav_cfg.working_dir)
+        self.status = StatusFile(os.path.join(self.path, 'status'),
+                                 index=status_index, index_key=self.id)
+        if test_id is None:
+            self.status.set(STATES.CREATED,
+                            "Test directory and status file created.")
 
         self.build_path = None
         self.build_name = None
         self.build_hash = None
         self.build_script_path = None
+        # How the source extraction went, for the build log.
+        self._setup_stats = []
+        # How attaching the build to this test went.
+        self.attach_stats = None
 
         build_config = self.config.get('build', {})
         if build_config:
@@ -112,12 +133,13 @@ class PavTest:
                 build_fn = os.path.basename(build_rp)
                 self.build_hash = build_fn.split('-')[-1]
             else:
-                self.build_hash = self._create_build_hash(build_config)
+                with self.timings.timer('build_hash'):
+                    self.build_hash = self._create_build_hash(build_config)
 
             short_hash = self.build_hash[:self.BUILD_HASH_BYTES*2]
             self.build_name = '{hash}'.format(hash=short_hash)
-            self.build_origin = os.path.join(pav_cfg.working_dir,
-                                             'builds', self.build_name)
+            self.build_origin = utils.make_build_path(
+                os.path.join(pav_cfg.working_dir, 'builds'), self.build_name)
 
             self.build_script_path = os.path.join(self.path, 'build.sh')
             self._write_script(self.build_script_path, build_config)
@@ -131,7 +153,10 @@ class PavTest:
             self.run_tmpl_path = None
             self.run_script_path = None
 
-        self.status.set(STATES.CREATED, "Test directory setup complete.")
+        # Reloading an existing test shouldn't change its status.
+        if test_id is None:
+            self._save_timings()
+            self.status.set(STATES.CREATED, "Test directory setup complete.")
 
     @classmethod
     def from_id(cls, pav_cfg, test_id):
@@ -231,18 +256,33 @@ class PavTest:
         :param str name: The name of the download, from the config's
             source_download_name field."""
 
-        fn = name
+        return wget.download_path(self._pav_cfg, loc, name)
 
-        if fn is None:
-            url_parts = urllib.parse.urlparse(loc)
-            path_parts = url_parts.path.split('/')
-            if path_parts and path_parts[-1]:
-                fn = path_parts[-1]
-            else:
-                # Use a hash of the url if we can't get a name from it.
-                fn = hashlib.sha256(loc.encode()).hexdigest()
+    @classmethod
+    def prefetch_sources(cls, pav_cfg, configs):
+        """Download (or update) the url sources of all the given test
+        configs at once, before the tests are created. Failures are left for
+        each test to report when it's created.
+        :param pav_cfg: The pavilion config.
+        :param list configs: Resolved test configs.
+        :returns: A dict of url -> WGetError for any failed downloads.
+        """
+
+        downloads = set()
+        for config in configs:
+            build_config = config.get('build', {})
+            src_loc = build_config.get('source_location')
+            if src_loc is not None and cls._isurl(src_loc):
+                dest = wget.download_path(
+                    pav_cfg, src_loc,
+                    build_config.get('source_download_name'))
+                downloads.add((src_loc, dest,
+                               build_config.get('source_sha256')))
 
-        return os.path.join(self._pav_cfg.working_dir, 'downloads', fn)
+        if not downloads:
+            return {}
+
+        return wget.get_manager(pav_cfg).prefetch(downloads)
 
     def _update_src(self, build_config):
         """Retrieve and/or check the existence of the files needed for the
@@ -260,8 +300,12 @@ class PavTest:
             dwn_name = build_config.get('source_download_name')
             src_dest = self._download_path(src_loc, dwn_name)
 
-            wget.update(self._pav_cfg, src_loc, src_dest)
+            # This shares any download of the same file that's already
+            # happening (or has happened) in this process.
+            wget.get_manager(self._pav_cfg).fetch(
+                src_loc, src_dest, build_config.get('source_sha256')).result()
 
+            self._check_sha256(src_dest, build_config)
             return src_dest
 
         src_path = self._find_file(src_loc, 'test_src')
@@ -270,19 +314,35 @@ class PavTest:
                                .format(src_loc))
 
         if os.path.isdir(src_path):
-            # For directories, update the directories mtime to match the
-            # latest mtime in the entire directory.
-            self._date_dir(src_path)
+            # Directories are hashed by their contents.
             return src_path
 
         elif os.path.isfile(src_path):
             # For static files, we'll end up just hashing the whole thing.
+            self._check_sha256(src_path, build_config)
             return src_path
 
         else:
             raise PavTestError("Source location '{}' points to something "
                                "unusable.".format(src_path))
 
+    def _check_sha256(self, src_path, build_config):
+        """Make sure the source file matches its expected checksum, if one
+        was given. The hash comes from the hash cache, so this normally
+        doesn't need to read the file again.
+        :raises PavTestError: On a mismatch.
+        """
+
+        expected = build_config.get('source_sha256')
+        if expected is None:
+            return
+
+        actual = self._hash_file(src_path).hex()
+        if actual != expected.strip().lower():
+            raise PavTestError(
+                "Source file '{}' has the wrong SHA-256 checksum. Expected "
+                "{}, got {}.".format(src_path, expected, actual))
+
     def _create_build_hash(self, build_config):
         """Turn the build config, and everything the build needs, into hash.
         This includes the build config itself, the source tarball, and all
@@ -292,15 +352,17 @@ class PavTest:
         # The hash order is:
         #  - The build config (sorted by key)
         #  - The src archive.
-        #    - For directories, the mtime (updated to the time of the most
-        #      recently updated file) is hashed instead.
+        #    - For directories, a hash of the contents of the tree.
         #  - All of the build's 'extra_files'
         #  - Each of the pav_cfg.build_hash_vars
 
         hash_obj = hashlib.sha256()
 
-        # Update the hash with the contents of the build config.
-        hash_obj.update(self._hash_dict(build_config))
+        # Update the hash with the contents of the build config. How the
+        # build is attached to tests doesn't change the build itself.
+        hash_obj.update(self._hash_dict(
+            {key: val for key, val in build_config.items()
+             if key != 'attach'}))
 
         src_path = self._update_src(build_config)
 
@@ -321,8 +383,6 @@ class PavTest:
             elif os.path.isfile(full_path):
                 hash_obj.update(self._hash_file(full_path))
             elif os.path.isdir(full_path):
-                self._date_dir(full_path)
-
                 hash_obj.update(self._hash_dir(full_path))
             else:
                 raise PavTestError("Extra file '{}' must be a regular "
@@ -338,53 +398,126 @@ class PavTest:
         build. Returns True if these steps completed successfully.
         """
 
+        try:
+            return self._build_and_attach()
+        finally:
+            self._save_timings()
+
+    # How many times to rebuild a build that was evicted while we were
+    # attaching it.
+    ATTACH_RETRIES = 2
+
+    def _build_and_attach(self):
+        """Perform the build (if needed) and attach it. See build()."""
+
+        tries = 0
+        while True:
+            if not self._build_if_needed() or not self._attach_build():
+                return False
+
+            # We may have touched the build just too late to keep the build
+            # cache from evicting it. Make sure what we attached is still
+            # there.
+            if os.path.isdir(self.build_origin):
+                return True
+
+            tries += 1
+            if tries > self.ATTACH_RETRIES:
+                msg = ("Build '{}' kept getting evicted while being attached."
+                       .format(self.build_name))
+                self.status.set(STATES.BUILD_ERROR, msg)
+                self.LOGGER.error(msg)
+                return False
+
+            self.LOGGER.warning("Build '{}' was evicted while being attached; "
+                                "building it again.".format(self.build_name))
+            try:
+                os.unlink(os.path.join(self.path, 'build_origin'))
+                shutil.rmtree(self.build_path)
+            except OSError as err:
+                msg = ("Could not remove the copy of evicted build '{}': {}"
+                       .format(self.build_name, err))
+                self.status.set(STATES.BUILD_ERROR, msg)
+                self.LOGGER.error(msg)
+                return False
+
+    def _build_if_needed(self):
+        """Perform the build, unless it already exists.
+        :returns: False if the build failed.
+        """
+
         # Only try to do the build if it doesn't already exist.
         if not os.path.exists(self.build_origin):
+            # In a sharded builds directory, the shard may not exist yet.
+            os.makedirs(os.path.dirname(self.build_origin), exist_ok=True)
+
             # Make sure another test doesn't try to do the build at
             # the same time.
             # Note cleanup of failed builds HAS to occur under this lock to
             # avoid a race condition, even though it would be way simpler to
             # do it in .build()
             lock_path = '{}.lock'.format(self.build_origin)
-            with lockfile.LockFile(lock_path, group=self._pav_cfg.shared_group):
-                # Make sure the build wasn't created while we waited for
-                # the lock.
-                if not os.path.exists(self.build_origin):
-                    build_dir = self.build_origin + '.tmp'
-
-                    # Attempt to perform the actual build, this shouldn't
-                    # raise an exception unless
-                    # something goes terribly wrong.
-                    if not self._build(build_dir):
-                        # The build failed. The reason should already be set
-                        # in the status file.
-                        def handle_error(_, path, exc_info):
-                            self.LOGGER.error("Error removing temporary build "
-                                              "directory '{}': {}"
-                                              .format(path, exc_info))
-
-                        # Cleanup the temporary build tree.
-                        shutil.rmtree(path=build_dir, onerror=handle_error)
-                        return False
-
-                    # Rename the build to it's final location.
-                    os.rename(build_dir, self.build_origin)
-
-        # Perform a symlink copy of the original build directory into our test
-        # directory.
-        try:
-            shutil.copytree(self.build_origin,
-                            self.build_path,
-                            symlinks=True,
-                            copy_function=utils.symlink_copy)
-        except OSError as err:
-            msg = "Could not perform the build directory copy: {}".format(err)
-            self.status.set(STATES.BUILD_ERROR, msg)
-            self.LOGGER.error(msg)
+            lock_start = timings.now()
+            # If someone else is performing this build, wait for them.
+            lock = lockfile.LockFile(
+                lock_path, group=self._pav_cfg.shared_group,
+                timeout=self._pav_cfg.build_lock_timeout)
+            try:
+                with lock:
+                    self.timings.record('build_lock', lock_start)
+                    # Make sure the build wasn't created while we waited for
+                    # the lock.
+                    if not os.path.exists(self.build_origin):
+                        return self._build_locked()
+            except lockfile.TimeoutError:
+                msg = ("Timed out after {}s waiting for someone else to "
+                       "perform build '{}'."
+                       .format(self._pav_cfg.build_lock_timeout,
+                               self.build_name))
+                self.status.set(STATES.BUILD_ERROR, msg)
+                self.LOGGER.error(msg)
+                return False
+
+        return True
+
+    def _build_locked(self):
+        """Perform the build and move it into place. This must be done while
+        holding the build's lock.
+        :returns: False if the build failed.
+        """
+
+        build_dir = self.build_origin + '.tmp'
+
+        # Attempt to perform the actual build, this shouldn't raise an
+        # exception unless something goes terribly wrong.
+        # Keep the status file open while building.
+        with self.status:
+            built = self._build(build_dir)
+
+        if not built:
+            # The build failed. The reason should already be set in the
+            # status file.
+            def handle_error(_, path, exc_info):
+                self.LOGGER.error("Error removing temporary build directory "
+                                  "'{}': {}".format(path, exc_info))
+
+            # Cleanup the temporary build tree.
+            shutil.rmtree(path=build_dir, onerror=handle_error)
             return False
 
-        # Touch the original build directory, so that we know it was used
-        # recently.
+        # Rename the build to it's final location.
+        os.rename(build_dir, self.build_origin)
+        return True
+
+    def _attach_build(self):
+        """Lease the build and attach it to this test.
+        :returns: False if the attach failed.
+        """
+
+        # Lease the build until our run is done, and touch it so that we
+        # know it was used recently. This is done before the copy, so that
+        # the build cache won't evict it out from under us.
+        self._lease_build()
         try:
             now = time.time()
             os.utime(self.build_origin, (now, now))
@@ -393,8 +526,39 @@ class PavTest:
                                 "'{}': {}"
                                 .format(self.build_origin, err))
 
+        # Attach the original build directory to our test directory, by
+        # default with a symlink copy.
+        attach_mode = self.config.get('build', {}).get('attach')
+        if not attach_mode:
+            attach_mode = self._pav_cfg.build_attach
+        try:
+            with self.timings.timer('attach'):
+                self.attach_stats = build_attach.attach(
+                    self.build_origin, self.build_path, attach_mode)
+            # Note which build we used, for the build cache.
+            os.symlink(self.build_origin,
+                       os.path.join(self.path, 'build_origin'))
+        except (OSError, ValueError) as err:
+            msg = "Could not perform the build directory copy: {}".format(err)
+            self.status.set(STATES.BUILD_ERROR, msg)
+            self.LOGGER.error(msg)
+            return False
+
+        self.LOGGER.debug(str(self.attach_stats))
+
         return True
 
+    def _lease_build(self):
+        """Lease our build from the build cache, so it isn't evicted while
+        we're using it."""
+
+        try:
+            build_cache.BuildCache(self._pav_cfg).lease(self.build_name,
+                                                        self.id)
+        except OSError as err:
+            self.LOGGER.warning("Could not lease build '{}': {}"
+                                .format(self.build_name, err))
+
     # A process should produce some output at least once every this many
     # seconds.
     BUILD_SILENT_TIMEOUT = 30
@@ -404,8 +568,10 @@ class PavTest:
         :returns: True or False, depending on whether the build appears to have
             been successful.
         """
+        self._setup_stats = []
         try:
-            self._setup_build_dir(build_dir)
+            with self.timings.timer('extract'):
+                self._setup_build_dir(build_dir)
         except PavTestError as err:
             self.status.set(STATES.BUILD_ERROR,
                             "Error setting up build directory '{}': {}"
@@ -415,67 +581,66 @@ class PavTest:
         build_log_path = os.path.join(build_dir, 'pav_build_log')
 
         try:
-            with open(build_log_path, 'w') as build_log:
-                proc = subprocess.Popen([self.build_script_path],
-                                        cwd=build_dir,
-                                        stdout=build_log,
-                                        stderr=build_log)
-
-                timeout = self.BUILD_SILENT_TIMEOUT
-                result = None
-                while result is None:
-                    try:
-                        result = proc.wait(timeout=timeout)
-                    except subprocess.TimeoutExpired:
-                        log_stat = os.stat(build_log_path)
-                        quiet_time = time.time() - log_stat.st_mtime
-                        # Has the output file changed recently?
-                        if self.BUILD_SILENT_TIMEOUT < quiet_time:
-                            # Give up on the build, and call it a failure.
-                            proc.kill()
-                            self.status.set(STATES.BUILD_FAILED,
-                                            "Build timed out after {} seconds."
-                                            .format(self.BUILD_SILENT_TIMEOUT))
-                            return False
-                        else:
-                            # Only wait a max of BUILD_SILENT_TIMEOUT next
-                            # 'wait'
-                            timeout = self.BUILD_SILENT_TIMEOUT - quiet_time
-
-        except subprocess.CalledProcessError as err:
-            self.status.set(STATES.BUILD_ERROR,
-                            "Error running build process: {}".format(err))
+            wall_timeout = self._get_timeout('build')
+        except PavTestError as err:
+            self.status.set(STATES.BUILD_ERROR, str(err))
             return False
 
+        try:
+            build_log = log_sink.from_config(self._pav_cfg, build_log_path)
         except (IOError, OSError) as err:
             self.status.set(STATES.BUILD_ERROR,
-                            "Error that's probably related to writing the "
-                            "build output: {}".format(err))
+                            "Could not open the build log: {}".format(err))
             return False
 
-        try:
-            self._fix_build_permissions()
-        except OSError as err:
-            self.LOGGER.warning("Error fixing build permissions: {}"
-                                .format(err))
+        with build_log:
+            try:
+                for stats in self._setup_stats:
+                    build_log.write('{}\n'.format(stats).encode('utf-8'))
+
+                with self.timings.timer('build'):
+                    proc_result = supervisor.supervise(
+                        [self.build_script_path], build_log, cwd=build_dir,
+                        silent_timeout=self.BUILD_SILENT_TIMEOUT,
+                        wall_timeout=wall_timeout)
+            except (IOError, OSError) as err:
+                self.status.set(STATES.BUILD_ERROR,
+                                "Error that's probably related to writing the "
+                                "build output: {}".format(err))
+                return False
+
+            if proc_result.timeout is None and proc_result.returncode == 0:
+                # The log is still open, so it can be written to after
+                # it becomes read only.
+                try:
+                    with self.timings.timer('build_perms'):
+                        checked, changed, elapsed = \
+                            self._fix_build_permissions(build_dir)
+                    build_log.write(
+                        "Fixed permissions on {} of {} files in {:.2f}s.\n"
+                        .format(changed, checked, elapsed).encode('utf-8'))
+                except OSError as err:
+                    self.LOGGER.warning("Error fixing build permissions: {}"
+                                        .format(err))
+
+        if proc_result.timeout is not None:
+            self.status.set(STATES.BUILD_FAILED,
+                            self._timeout_msg('Build', proc_result.timeout,
+                                              self.BUILD_SILENT_TIMEOUT,
+                                              wall_timeout))
+            return False
+        result = proc_result.returncode
 
         if result != 0:
+            # Failed builds are deleted, so their permissions weren't fixed.
             self.status.set(STATES.BUILD_FAILED,
                             "Build returned a non-zero result.")
             return False
         else:
-
             self.status.set(STATES.BUILD_DONE, "Build completed successfully.")
             return True
 
-    TAR_SUBTYPES = (
-        'gzip',
-        'x-gzip',
-        'x-bzip2',
-        'x-xz',
-        'x-tar',
-        'x-lzma',
-    )
+    TAR_SUBTYPES = extract.SUBTYPES + ('x-tar',)
 
     def _setup_build_dir(self, build_path):
         """Setup the build directory, by extracting or copying the source
@@ -517,68 +682,32 @@ class PavTest:
             category, subtype = utils.get_mime_type(src_path)
 
             if category == 'application' and subtype in self.TAR_SUBTYPES:
-                if tarfile.is_tarfile(src_path):
-                    try:
-                        with tarfile.open(src_path, 'r') as tar:
-                            # Filter out all but the top level items.
-                            top_level = [m for m in tar.members
-                                         if '/' not in m.name]
-                            # If the file contains only a single directory,
-                            # make that directory the build directory. This
-                            # should be the default in most cases.
-                            if len(top_level) == 1 and top_level[0].isdir():
-                                tmpdir = '{}.zip'.format(build_path)
-                                os.mkdir(tmpdir)
-                                tar.extractall(tmpdir)
-                                opath = os.path.join(tmpdir,
-                                                     top_level[0].name)
-                                os.rename(opath, build_path)
-                                os.rmdir(tmpdir)
-                            else:
-                                # Otherwise, the build path will contain the
-                                # extracted contents of the archive.
-                                os.mkdir(build_path)
-                                tar.extractall(build_path)
-                    except (OSError, IOError,
-                            tarfile.CompressionError, tarfile.TarError) as err:
-                        raise PavTestError(
-                            "Could not extract tarfile '{}' into '{}': {}"
-                            .format(src_path, build_path, err))
-
-                else:
-                    # If it's a compressed file but isn't a tar, extract the
-                    # file into the build directory.
-                    # All the python compression libraries have the same basic
-                    # interface, so we can just dynamically switch between
-                    # modules.
-                    if subtype in ('gzip', 'x-gzip'):
-                        comp_lib = gzip
-                    elif subtype == 'x-bzip2':
-                        comp_lib = bz2
-                    elif subtype in ('x-xz', 'x-lzma'):
-                        comp_lib = lzma
+                # Archives are extracted in a single streaming pass. If the
+                # archive contains only a single directory, that directory
+                # becomes the build directory. This should be the default in
+                # most cases.
+                try:
+                    if extract.is_tar(src_path, subtype):
+                        self._extract_tar(src_path, subtype, build_path)
                     elif subtype == 'x-tar':
                         raise PavTestError(
                             "Test src file '{}' is a bad tar file."
                             .format(src_path))
                     else:
-                        raise RuntimeError("Unhandled compression type. '{}'"
-                                           .format(subtype))
-
-                    decomp_fn = src_path.split('/')[-1]
-                    decomp_fn = decomp_fn.split('.', 1)[0]
-                    decomp_fn = os.path.join(build_path, decomp_fn)
-                    os.mkdir(build_path)
-
-                    try:
-                        with comp_lib.open(src_path) as infile, \
-                                open(decomp_fn, 'wb') as outfile:
-                            shutil.copyfileobj(infile, outfile)
-                    except (OSError, IOError, lzma.LZMAError) as err:
-                        raise PavTestError(
-                            "Error decompressing compressed file "
-                            "'{}' into '{}': {}"
-                            .format(src_path, decomp_fn, err))
+                        # If it's a compressed file but isn't a tar, extract
+                        # the file into the build directory.
+                        decomp_fn = src_path.split('/')[-1]
+                        decomp_fn = decomp_fn.split('.', 1)[0]
+                        decomp_fn = os.path.join(build_path, decomp_fn)
+                        os.mkdir(build_path)
+
+                        self._setup_stats.append(extract.decompress(
+                            src_path, subtype, decomp_fn))
+                except (OSError, extract.ExtractError,
+                        source_cache.SourceCacheError) as err:
+                    raise PavTestError(
+                        "Could not extract '{}' into '{}': {}"
+                        .format(src_path, build_path, err))
 
             elif category == 'application' and subtype == 'zip':
                 try:
@@ -586,9 +715,14 @@ class PavTest:
                     # above with tarfiles.
                     with zipfile.ZipFile(src_path) as zipped:
 
+                        stats = extract.ExtractStats(src_path, 'python zipfile')
                         tmpdir = '{}.unzipped'.format(build_path)
                         os.mkdir(tmpdir)
                         zipped.extractall(tmpdir)
+                        stats.bytes_out = sum(info.file_size
+                                              for info in zipped.infolist())
+                        stats.done()
+                        self._setup_stats.append(stats)
 
                         files = os.listdir(tmpdir)
                         if (len(files) == 1 and
@@ -629,28 +763,49 @@ class PavTest:
                     "Could not copy extra file '{}' to dest '{}': {}"
                     .format(path, dest, err))
 
+    def _extract_tar(self, src_path, subtype, build_path):
+        """Extract a tar archive into the build directory, through the
+        source cache when it's enabled.
+        :raises extract.ExtractError: When direct extraction fails.
+        :raises source_cache.SourceCacheError: When the cache can't be used.
+        """
+
+        cache = source_cache.SourceCache(self._pav_cfg)
+        if not cache.enabled:
+            self._setup_stats.append(
+                extract.extract_tar(src_path, subtype, build_path))
+            return
+
+        digest = self._hash_file(src_path)
+        extract_stats, link_stats = cache.populate(src_path, subtype, digest,
+                                                   build_path)
+        if extract_stats is not None:
+            self._setup_stats.append(extract_stats)
+        self._setup_stats.append(link_stats)
+
     RUN_SILENT_TIMEOUT = 5*60
 
-    def _fix_build_permissions(self):
+    def _fix_build_permissions(self, build_dir):
         """The files in a build directory should never be writable, but
             directories should be. Users are thus allowed to delete build
             directories and their files, but never modify them. Additions,
             deletions within test build directories will effect the soft links,
             not the original files themselves. (This applies both to owner and
             group).
+        :param str build_dir: The build directory to fix.
+        :returns: The number of files checked and changed, and how long
+            it took.
         :raises OSError: If we lack permissions or something else goes wrong."""
 
         # We rely on the umask to handle most restrictions.
         # This just masks out the write bits.
-        file_mask = 0o777555
+        file_mask = 0o7555
 
         # We shouldn't have to do anything to directories, they should have
         # the correct permissions already.
-        for path, _, files in os.walk(self.build_origin):
-            for file in files:
-                file_path = os.path.join(path, file)
-                st = os.stat(file_path)
-                os.chmod(file_path, st.st_mode & file_mask)
+        start = time.time()
+        checked, changed = utils.mask_file_perms(build_dir, file_mask)
+        return checked, changed, time.time() - start
 
     def run(self, sched_vars):
         """Run the test, returning True on success, False otherwise.
@@ -658,8 +813,29 @@ class PavTest:
         template.
         """
 
+        # Tests can sit in a queue for a while, so renew our lease on the
+        # build now that we're actually using it.
+        if self.build_name is not None:
+            self._lease_build()
+
+        # Keep the status file open for the duration of the run.
+        try:
+            with self.status:
+                return self._run(sched_vars)
+        finally:
+            self._save_timings()
+            # We're done with our build, as far as the build cache is
+            # concerned.
+            if self.build_name is not None:
+                build_cache.BuildCache(self._pav_cfg).release(self.build_name,
+                                                              self.id)
+
+    def _run(self, sched_vars):
+        """Perform the run. See run()."""
+
         if self.run_tmpl_path is not None:
             # Convert the run script template into the final run script.
+            tmpl_start = timings.now()
             try:
                 var_man = variables.VariableSetManager()
                 var_man.add_var_set('sched', sched_vars)
@@ -677,36 +853,32 @@ class PavTest:
             except PavTestError as err:
                 self.LOGGER.error(err)
                 self.status.set(STATES.RUN_ERROR, err)
+            self.timings.record('run_template', tmpl_start)
 
         run_log_path = os.path.join(self.path, 'run.log')
 
-        with open(run_log_path, 'wb') as run_log:
-            proc = subprocess.Popen([self.run_script_path],
-                                    cwd=self.build_path,
-                                    stdout=run_log,
-                                    stderr=run_log)
+        try:
+            wall_timeout = self._get_timeout('run')
+        except PavTestError as err:
+            self.status.set(STATES.RUN_ERROR, str(err))
+            return False
 
+        with log_sink.from_config(self._pav_cfg, run_log_path) as run_log:
             # Run the test, but timeout if it doesn't produce any output every
-            # RUN_SILENT_TIMEOUT seconds
-            timeout = self.RUN_SILENT_TIMEOUT
-            result = None
-            while result is None:
-                try:
-                    result = proc.wait(timeout=timeout)
-                except subprocess.TimeoutExpired:
-                    out_stat = os.stat(run_log_path)
-                    quiet_time = time.time() - out_stat.st_mtime
-                    # Has the output file changed recently?
-                    if self.RUN_SILENT_TIMEOUT < quiet_time:
-                        # Give up on the build, and call it a failure.
-                        proc.kill()
-                        self.status.set(STATES.RUN_FAILED,
-                                        "Run timed out after {} seconds."
-                                        .format(self.RUN_SILENT_TIMEOUT))
-                        return False
-                    else:
-                        # Only wait a max of BUILD_SILENT_TIMEOUT next 'wait'
-                        timeout = self.RUN_SILENT_TIMEOUT - quiet_time
+            # RUN_SILENT_TIMEOUT seconds, or runs too long.
+            with self.timings.timer('run'):
+                proc_result = supervisor.supervise(
+                    [self.run_script_path], run_log, cwd=self.build_path,
+                    silent_timeout=self.RUN_SILENT_TIMEOUT,
+                    wall_timeout=wall_timeout)
+
+        if proc_result.timeout is not None:
+            self.status.set(STATES.RUN_FAILED,
+                            self._timeout_msg('Run', proc_result.timeout,
+                                              self.RUN_SILENT_TIMEOUT,
+                                              wall_timeout))
+            return False
+        result = proc_result.returncode
 
         if result != 0:
             self.status.set(STATES.RUN_FAILED, "Test run failed.")
@@ -716,6 +888,45 @@ class PavTest:
                             "Test run has completed successfully.")
             return True
 
+    def _get_timeout(self, section):
+        """Get the wall clock timeout (in seconds) for the given section
+        ('build' or 'run') of the test config.
+        :returns: The timeout, or None if there isn't one.
+        :raises PavTestError: For invalid timeouts.
+        """
+
+        timeout = self.config.get(section, {}).get('timeout')
+        if timeout in (None, ''):
+            return None
+
+        try:
+            timeout = float(timeout)
+        except ValueError:
+            raise PavTestError("Invalid {} timeout '{}'. It must be a number "
+                               "of seconds.".format(section, timeout))
+
+        return timeout if timeout > 0 else None
+
+    @staticmethod
+    def _timeout_msg(what, timeout, silent_timeout, wall_timeout):
+        """Describe a process timeout for the status file."""
+
+        if timeout == supervisor.TIMEOUT_WALL:
+            return ("{} exceeded its time limit of {} seconds."
+                    .format(what, wall_timeout))
+        else:
+            return ("{} timed out after {} seconds without output."
+                    .format(what, silent_timeout))
+
+    def _save_timings(self):
+        """Save the phase timings, if possible."""
+
+        try:
+            self.timings.save()
+        except OSError as err:
+            self.LOGGER.warning("Could not save test timings to '{}': {}"
+                                .format(self.timings.path, err))
+
     def process_results(self):
         """Process the results of the test."""
 
@@ -726,7 +937,7 @@ class PavTest:
             False otherwise.
         """
 
-        if 'build' not in self.config:
+        if self.build_path is None:
             return True
 
         if os.path.islink(self.build_path):
@@ -741,6 +952,10 @@ class PavTest:
 
             return True
 
+        # The build may have already been copied into the test directory (as
+        # 'pav run' does before scheduling tests).
+        return os.path.isdir(self.build_path)
+
     @property
     def job_id(self):
 
@@ -806,7 +1021,16 @@ class PavTest:
         return hash_obj.digest()
 
     def _hash_file(self, path):
-        """Hash the given file (which is assumed to exist).
+        """Hash the given file (which is assumed to exist). The hash is only
+        actually computed if the file isn't in the working_dir hash cache.
+        :param str path: Path to the file to hash.
+        """
+
+        cache = hash_cache.get_cache(self._pav_cfg.working_dir)
+        return cache.hash_file(path, self._hash_file_contents, alg='sha256')
+
+    def _hash_file_contents(self, path):
+        """Hash the contents of the given file.
         :param str path: Path to the file to hash.
         """
 
@@ -820,36 +1044,16 @@ class PavTest:
 
         return hash_obj.digest()
 
-    @staticmethod
-    def _hash_dir(path):
-        """Instead of hashing the files within a directory, we just create a
-            'hash' based on it's name and mtime, assuming we've run _date_dir
-            on it before hand. This produces an arbitrary string, not a hash.
+    def _hash_dir(self, path):
+        """Hash the contents of the given directory tree. Only files that
+        changed since the last time the tree was hashed are actually read
+        (see hash_cache).
         :param str path: The path to the directory.
-        :returns: The 'hash'
+        :returns: The hash digest.
         """
 
-        dir_stat = os.stat(path)
-        return '{} {:0.5f}'.format(path, dir_stat.st_mtime).encode('utf-8')
-
-    @staticmethod
-    def _date_dir(base_path):
-        """Update the mtime of the given directory or path to the the latest
-        mtime contained within.
-        :param str base_path: The root of the path to evaluate.
-        """
-
-        src_stat = os.stat(base_path)
-        latest = src_stat.st_mtime
-
-        paths = utils.flat_walk(base_path)
-        for path in paths:
-            dir_stat = os.stat(path)
-            if dir_stat.st_mtime > latest:
-                latest = dir_stat.st_mtime
-
-        if src_stat.st_mtime != latest:
-            os.utime(base_path, (src_stat.st_atime, latest))
+        cache = hash_cache.get_cache(self._pav_cfg.working_dir)
+        return cache.hash_dir(path, self._hash_file_contents, alg='sha256')
 
     def _write_script(self, path, config):
         """Write a build or run script or template. The formats for each are
@@ -1,10 +1,13 @@
+from . import format
 from . import string_parser
 from . import variables
 from .format import TestConfigError, KEY_NAME_RE
 from .format import TestConfigLoader, TestSuiteLoader
 from collections import defaultdict
+from pavilion import config_cache
+from pavilion import config_index
 import logging
-import os
+import yaml_config
 
 # Config file types
 CONF_HOST = 'hosts'
@@ -22,12 +25,8 @@ def find_config(pav_config, conf_type, conf_name):
     :param conf_name: The name of the config (without a file extension).
     :return: The path to the first matching config found, or None if one wasn't found.
     """
-    for conf_dir in pav_config.config_dirs:
-        path = os.path.join(conf_dir, conf_type, '{}.yaml'.format(conf_name))
-        if os.path.exists(path):
-            return path
 
-    return None
+    return config_index.get_index(pav_config).find(conf_type, conf_name)
 
 
 def get_tests(pav_config, host, modes, tests):
@@ -47,32 +46,26 @@ def get_tests(pav_config, host, modes, tests):
     test_config_loader = TestConfigLoader()
 
     if host is None:
-        # Use the defaults if a host config isn't given.
-        base_config = test_config_loader.load_empty()
+        host_cfg_path = None
+        base_paths = []
     else:
         host_cfg_path = find_config(pav_config, CONF_HOST, host)
         if host_cfg_path is None:
             raise TestConfigError("Could not find {} config file for {}.".format(CONF_HOST, host))
+        base_paths = [host_cfg_path]
 
-        try:
-            with open(host_cfg_path) as host_cfg_file:
-                # Load and validate the host test config defaults.
-                base_config = test_config_loader.load(host_cfg_file)
-        except (IOError, OSError) as err:
-            raise TestConfigError("Could not open host config '{}': {}".format(host_cfg_path, err))
-
+    mode_cfg_paths = []
     for mode in modes:
         mode_cfg_path = find_config(pav_config, CONF_MODE, mode)
 
         if mode_cfg_path is None:
             raise TestConfigError("Could not find {} config file for {}.".format(CONF_MODE, mode))
+        mode_cfg_paths.append(mode_cfg_path)
+    base_paths.extend(mode_cfg_paths)
 
-        try:
-            with open(mode_cfg_path) as mode_cfg_file:
-                # Load this mode_config and merge it into the base_config.
-                base_config = test_config_loader.load_merge(base_config, mode_cfg_file)
-        except (IOError, OSError) as err:
-            raise TestConfigError("Could not open mode config '{}': {}".format(mode_cfg_path, err))
+    base_config = _load_cached(
+        pav_config, 'base', base_paths,
+        lambda: _load_base_config(test_config_loader, host_cfg_path, mode_cfg_paths))
 
     # A dictionary of test suites to a list of subtests to run in that suite.
     all_tests = defaultdict(lambda: dict())
@@ -111,56 +104,10 @@ def get_tests(pav_config, host, modes, tests):
                 raise TestConfigError("Could not find test suite {}. Looked in these locations: {}"
                                       .format(test_suite, pav_config.config_dirs))
 
-            try:
-                with open(test_suite_path) as test_suite_file:
-                    test_suite_cfg = test_suite_loader.load(test_suite_file)
-
-            except (IOError, OSError) as err:
-                raise TestConfigError("Could not open test suite config {}: {}"
-                                      .format(test_suite_path, err))
-
-            # Organize tests into an inheritance tree.
-            depended_on_by = defaultdict(lambda: list())
-            # All the tests for this suite.
-            suite_tests = {}
-            # Tests that haven't been processed whose dependencies are resolved.
-            dep_resolved = []
-            for test_cfg_name, test_cfg in test_suite_cfg.items():
-                if test_cfg.get('inherits_from') is None:
-                    test_cfg.inherits_from = '__base__'
-                    dep_resolved.append(test_cfg_name)
-                else:
-                    depended_on_by[test_cfg.inherits_from].append(test_cfg)
-
-                suite_tests[test_cfg_name] = test_cfg
-
-            suite_tests['__base__'] = base_config
-
-            # Resolve all the dependencies
-            while dep_resolved:
-                test_cfg_name = dep_resolved.pop(0)
-                test_cfg = suite_tests[test_cfg_name]
-                parent = suite_tests[test_cfg.inherits_from]
-
-                suite_tests[test_cfg_name] = test_config_loader.merge(parent, test_cfg)
-
-                dep_resolved.append(depended_on_by.get(test_cfg_name, []))
-                del depended_on_by[test_cfg_name]
-
-            if depended_on_by:
-                raise TestConfigError("Tests in suite '{}' have dependencies on '{}' that "
-                                      "could not be resolved."
-                                      .format(test_suite_path, depended_on_by.keys()))
-
-            # Add some basic information to each test config.
-            for test_cfg_name, test_cfg in suite_tests:
-                test_cfg['name'] = test_suite_cfg
-                test_cfg['suite'] = test_suite
-                test_cfg['suite_path'] = test_suite_path
-                if 'variables' not in test_cfg:
-                    test_cfg['variables'] = dict()
-                if 'permutations' not in test_cfg:
-                    test_cfg['permutations'] = dict()
+            suite_tests = _load_cached(
+                pav_config, 'suite', base_paths + [test_suite_path],
+                lambda: _load_suite(test_config_loader, test_suite_loader, base_config,
+                                    test_suite, test_suite_path))
 
             all_tests[test_suite] = suite_tests
 
@@ -180,6 +127,121 @@ def get_tests(pav_config, host, modes, tests):
     return picked_tests
 
 
+def _load_cached(pav_config, kind, paths, build):
+    """Get a loaded config from the config cache (if it's enabled), or
+    build it with the given function.
+    :param pav_config: The pavilion config.
+    :param str kind: The kind of config.
+    :param list paths: The config files it's built from.
+    :param build: A function that loads the config.
+    """
+
+    if pav_config.config_cache != 'true':
+        return build()
+
+    # The loader modules themselves are part of the key, as is the schema,
+    # since plugins add to it.
+    paths = [format.__file__, yaml_config.__file__] + paths
+
+    cache = config_cache.get_cache(pav_config.working_dir)
+    return cache.get(kind, paths, TestConfigLoader.schema_key(), build)
+
+
+def _load_base_config(test_config_loader, host_cfg_path, mode_cfg_paths):
+    """Load the host config (or the defaults), and merge the mode configs
+    into it.
+    :param TestConfigLoader test_config_loader: The test config loader.
+    :param str host_cfg_path: The host config file, if any.
+    :param list mode_cfg_paths: The mode config files.
+    """
+
+    if host_cfg_path is None:
+        # Use the defaults if a host config isn't given.
+        base_config = test_config_loader.load_empty()
+    else:
+        try:
+            with open(host_cfg_path) as host_cfg_file:
+                # Load and validate the host test config defaults.
+                base_config = test_config_loader.load(host_cfg_file)
+        except (IOError, OSError) as err:
+            raise TestConfigError("Could not open host config '{}': {}".format(host_cfg_path, err))
+
+    for mode_cfg_path in mode_cfg_paths:
+        try:
+            with open(mode_cfg_path) as mode_cfg_file:
+                # Load this mode_config and merge it into the base_config.
+                base_config = test_config_loader.load_merge(base_config, mode_cfg_file)
+        except (IOError, OSError) as err:
+            raise TestConfigError("Could not open mode config '{}': {}".format(mode_cfg_path, err))
+
+    return base_config
+
+
+def _load_suite(test_config_loader, test_suite_loader, base_config, test_suite,
+                test_suite_path):
+    """Load the given test suite, and resolve the inheritance of its tests.
+    :param TestConfigLoader test_config_loader: The test config loader.
+    :param TestSuiteLoader test_suite_loader: The test suite loader.
+    :param base_config: The base (host and mode) config the tests inherit from.
+    :param str test_suite: The name of the suite.
+    :param str test_suite_path: The suite's config file.
+    :returns: A dict of test name -> test config.
+    """
+
+    try:
+        with open(test_suite_path) as test_suite_file:
+            test_suite_cfg = test_suite_loader.load(test_suite_file)
+
+    except (IOError, OSError) as err:
+        raise TestConfigError("Could not open test suite config {}: {}"
+                              .format(test_suite_path, err))
+
+    # Organize tests into an inheritance tree.
+    depended_on_by = defaultdict(lambda: list())
+    # All the tests for this suite.
+    suite_tests = {}
+    # Tests that haven't been processed whose dependencies are resolved.
+    dep_resolved = []
+    for test_cfg_name, test_cfg in test_suite_cfg.items():
+        if test_cfg.get('inherits_from') is None:
+            test_cfg.inherits_from = '__base__'
+            dep_resolved.append(test_cfg_name)
+        else:
+            depended_on_by[test_cfg.inherits_from].append(test_cfg)
+
+        suite_tests[test_cfg_name] = test_cfg
+
+    suite_tests['__base__'] = base_config
+
+    # Resolve all the dependencies
+    while dep_resolved:
+        test_cfg_name = dep_resolved.pop(0)
+        test_cfg = suite_tests[test_cfg_name]
+        parent = suite_tests[test_cfg.inherits_from]
+
+        suite_tests[test_cfg_name] = test_config_loader.merge(parent, test_cfg)
+
+        dep_resolved.append(depended_on_by.get(test_cfg_name, []))
+        del depended_on_by[test_cfg_name]
+
+    if depended_on_by:
+        raise TestConfigError("Tests in suite '{}' have dependencies on '{}' that "
+                              "could not be resolved."
+                              .format(test_suite_path, depended_on_by.keys()))
+
+    # Add some basic information to each test config.
+    for test_cfg_name, test_cfg in suite_tests:
+        test_cfg['name'] = test_suite_cfg
+        test_cfg['suite'] = test_suite
+        test_cfg['suite_path'] = test_suite_path
+        if 'variables' not in test_cfg:
+            test_cfg['variables'] = dict()
+        if 'permutations' not in test_cfg:
+            test_cfg['permutations'] = dict()
+
+    return suite_tests
+
+
 NOT_OVERRIDABLE = ['name', 'suite', 'suite_path']
 
 
@@ -231,13 +293,15 @@ def _apply_overrides(test_cfg, overrides, _first_level=True):
                                   "Key: {}, Type: {}.".format(key, type(test_cfg[key])))
 
 
-        # TODO: Write this function, maybe?
 def get_all_tests(pav_config):
-    """Find all the tests within known config directories.
-    :param dict pav_config:
-    :return:
+    """Find all the test suites within known config directories.
+    :param pav_config: The pavilion config data.
+    :return: A dict of test suite name -> the path to the suite config that
+        takes precedence.
     """
 
+    return config_index.get_index(pav_config).names(CONF_TEST)
+
 
 def resolve_permutations(raw_test_cfg, pav_vars, sys_vars):
     """Resolve permutations for all used permutation variables, returning a variable manager for
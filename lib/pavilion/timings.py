@@ -0,0 +1,141 @@
+"""Per-phase timings for tests.
+
+Each test records how long each phase of its life took in 'timings.json'
+in its test directory, as {phase: [wall clock start, duration]}. Durations
+are measured with the monotonic clock; the wall clock start is just so the
+phases can be put in order. A test's phases are recorded by different
+processes (the build and run usually happen on different hosts), so each
+save merges with what's already in the file.
+"""
+
+from contextlib import contextmanager
+import json
+import math
+import os
+import time
+
+TIMINGS_FN = 'timings.json'
+
+# Every phase, in the order they normally happen.
+PHASES = (
+    'id_alloc',      # Getting the test's id and directory.
+    'config_save',   # Saving the test config.
+    'build_hash',    # Hashing the build config, source and extra files.
+    'build_lock',    # Waiting for the build lock.
+    'extract',       # Extracting/copying the source into the build dir.
+    'build',         # Running the build script.
+    'build_perms',   # Fixing the build's permissions.
+    'attach',        # Attaching the build to the test.
+    'run_template',  # Resolving the run script template.
+    'run',           # Running the run script.
+)
+
+# The phases that are the test doing its own work. Everything else is
+# Pavilion overhead.
+TEST_PHASES = ('build', 'run')
+
+
+def now():
+    """Get a start time for Timings.record()."""
+    return time.time(), time.monotonic()
+
+
+class Timings:
+    """The phase timings for a single test."""
+
+    def __init__(self, test_path):
+        self.path = os.path.join(test_path, TIMINGS_FN)
+        self.times = {}
+
+    def record(self, phase, start):
+        """Record that the given phase took from start (from now()) until
+        now."""
+
+        wall_start, mono_start = start
+        self.times[phase] = [round(wall_start, 3),
+                             round(time.monotonic() - mono_start, 6)]
+
+    @contextmanager
+    def timer(self, phase):
+        """Time the enclosed block as the given phase. The time is recorded
+        even if the block raises an exception."""
+
+        start = now()
+        try:
+            yield
+        finally:
+            self.record(phase, start)
+
+    def save(self):
+        """Merge our timings into the timings file.
+        :raises OSError: When the file can't be written.
+        """
+
+        if not self.times:
+            return
+
+        times = load(os.path.dirname(self.path))
+        times.update(self.times)
+
+        tmp_path = '{}.{}'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as timings_file:
+            json.dump(times, timings_file, separators=(',', ':'))
+        os.rename(tmp_path, self.path)
+
+
+def load(test_path):
+    """Load the timings for the test at the given path.
+    :returns: A dict of phase -> [start, duration]. Empty if the test has no
+        timings.
+    """
+
+    try:
+        with open(os.path.join(test_path, TIMINGS_FN)) as timings_file:
+            times = json.load(timings_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+    return times if isinstance(times, dict) else {}
+
+
+def percentile(values, pct):
+    """Get the given percentile (0-100) of the sorted values, by the nearest
+    rank method."""
+
+    if not values:
+        return None
+
+    rank = max(int(math.ceil(pct/100*len(values))), 1)
+    return values[rank - 1]
+
+
+def aggregate(all_times, percentiles=(50, 90, 99)):
+    """Summarize the phase durations of many tests.
+    :param list all_times: A list of timings dicts, as from load().
+    :param percentiles: The percentiles to compute.
+    :returns: A dict of phase -> {'count', 'total', 'max', and 'p<N>' for
+        each percentile}. Phases are in PHASES order, with any unknown
+        phases last.
+    """
+
+    durations = {}
+    for times in all_times:
+        for phase, (_, duration) in times.items():
+            durations.setdefault(phase, []).append(duration)
+
+    phases = [phase for phase in PHASES if phase in durations]
+    phases.extend(sorted(set(durations) - set(PHASES)))
+
+    summary = {}
+    for phase in phases:
+        values = sorted(durations[phase])
+        stats = {
+            'count': len(values),
+            'total': sum(values),
+            'max': values[-1],
+        }
+        for pct in percentiles:
+            stats['p{}'.format(pct)] = percentile(values, pct)
+        summary[phase] = stats
+
+    return summary
@@ -1,6 +1,9 @@
 # This file contains assorted utility functions.
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
+import stat
 import subprocess
 from pavilion import lockfile
 
@@ -60,19 +63,455 @@ def symlink_copy(src, dst):
     return os.symlink(src, dst)
 
 
+# How many threads to fix permissions with.
+PERM_WORKERS = 8
+
+
+def _mask_dir_perms(dir_path, mask):
+    """Mask the mode of every file directly in dir_path. Files are
+    stat'ed and chmod'ed relative to the directory's fd, so the path is only
+    looked up once.
+    :returns: A list of subdirectory paths, the number of files checked,
+        and the number changed.
+    """
+
+    sub_dirs = []
+    checked = changed = 0
+
+    dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        with os.scandir(dir_fd) as scan:
+            for entry in scan:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(os.path.join(dir_path, entry.name))
+                elif entry.is_file(follow_symlinks=False):
+                    checked += 1
+                    mode = stat.S_IMODE(entry.stat(follow_symlinks=False)
+                                        .st_mode)
+                    if mode & mask != mode:
+                        os.chmod(entry.name, mode & mask, dir_fd=dir_fd)
+                        changed += 1
+    finally:
+        os.close(dir_fd)
+
+    return sub_dirs, checked, changed
+
+
+def mask_file_perms(path, mask, max_workers=PERM_WORKERS):
+    """Apply the given mask to the permissions of every regular file under
+    path. Symlinks are left alone, as are files whose mode already fits the
+    mask. The directories at each level of the tree are handled in
+    parallel.
+    :param str path: The directory tree to fix.
+    :param int mask: The permission bits to keep.
+    :param int max_workers: The maximum number of threads to use.
+    :returns: The number of files checked, and the number changed.
+    :raises OSError: The first error encountered, after fixing everything
+        else that could be.
+    """
+
+    checked = changed = 0
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        level = [path]
+        while level:
+            futures = [pool.submit(_mask_dir_perms, dir_path, mask)
+                       for dir_path in level]
+            level = []
+            for future in futures:
+                try:
+                    sub_dirs, dir_checked, dir_changed = future.result()
+                except OSError as err:
+                    error = error or err
+                    continue
+
+                level.extend(sub_dirs)
+                checked += dir_checked
+                changed += dir_changed
+
+    if error is not None:
+        raise error
+
+    return checked, changed
+
+
 ID_DIGITS = 7
 ID_FMT = '{id:0{digits}d}'
 
+# Id and build directories can either be 'flat' (every entry directly in the
+# base directory), or 'sharded' into fan-out sub-directories to keep any one
+# directory from growing huge. Sharded id directories look like
+# '<base>/00/12/0012345', and sharded build directories look like
+# '<base>/ab/abcdef0123456789'. The layout of a base directory is recorded in
+# a marker file within it; no marker means flat.
+LAYOUT_FN = '.layout'
+LAYOUT_FLAT = 'flat'
+LAYOUT_SHARDED = 'sharded'
+LAYOUTS = (LAYOUT_FLAT, LAYOUT_SHARDED)
+
+# The layout of each base directory we've looked at.
+_LAYOUTS = {}
+
+
+def get_layout(base_path):
+    """Get the layout of the given id or build directory. The result is
+    cached for the life of the process.
+    :param str base_path: The id or build directory.
+    :returns: One of LAYOUTS.
+    """
+
+    if base_path not in _LAYOUTS:
+        layout = LAYOUT_FLAT
+        try:
+            with open(os.path.join(base_path, LAYOUT_FN)) as layout_file:
+                layout = layout_file.read().strip()
+        except (IOError, OSError):
+            pass
+
+        if layout not in LAYOUTS:
+            raise ValueError("Invalid layout '{}' in directory '{}'."
+                             .format(layout, base_path))
+
+        _LAYOUTS[base_path] = layout
+
+    return _LAYOUTS[base_path]
+
+
+def _set_layout(base_path, layout):
+    """Record the layout of the given base directory."""
+
+    layout_path = os.path.join(base_path, LAYOUT_FN)
+    tmp_path = layout_path + '.tmp'
+    with open(tmp_path, 'w') as layout_file:
+        layout_file.write(layout)
+    os.rename(tmp_path, layout_path)
+
+    _LAYOUTS[base_path] = layout
+
+
+def _shard_id_name(name):
+    """Get the sharded relative path for an id directory name."""
+    return os.path.join(name[:2], name[2:4], name)
+
+
+def _shard_build_name(name):
+    """Get the sharded relative path for a build directory name."""
+    return os.path.join(name[:2], name)
+
 
 def make_id_path(base_path, id_):
     """Create the full path to an id directory given its base path and
     the id."""
-    return os.path.join(base_path, ID_FMT.format(id=id_, digits=ID_DIGITS))
+
+    name = ID_FMT.format(id=id_, digits=ID_DIGITS)
+
+    if get_layout(base_path) == LAYOUT_SHARDED:
+        return os.path.join(base_path, _shard_id_name(name))
+    else:
+        return os.path.join(base_path, name)
+
+
+def make_build_path(base_path, build_name):
+    """Create the full path to a build directory given the base builds
+    directory and the build name (hash)."""
+
+    if get_layout(base_path) == LAYOUT_SHARDED:
+        return os.path.join(base_path, _shard_build_name(build_name))
+    else:
+        return os.path.join(base_path, build_name)
+
+
+def _mkdir_id(path):
+    """Make the given id directory, and any missing shard directories above
+    it.
+    :raises FileExistsError: When the id directory already exists.
+    """
+
+    try:
+        os.mkdir(path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.mkdir(path)
+
+
+def _list_flat(base_path, min_len):
+    """List the entries in a flat base directory that could be ids or
+    build names (so no lock files, temp dirs or shard directories).
+    :returns: A list of (name, path) tuples.
+    """
+
+    entries = []
+    for name in os.listdir(base_path):
+        path = os.path.join(base_path, name)
+        if (len(name) >= min_len and '.' not in name and
+                os.path.isdir(path) and not os.path.islink(path)):
+            entries.append((name, path))
+
+    return entries
+
+
+def _list_sharded(base_path, depth):
+    """List the entries in a sharded base directory.
+    :param str base_path: The base id or build directory.
+    :param int depth: How many levels of shard directories there are.
+    :returns: A list of (name, path) tuples.
+    """
+
+    shards = [base_path]
+    for i in range(depth):
+        sub_shards = []
+        for shard in shards:
+            for name in os.listdir(shard):
+                path = os.path.join(shard, name)
+                if len(name) == 2 and os.path.isdir(path):
+                    sub_shards.append(path)
+        shards = sub_shards
+
+    entries = []
+    for shard in shards:
+        entries.extend(_list_flat(shard, 3))
+
+    return entries
+
+
+def list_id_dirs(id_dir):
+    """List every id directory in the given base directory, regardless of
+    layout. This is slow on large directories.
+    :returns: A list of (id, path) tuples, sorted by id.
+    """
+
+    if get_layout(id_dir) == LAYOUT_SHARDED:
+        entries = _list_sharded(id_dir, 2)
+    else:
+        entries = _list_flat(id_dir, 3)
+
+    ids = [(int(name), path) for name, path in entries if name.isdigit()]
+    ids.sort()
+
+    return ids
+
+
+def list_build_dirs(build_dir):
+    """List every build directory in the given base directory, regardless
+    of layout.
+    :returns: A list of (build_name, path) tuples.
+    """
+
+    if get_layout(build_dir) == LAYOUT_SHARDED:
+        return _list_sharded(build_dir, 1)
+    else:
+        return _list_flat(build_dir, 3)
+
+
+def _convert_layout(base_path, layout, depth, shard_func):
+    """Move every entry in base_path to where it belongs in the given layout.
+    Entries are looked for in both layouts, so an interrupted conversion can
+    simply be run again.
+    :returns: A dict of old paths to new paths for every moved entry.
+    """
+
+    if layout not in LAYOUTS:
+        raise ValueError("Invalid layout '{}'.".format(layout))
+
+    # Write the new layout first, so that nothing new is created using the
+    # old one.
+    _set_layout(base_path, layout)
+
+    entries = _list_flat(base_path, 3) + _list_sharded(base_path, depth)
+
+    moved = {}
+    for name, path in entries:
+        if layout == LAYOUT_SHARDED:
+            new_path = os.path.join(base_path, shard_func(name))
+        else:
+            new_path = os.path.join(base_path, name)
+
+        if new_path == path:
+            continue
+
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.rename(path, new_path)
+        moved[path] = new_path
+
+    if layout == LAYOUT_FLAT:
+        _remove_shards(base_path, depth)
+
+    return moved
+
+
+def _remove_shards(path, depth):
+    """Remove the (hopefully empty) shard directories under path, deepest
+    first. Non-empty shards are left alone."""
+
+    for name in os.listdir(path):
+        shard = os.path.join(path, name)
+        if len(name) == 2 and os.path.isdir(shard):
+            if depth > 1:
+                _remove_shards(shard, depth - 1)
+            try:
+                os.rmdir(shard)
+            except OSError:
+                pass
+
+
+def convert_id_dir(id_dir, layout):
+    """Convert the given id directory (such as working_dir/tests) to the
+    given layout in place. This holds the id lock the whole time, but other
+    Pavilion processes using the directory shouldn't be running.
+    :param str id_dir: The id directory to convert.
+    :param str layout: One of LAYOUTS.
+    :returns: A dict of old paths to new paths for every moved id directory.
+    :raises OSError: When we can't move things.
+    :raises TimeoutError: If we couldn't get the lock in time.
+    """
+
+    lockfile_path = os.path.join(id_dir, ID_LOCK_FN)
+    with lockfile.LockFile(lockfile_path, timeout=ID_LOCK_TIMEOUT):
+        return _convert_layout(id_dir, layout, 2, _shard_id_name)
+
+
+def convert_build_dir(build_dir, layout):
+    """Convert the given builds directory to the given layout in place. No
+    builds should be running while this happens.
+    :param str build_dir: The build directory to convert.
+    :param str layout: One of LAYOUTS.
+    :returns: A dict of old paths to new paths for every moved build.
+    :raises OSError: When we can't move things.
+    """
+
+    return _convert_layout(build_dir, layout, 1, _shard_build_name)
+
+
+def repoint_symlinks(root, moved):
+    """Walk the tree at root (or just root itself, if it's a symlink), and
+    update any symlinks that point into a moved file or directory to point
+    to the new location instead.
+    :param str root: The path to walk.
+    :param dict moved: A dictionary of old (real) paths to new paths.
+    :returns: The number of symlinks updated.
+    """
+
+    if os.path.islink(root):
+        links = [root]
+    else:
+        links = []
+        for path, dirs, files in os.walk(root):
+            for name in dirs + files:
+                link_path = os.path.join(path, name)
+                if os.path.islink(link_path):
+                    links.append(link_path)
+
+    count = 0
+    for link_path in links:
+        target = os.path.realpath(link_path)
+
+        # Look for the closest moved parent of the target.
+        prefix = target
+        while prefix not in moved and os.path.dirname(prefix) != prefix:
+            prefix = os.path.dirname(prefix)
+
+        if prefix in moved:
+            os.unlink(link_path)
+            os.symlink(moved[prefix] + target[len(prefix):], link_path)
+            count += 1
+
+    return count
+
+
+# Each id directory keeps a small counter file, so that we don't have to
+# list the (potentially huge) directory to find the next id. It contains the
+# next never-used id on the first line, and optionally a line of free id
+# ranges (as 'start-end', inclusive) found by compact_id_dir().
+ID_COUNTER_FN = '.id_counter'
+ID_LOCK_FN = '.lockfile'
+# How long to wait on the id lock. Bulk reservations may hold it for a while.
+ID_LOCK_TIMEOUT = 10
+
+
+def _scan_ids(id_dir):
+    """Get a sorted list of the ids of every id directory in id_dir. This
+    is slow for large directories, and should only be used when the counter
+    file needs to be rebuilt.
+    :param str id_dir: The directory to scan.
+    :rtype: list
+    """
+
+    return [id_ for id_, _ in list_id_dirs(id_dir)]
+
+
+def _read_id_counter(id_dir):
+    """Read the id counter file for the given id directory.
+    :param str id_dir: The id directory.
+    :returns: The next unused id and a list of free (start, end) id ranges.
+        The next id will be None if the counter file is missing or corrupt.
+    """
+
+    counter_path = os.path.join(id_dir, ID_COUNTER_FN)
+
+    try:
+        with open(counter_path) as counter_file:
+            lines = counter_file.read().split('\n')
+    except (IOError, OSError):
+        return None, []
+
+    try:
+        next_id = int(lines[0])
+        free = []
+        if len(lines) > 1:
+            for rng in lines[1].split():
+                start, end = rng.split('-')
+                free.append((int(start), int(end)))
+    except ValueError:
+        return None, []
+
+    return next_id, free
+
+
+def _write_id_counter(id_dir, next_id, free):
+    """Atomically replace the id counter file for the given id directory.
+    :param str id_dir: The id directory.
+    :param int next_id: The next never-used id.
+    :param list free: A list of free (start, end) id ranges.
+    :raises OSError: When we can't write the file.
+    """
+
+    counter_path = os.path.join(id_dir, ID_COUNTER_FN)
+    tmp_path = counter_path + '.tmp'
+
+    with open(tmp_path, 'w') as counter_file:
+        counter_file.write('{}\n'.format(next_id))
+        counter_file.write(' '.join('{}-{}'.format(start, end)
+                                    for start, end in free))
+
+    os.rename(tmp_path, counter_path)
+
+
+def _load_id_counter(id_dir):
+    """Read the id counter, rebuilding it from a directory scan if it's
+    missing or damaged. This should only be called while holding the id
+    lock.
+    :param str id_dir: The id directory.
+    :returns: The next unused id and a list of free (start, end) id ranges.
+    """
+
+    next_id, free = _read_id_counter(id_dir)
+
+    if next_id is None:
+        # No counter yet (or it was damaged). Start after the highest
+        # existing id.
+        ids = _scan_ids(id_dir)
+        next_id = ids[-1] + 1 if ids else 1
+        free = []
+
+    return next_id, free
 
 
 def create_id_dir(id_dir):
-    """In the given directory, create the lowest numbered (positive integer)
-    directory that doesn't already exist.
+    """In the given directory, create the next available numbered (positive
+    integer) directory. Ids are handed out from a persistent counter, so
+    this doesn't depend on the number of existing directories. Ids freed
+    by deleting old directories are only reused after a compact_id_dir().
     :param str id_dir: Path to the directory that contains these 'id'
         directories
     :returns: The id and path to the created directory.
@@ -81,24 +520,141 @@ def create_id_dir(id_dir):
 
     """
 
-    lockfile_path = os.path.join(id_dir, '.lockfile')
-    with lockfile.LockFile(lockfile_path, timeout=1):
-        ids = os.listdir(id_dir)
-        # Only return the test directories that could be integers.
-        ids = filter(str.isdigit, ids)
-        ids = filter(lambda d: os.path.isdir(os.path.join(id_dir, d)), ids)
-        ids = list(map(int, ids))
-        ids.sort()
+    lockfile_path = os.path.join(id_dir, ID_LOCK_FN)
+    with lockfile.LockFile(lockfile_path, timeout=ID_LOCK_TIMEOUT):
+        next_id, free = _load_id_counter(id_dir)
+
+        while True:
+            if free:
+                id_, end = free.pop(0)
+                if id_ < end:
+                    free.insert(0, (id_ + 1, end))
+            else:
+                id_ = next_id
+                next_id += 1
+
+            path = make_id_path(id_dir, id_)
+            try:
+                _mkdir_id(path)
+                break
+            except FileExistsError:
+                # Something created this directory without the counter
+                # (an older Pavilion, or a stale counter). Skip it.
+                continue
+
+        _write_id_counter(id_dir, next_id, free)
 
-        # Find the first unused id.
-        id_ = 1
-        while id_ in ids:
-            id_ += 1
+    return id_, path
 
-        path = make_id_path(id_dir, id_)
-        os.mkdir(path)
 
-    return id_, path
+class IdReservation:
+    """A block of already created id directories, as returned by
+    reserve_ids(). Ids are handed out in order with take(). Any that are
+    never taken should be given back with release()."""
+
+    def __init__(self, id_dir, reserved):
+        """
+        :param str id_dir: The id directory the ids were reserved from.
+        :param list reserved: A list of (id, path) tuples.
+        """
+
+        self.id_dir = id_dir
+        self._reserved = deque(reserved)
+
+    def take(self):
+        """Get the next reserved id and path.
+        :returns: The id and path to its (already created) directory.
+        :raises IndexError: When the reservation is exhausted.
+        """
+
+        if not self._reserved:
+            raise IndexError("Id reservation in '{}' is exhausted."
+                             .format(self.id_dir))
+
+        return self._reserved.popleft()
+
+    def release(self):
+        """Remove the directories of any ids that were never taken. The ids
+        themselves won't be handed out again until the id directory is
+        compacted."""
+
+        while self._reserved:
+            _, path = self._reserved.pop()
+            try:
+                os.rmdir(path)
+            except OSError:
+                # It's not a problem if it's already gone or was used anyway.
+                pass
+
+    def __len__(self):
+        return len(self._reserved)
+
+
+def reserve_ids(id_dir, count):
+    """Reserve a block of count consecutive ids in id_dir, creating all of
+    their directories under a single acquisition of the id lock. The block
+    will only be non-consecutive if it runs into directories created without
+    the id counter.
+    :param str id_dir: Path to the directory that contains the 'id'
+        directories.
+    :param int count: The number of ids to reserve.
+    :rtype: IdReservation
+    :raises OSError: on directory creation failure.
+    :raises TimeoutError: If we couldn't get the lock in time.
+    """
+
+    reserved = []
+
+    lockfile_path = os.path.join(id_dir, ID_LOCK_FN)
+    with lockfile.LockFile(lockfile_path, timeout=ID_LOCK_TIMEOUT):
+        next_id, free = _load_id_counter(id_dir)
+
+        # Always save the counter, so that any directories we did create
+        # aren't handed out again.
+        try:
+            while len(reserved) < count:
+                id_ = next_id
+                next_id += 1
+
+                path = make_id_path(id_dir, id_)
+                try:
+                    _mkdir_id(path)
+                except FileExistsError:
+                    continue
+
+                reserved.append((id_, path))
+        finally:
+            _write_id_counter(id_dir, next_id, free)
+
+    return IdReservation(id_dir, reserved)
+
+
+def compact_id_dir(id_dir):
+    """Rebuild the id counter for the given directory from a full scan,
+    recording any gaps in the id sequence so that they will be reused by
+    future calls to create_id_dir(). This is slow on large directories, and
+    is meant to be run occasionally after cleaning out old tests.
+    :param str id_dir: Path to the directory that contains the 'id'
+        directories.
+    :returns: The number of free ids found below the highest used id.
+    :raises OSError: When we can't read the directory or write the counter.
+    :raises TimeoutError: If we couldn't get the lock in time.
+    """
+
+    lockfile_path = os.path.join(id_dir, ID_LOCK_FN)
+    with lockfile.LockFile(lockfile_path, timeout=ID_LOCK_TIMEOUT):
+        ids = _scan_ids(id_dir)
+
+        free = []
+        last = 0
+        for id_ in ids:
+            if id_ > last + 1:
+                free.append((last + 1, id_ - 1))
+            last = id_
+
+        _write_id_counter(id_dir, last + 1, free)
+
+    return sum(end - start + 1 for start, end in free)
 
 
 def cprint(*args, color=33, **kwargs):
@@ -1,8 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from pavilion import hash_cache
+from pavilion import lockfile
 import urllib.parse
 import requests
+import requests.adapters
+import urllib3
+import json
 import os
-import tempfile
-import dbm
+import threading
+import time
+import hashlib
 import logging
 
 LOGGER = logging.getLogger('pavilion.' + __file__)
@@ -16,44 +23,347 @@ class WGetError(RuntimeError):
 # returning whatever we last got.
 REDIRECT_LIMIT = 10
 
+# How many downloads to run at once, and how many connections to keep open.
+DOWNLOAD_WORKERS = 8
 
-def get(pav_cfg, url, dest):
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _get_session():
+    """Get the session shared by every request in this process, so that
+    connections are pooled and reused."""
+
+    global _SESSION
+
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            session.trust_env = False
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=DOWNLOAD_WORKERS,
+                pool_maxsize=DOWNLOAD_WORKERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _SESSION = session
+
+    return _SESSION
+
+
+# Downloads are read in chunks between these sizes (in bytes). The chunk
+# size doubles while reads complete in under FAST_READ seconds, and halves
+# when they take more than four times that.
+MIN_CHUNK = 64*1024
+MAX_CHUNK = 8*1024**2
+FAST_READ = 0.25
+
+# How many times to resume an interrupted download within a single get().
+RESUME_RETRIES = 3
+
+# Downloads in progress are written to '<dest>.part'. What's needed to
+# resume them (the url and the response's ETag or Last-Modified) is kept
+# in '<dest>.part.json'.
+PARTIAL_EXT = '.part'
+PARTIAL_STATE_EXT = '.part.json'
+
+
+class _Interrupted(Exception):
+    """The connection was lost part way through a download."""
+    pass
+
+
+def _load_partial(dest, url):
+    """Get the size and validator for a partial download of url to dest.
+    :returns: The size and validator, or (0, None) if there's nothing to
+        resume."""
+
+    try:
+        with open(dest + PARTIAL_STATE_EXT) as state_file:
+            state = json.load(state_file)
+        size = os.path.getsize(dest + PARTIAL_EXT)
+    except (IOError, OSError, ValueError):
+        return 0, None
+
+    if not isinstance(state, dict) or state.get('url') != url or \
+            not state.get('validator'):
+        return 0, None
+
+    return size, state['validator']
+
+
+def _save_partial(dest, url, validator):
+    """Note how to resume the download of url to dest, if it's possible."""
+
+    state_path = dest + PARTIAL_STATE_EXT
+    try:
+        if validator is None:
+            if os.path.exists(state_path):
+                os.unlink(state_path)
+        else:
+            with open(state_path, 'w') as state_file:
+                json.dump({'url': url, 'validator': validator}, state_file)
+    except (IOError, OSError) as err:
+        LOGGER.warning("Could not save download state to '{}': {}"
+                       .format(state_path, err))
+
+
+def _discard_partial(dest):
+    """Remove any partial download of dest, so the next try starts over."""
+
+    for ext in PARTIAL_EXT, PARTIAL_STATE_EXT:
+        try:
+            os.unlink(dest + ext)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            LOGGER.warning("Could not remove partial download '{}': {}"
+                           .format(dest + ext, err))
+
+
+def _hash_partial(path, size):
+    """Get a sha256 hash object for the first size bytes of the file."""
+
+    hash_obj = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while size > 0:
+            chunk = file.read(min(MAX_CHUNK, size))
+            if not chunk:
+                break
+            hash_obj.update(chunk)
+            size -= len(chunk)
+
+    return hash_obj
+
+
+def _get_once(pav_cfg, session, url, dest, proxies, known=None):
+    """Download (or resume downloading) url to '<dest>.part'.
+    :param dict known: The download index entry for the current copy of
+        dest, if any. The request is made conditional on it having changed.
+    :returns: The sha256 hash object for the complete file and the response
+        headers, or (None, None) if the known copy is still current.
+    :raises _Interrupted: When the transfer is cut short.
+    """
+
+    part_path = dest + PARTIAL_EXT
+    offset, validator = _load_partial(dest, url)
+
+    headers = {}
+    if offset:
+        # If-Range makes the server send the whole thing if it changed.
+        headers = {'Range': 'bytes={}-'.format(offset),
+                   'If-Range': validator}
+    elif known is not None:
+        if known.get('etag'):
+            headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            headers['If-Modified-Since'] = known['last_modified']
+
+    try:
+        with session.get(url, proxies=proxies, stream=True, headers=headers,
+                         timeout=pav_cfg.wget_timeout) as response:
+            if offset and not response.ok:
+                # The partial download can't be resumed (a 416 usually
+                # means it was already complete). Start over from scratch.
+                _discard_partial(dest)
+                raise _Interrupted("Could not resume from byte {}: {} {}"
+                                   .format(offset, response.status_code,
+                                           response.reason))
+
+            # Don't save error pages as the download.
+            response.raise_for_status()
+
+            if response.status_code == 304:
+                return None, None
+
+            content_range = response.headers.get('Content-Range', '')
+            if (response.status_code == 206 and
+                    content_range.startswith('bytes {}-'.format(offset))):
+                hash_obj = _hash_partial(part_path, offset)
+                mode = 'ab'
+            else:
+                offset = 0
+                hash_obj = hashlib.sha256()
+                mode = 'wb'
+                # Byte ranges of encoded content can't be resumed sensibly.
+                validator = None
+                if response.headers.get('Content-Encoding',
+                                        'identity') == 'identity':
+                    validator = (response.headers.get('ETag') or
+                                 response.headers.get('Last-Modified'))
+                _save_partial(dest, url, validator)
+
+            expected = response.headers.get('Content-Length')
+            if response.headers.get('Content-Encoding',
+                                    'identity') != 'identity':
+                expected = None
+
+            written = 0
+            chunk_size = MIN_CHUNK
+            with open(part_path, mode) as part_file:
+                while True:
+                    start = time.monotonic()
+                    try:
+                        chunk = response.raw.read(chunk_size,
+                                                  decode_content=True)
+                    except (urllib3.exceptions.HTTPError, OSError) as err:
+                        raise _Interrupted(err)
+                    elapsed = time.monotonic() - start
+
+                    if not chunk:
+                        break
+
+                    part_file.write(chunk)
+                    hash_obj.update(chunk)
+                    written += len(chunk)
+
+                    if elapsed < FAST_READ and len(chunk) == chunk_size:
+                        chunk_size = min(chunk_size*2, MAX_CHUNK)
+                    elif elapsed > 4*FAST_READ:
+                        chunk_size = max(chunk_size//2, MIN_CHUNK)
+
+            if expected is not None and written != int(expected):
+                raise _Interrupted("Got {} of {} bytes."
+                                   .format(written, expected))
+
+    except (requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError) as err:
+        raise _Interrupted(err)
+
+    return hash_obj, response.headers
+
+
+# How long to wait (in seconds) on someone else downloading the same file.
+LOCK_TIMEOUT = 60*60
+
+
+def _dest_lock(pav_cfg, dest):
+    """Get the lock for downloading to dest, creating dest's directory if
+    needed.
+    :raises WGetError: If the directory can't be created.
+    """
+
+    dest_dir = os.path.dirname(os.path.abspath(dest))
+    try:
+        os.makedirs(dest_dir, exist_ok=True)
+    except OSError as err:
+        raise WGetError("Could not create download directory '{}': {}"
+                        .format(dest_dir, err))
+
+    return lockfile.LockFile(dest + '.lock', group=pav_cfg.shared_group,
+                             timeout=LOCK_TIMEOUT)
+
+
+def get(pav_cfg, url, dest, sha256=None):
     """Download the file at the given url and store it at dest. If a file
     already exists at dest it will be overwritten (assuming we have the
     permissions to do so). Proxies are handled automatically based on
-    pav_cfg settings. This is done atomically; the download is saved to an
-    intermediate location and then moved.
+    pav_cfg settings. The download is saved to an intermediate location
+    ('<dest>.part') and then moved into place, all while holding
+    '<dest>.lock', so concurrent downloads to the same dest (from any
+    process) take turns. Interrupted downloads are resumed with HTTP range
+    requests where the server allows, both within this call and by later
+    calls. The SHA-256 of the file is computed as it's written, and added to
+    the hash cache. The download is recorded in the download index for
+    dest's directory.
     :param pav_cfg: The pavilion configuration object.
     :param str url: The url for the file to download.
     :param str dest: The path to where the file will be stored.
+    :param str sha256: The expected SHA-256 (in hex) of the file, if known.
+        The download fails (and is discarded) if it doesn't match.
+    :returns: The SHA-256 digest of the file.
+    :rtype: bytes
+    """
+
+    try:
+        with _dest_lock(pav_cfg, dest):
+            return _download(pav_cfg, url, dest, sha256)
+    except lockfile.TimeoutError:
+        raise WGetError("Timed out waiting for someone else to download "
+                        "'{}' to '{}'.".format(url, dest))
+
+
+def _download(pav_cfg, url, dest, sha256=None, known=None):
+    """Download url to dest, as per get(). This must be done while holding
+    dest's lock.
+    :param dict known: The download index entry for the current copy of
+        dest, if there is one.
+    :returns: The digest, or None if the known copy is still current.
     """
 
     proxies = _get_proxies(pav_cfg, url)
 
-    session = requests.Session()
-    session.trust_env = False
+    session = _get_session()
 
-    dest_dir = os.path.dirname(os.path.realpath(dest))
+    part_path = dest + PARTIAL_EXT
 
-    try:
-        with session.get(url, proxies=proxies, stream=True,
-                         timeout=pav_cfg.wget_timeout) as response, \
-              tempfile.NamedTemporaryFile(dir=dest_dir, delete=False) as tmp:
-            for chunk in response.iter_content(chunk_size=4096):
-                tmp.write(chunk)
-    except requests.exceptions.RequestException as err:
-        # The requests package exceptions are pretty descriptive already.
-        raise WGetError(err)
-    except (IOError, OSError) as err:
-        raise WGetError("Error writing download '{}' to file in '{}': {}"
-                        .format(url, dest_dir, err))
+    tries = 0
+    while True:
+        try:
+            hash_obj, headers = _get_once(pav_cfg, session, url, dest,
+                                          proxies, known)
+            break
+        except _Interrupted as err:
+            tries += 1
+            if tries > RESUME_RETRIES:
+                raise WGetError("Download of '{}' kept getting interrupted: {}"
+                                .format(url, err))
+            LOGGER.info("Download of '{}' interrupted, resuming: {}"
+                        .format(url, err))
+        except requests.exceptions.RequestException as err:
+            # The requests package exceptions are pretty descriptive already.
+            raise WGetError(err)
+        except (IOError, OSError) as err:
+            raise WGetError("Error writing download '{}' to '{}': {}"
+                            .format(url, part_path, err))
+
+    if hash_obj is None:
+        return None
+
+    digest = hash_obj.digest()
+
+    # Nothing left to resume, either way.
+    _save_partial(dest, url, None)
+
+    if sha256 is not None and digest.hex() != sha256.strip().lower():
+        try:
+            os.unlink(part_path)
+        except OSError:
+            pass
+        raise WGetError("Download of '{}' has the wrong SHA-256 checksum. "
+                        "Expected {}, got {}."
+                        .format(url, sha256, digest.hex()))
 
     try:
-        os.rename(tmp.name, dest)
+        os.rename(part_path, dest)
     except (IOError, OSError) as err:
         raise WGetError("Error moving file from '{}' to final location '{}': {}"
                         .format(url, dest, err))
 
+    try:
+        hash_cache.get_cache(pav_cfg.working_dir).add(dest, digest,
+                                                      alg='sha256')
+    except OSError as err:
+        LOGGER.warning("Could not add '{}' to the hash cache: {}"
+                       .format(dest, err))
+
+    try:
+        file_stat = os.stat(dest)
+        DownloadIndex(os.path.dirname(dest), pav_cfg.shared_group).record(
+            dest,
+            url=url,
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+            size=file_stat.st_size,
+            mtime_ns=file_stat.st_mtime_ns,
+            sha256=digest.hex(),
+            checked=time.time())
+    except (OSError, lockfile.TimeoutError) as err:
+        LOGGER.warning("Could not record download '{}' in the download "
+                       "index: {}".format(dest, err))
+
+    return digest
+
 
 def head(pav_cfg, url):
     """Get the header information for the given url.
@@ -65,8 +375,7 @@ def head(pav_cfg, url):
 
     proxies = _get_proxies(pav_cfg, url)
 
-    session = requests.Session()
-    session.trust_env = False
+    session = _get_session()
 
     redirects = 0
 
@@ -112,99 +421,262 @@ def _get_proxies(pav_cfg, url):
     return pav_cfg.proxies
 
 
-def _get_info(path):
-    """Get the contents of the info file for the given file, which is located at <filename>.info.
-    Additionally, add some useful stat information to the info object we return.
-    :param str path: The path to the file we want the info object for.
-    :returns: A dictionary of the info information.
-    :rtype dict:
-    """
+class DownloadIndex:
+    """What's known about the downloads in a directory: the url, the
+    response's ETag and Last-Modified, the size, mtime and SHA-256 of the
+    file, and when the url was last checked for changes.
+
+    The index is a log of json lines ('.index.jsonl' in the directory),
+    where the last line for each download wins. Lines are appended under
+    the index lock, and the log is compacted once it's long enough."""
+
+    INDEX_FN = '.index.jsonl'
 
-    info_fn = '{}.info'.format(path)
+    # Compact the log when it has this many more lines than entries.
+    COMPACT_SLACK = 500
 
-    info = {}
+    # How long to wait (in seconds) for the index lock. It's only ever
+    # held long enough to write a line.
+    LOCK_TIMEOUT = 60
 
-    if os.path.isfile(info_fn):
+    def __init__(self, path, group=None):
+        """
+        :param str path: The downloads directory.
+        :param str group: The group to give the index lock.
+        """
+
+        self.path = os.path.join(path, self.INDEX_FN)
+        self.group = group
+
+    def _read(self):
+        """Read the log.
+        :returns: The entries by name, and the number of lines read.
+        """
+
+        entries = {}
+        lines = 0
         try:
-            with dbm.open(info_fn) as db:
+            with open(self.path) as index_file:
+                for line in index_file:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Most likely a line cut short by a crash.
+                        continue
+                    if isinstance(entry, dict) and 'name' in entry:
+                        entries[entry['name']] = entry
+        except (IOError, OSError):
+            pass
+
+        return entries, lines
+
+    def get(self, dest):
+        """Get the entry for the given download, if there is one.
+        :rtype: dict
+        """
+
+        entries, _ = self._read()
+        return entries.get(os.path.basename(dest))
+
+    def record(self, dest, **fields):
+        """Replace the entry for the given download.
+        :param str dest: The downloaded file.
+        :param fields: The entry's fields.
+        :raises OSError: When the index can't be written.
+        :raises lockfile.TimeoutError: When the index lock can't be had.
+        """
+
+        entry = dict(fields, name=os.path.basename(dest))
+
+        with lockfile.LockFile(self.path + '.lock', group=self.group,
+                               timeout=self.LOCK_TIMEOUT):
+            with open(self.path, 'a') as index_file:
+                index_file.write(json.dumps(entry, sort_keys=True) + '\n')
+
+            entries, lines = self._read()
+            if lines - len(entries) > self.COMPACT_SLACK:
+                tmp_path = '{}.{}'.format(self.path, os.getpid())
+                with open(tmp_path, 'w') as tmp_file:
+                    for name in sorted(entries):
+                        tmp_file.write(json.dumps(entries[name],
+                                                  sort_keys=True) + '\n')
+                os.rename(tmp_path, self.path)
+
+
+def _current(entry, url, dest, sha256):
+    """Check whether the index entry (which may be None) describes the file
+    at dest, as downloaded from url.
+    """
 
-                for key in db.keys():
-                    # Convert everything to unicode.
-                    info[key.decode('utf-8')] = db[key].decode('utf-8')
+    if entry is None or entry.get('url') != url:
+        return False
 
-        except dbm.error as err:
-            LOGGER.warning("Error reading dbm file '{}': {}".format(info_fn, err))
+    if sha256 is not None and entry.get('sha256') != sha256.strip().lower():
+        return False
 
-    stat = os.stat(path)
+    try:
+        file_stat = os.stat(dest)
+    except OSError:
+        return False
+
+    # Anything else touching the file means we can't trust the entry.
+    return (entry.get('size') == file_stat.st_size and
+            entry.get('mtime_ns') == file_stat.st_mtime_ns)
+
+
+def update(pav_cfg, url, dest, sha256=None):
+    """Check if the file needs to be re-downloaded, and do so if necessary.
+    What's known about each download is kept in the download index for
+    dest's directory. Copies checked less than 'download_ttl' seconds ago
+    aren't checked at all. Otherwise a single conditional GET either
+    confirms our copy is current or downloads the new one. Like get(), this
+    holds '<dest>.lock' throughout.
+    :param pav_cfg: The pavilion configuration object.
+    :param str url: The url for the file to download.
+    :param str dest: The path to where we want to store the file.
+    :param str sha256: The expected SHA-256 (in hex) of the file. Copies
+        that don't match are downloaded again (and checked).
+    """
 
-    info['mtime'] = stat.st_mtime
-    info['ctime'] = stat.st_ctime
-    info['size'] = stat.st_size
+    try:
+        with _dest_lock(pav_cfg, dest):
+            _update(pav_cfg, url, dest, sha256)
+    except lockfile.TimeoutError:
+        raise WGetError("Timed out waiting for someone else to download "
+                        "'{}' to '{}'.".format(url, dest))
 
-    return info
 
+def _update(pav_cfg, url, dest, sha256):
+    """Update dest, as per update(). This must be done while holding dest's
+    lock."""
 
-# The fields to save into our info files.
-INFO_HEADER_FIELDS = [
-    'Content-Length',
-    'Content-Encoding',
-    'ETag',
-]
+    index = DownloadIndex(os.path.dirname(dest), pav_cfg.shared_group)
+    entry = index.get(dest)
 
+    if not _current(entry, url, dest, sha256):
+        _download(pav_cfg, url, dest, sha256)
+        return
 
-def _save_info(path, head_data):
-    """Given the path and the http head data, create an info file.
-    :param str path: The path to the file we're creating the info object for.
-    :param dict head_data: The header information from an http HEAD request for the object.
-    """
+    if time.time() - entry.get('checked', 0) >= pav_cfg.download_ttl:
+        if _download(pav_cfg, url, dest, sha256, known=entry) is not None:
+            # It changed, and the new version was downloaded.
+            return
 
-    info_fn = '{}.info'.format(path)
+        entry['checked'] = time.time()
+        try:
+            index.record(dest, **entry)
+        except (OSError, lockfile.TimeoutError) as err:
+            LOGGER.warning("Could not record download '{}' in the download "
+                           "index: {}".format(dest, err))
 
+    # Our copy is current, and we already know its hash.
     try:
-        with dbm.open(info_fn, 'n') as db:
-            for field in INFO_HEADER_FIELDS:
-                if field in head_data:
-                    db[field] = head_data[field]
-    except dbm.error as err:
-        LOGGER.warning("Error writing dbm file '{}': {}".format(info_fn, err))
-
-
-def update(pav_cfg, url, dest):
-    """Check if the file needs to be re-downloaded, and do so if necessary. This will
-    careate a '{dest}.info' file in the same directory that will be used to check if updates are
-    necessary.
+        hash_cache.get_cache(pav_cfg.working_dir).add(
+            dest, bytes.fromhex(entry['sha256']), alg='sha256')
+    except (OSError, KeyError, ValueError):
+        pass
+
+
+def download_path(pav_cfg, url, name=None):
+    """Get the path in the downloads directory that the given url should be
+    downloaded to.
     :param pav_cfg: The pavilion configuration object.
-    :param str url: The url for the file to download.
-    :param str dest: The path to where we want to store the file.
+    :param str url: The url to download.
+    :param str name: The name to give the download. By default, it's the
+        last part of the url path, or a hash of the url if there isn't one.
     """
 
-    fetch = False
+    if name is None:
+        url_parts = urllib.parse.urlparse(url)
+        path_parts = url_parts.path.split('/')
+        if path_parts and path_parts[-1]:
+            name = path_parts[-1]
+        else:
+            # Use a hash of the url if we can't get a name from it.
+            name = hashlib.sha256(url.encode()).hexdigest()
+
+    return os.path.join(pav_cfg.working_dir, 'downloads', name)
+
+
+class DownloadManager:
+    """Runs downloads (as per update()) in a bounded pool of threads, over
+    the shared connection pool. Requests for a url and destination that are
+    already being downloaded (or have been) share that download. Like any
+    update(), each destination is only written under its lock, so separate
+    processes don't race on it either."""
+
+    def __init__(self, pav_cfg, max_workers=DOWNLOAD_WORKERS):
+        self.pav_cfg = pav_cfg
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, url, dest, sha256=None):
+        """Make sure dest is an up to date download of url.
+        :param str url: The url to download.
+        :param str dest: Where to put it.
+        :param str sha256: The expected SHA-256 (in hex) of a new download.
+        :returns: A future for the download. Its result is dest, and it
+            raises a WGetError on failure.
+        :rtype: concurrent.futures.Future
+        """
+
+        key = (url, os.path.abspath(dest))
+
+        with self._lock:
+            future = self._jobs.get(key)
+            # Failed downloads are tried again.
+            if future is None or (future.done() and
+                                  future.exception() is not None):
+                future = self._pool.submit(self._update, url, dest,
+                                           sha256)
+                self._jobs[key] = future
+
+        return future
+
+    def _update(self, url, dest, sha256):
+        update(self.pav_cfg, url, dest, sha256=sha256)
+        return dest
+
+    def prefetch(self, downloads):
+        """Download all of the given files concurrently.
+        :param downloads: An iterable of (url, dest) or (url, dest, sha256)
+            tuples.
+        :returns: A dict of url -> WGetError for any that failed.
+        """
+
+        futures = {self.fetch(*download): download[0]
+                   for download in downloads}
+        wait(futures)
+
+        return {url: future.exception() for future, url in futures.items()
+                if future.exception() is not None}
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
 
-    info_path = '{}.info'.format(dest)
+# Managers by (working_dir, id(pav_cfg)). Each entry keeps a reference to
+# its pav_cfg, so that id can't be reused by another config.
+_MANAGERS = {}
 
-    head_data = head(pav_cfg, url)
 
-    # If the file doesn't exist, just get it.
-    if not os.path.exists(dest):
-        fetch = True
-    else:
-        info = _get_info(dest)
+def get_manager(pav_cfg):
+    """Get this process's download manager for the given pavilion config.
+    Each config gets its own, so downloads always use the settings (proxies,
+    timeouts, working_dir, etc.) of the config they were requested with."""
 
-        # If the file .info file doesn't exist, check to see if we can get a matching
-        # Content-Length and fetch it if we can't.
-        if not os.path.exists(info_path) and head_data.get('Content-Length') != info['size']:
-            fetch = True
+    key = (pav_cfg.working_dir, id(pav_cfg))
 
-        # If we do have an info file and neither the ETag or content length match, refetch.
-        # Note that the content length vs saved length depends on the transfer encoding. It should
-        # match for any already compressed files, but other data types are frequently compressed.
-        elif not (info['ETag'] == head_data.get('ETag') or
-                  # If the old content length is the same, it's probably unchanged. Probably...
-                  head_data.get('Content-Length') == info.get('Content-Length') or
-                  # Or if the content length matches the actual size.
-                  head_data.get('Content-Length') == info['size']):
-            fetch = True
+    with _SESSION_LOCK:
+        if key not in _MANAGERS:
+            _MANAGERS[key] = (pav_cfg, DownloadManager(pav_cfg))
 
-    if fetch:
-        get(pav_cfg, url, dest)
-        _save_info(dest, head_data)
+        return _MANAGERS[key][1]
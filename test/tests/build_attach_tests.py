@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pavilion import build_attach
+
+
+class BuildAttachTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.origin = os.path.join(self.tmp_dir, 'origin')
+
+        # A small build, a few levels deep, with a relative symlink.
+        for sub in 'a', 'a/b', 'a/b/c', 'd':
+            os.makedirs(os.path.join(self.origin, sub))
+            for i in range(3):
+                path = os.path.join(self.origin, sub, 'file{}'.format(i))
+                with open(path, 'w') as file:
+                    file.write(path)
+        os.symlink('a/file0', os.path.join(self.origin, 'rel_link'))
+        with open(os.path.join(self.origin, 'top'), 'w') as file:
+            file.write('top')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _check_contents(self, dest):
+        """Every file should read the same from dest as from the origin."""
+
+        for path, _, files in os.walk(self.origin):
+            rel_path = os.path.relpath(path, self.origin)
+            for name in files:
+                with open(os.path.join(path, name)) as orig_file, \
+                        open(os.path.join(dest, rel_path, name)) as file:
+                    self.assertEqual(orig_file.read(), file.read())
+
+        self.assertEqual(os.readlink(os.path.join(dest, 'rel_link')),
+                         'a/file0')
+
+    def test_attach_modes(self):
+        """Check each attach mode."""
+
+        dest = os.path.join(self.tmp_dir, 'symlink')
+        stats = build_attach.attach(self.origin, dest, 'symlink',
+                                    max_workers=3)
+        self._check_contents(dest)
+        self.assertEqual(stats.dirs, 5)
+        self.assertEqual(stats.links, 14)
+        self.assertIn('symlink mode', str(stats))
+        self.assertTrue(os.path.isdir(os.path.join(dest, 'a', 'b')))
+        self.assertFalse(os.path.islink(os.path.join(dest, 'a', 'b')))
+        self.assertEqual(os.readlink(os.path.join(dest, 'a', 'b', 'file1')),
+                         os.path.join(self.origin, 'a', 'b', 'file1'))
+
+        dest = os.path.join(self.tmp_dir, 'lazy')
+        stats = build_attach.attach(self.origin, dest, 'lazy')
+        self._check_contents(dest)
+        self.assertEqual((stats.dirs, stats.links), (1, 4))
+        self.assertEqual(os.readlink(os.path.join(dest, 'a')),
+                         os.path.join(self.origin, 'a'))
+
+        dest = os.path.join(self.tmp_dir, 'hardlink')
+        stats = build_attach.attach(self.origin, dest, 'hardlink')
+        self._check_contents(dest)
+        self.assertEqual((stats.dirs, stats.links), (5, 14))
+        top = os.path.join(dest, 'top')
+        self.assertFalse(os.path.islink(top))
+        self.assertEqual(os.stat(top).st_ino,
+                         os.stat(os.path.join(self.origin, 'top')).st_ino)
+
+        with self.assertRaises(ValueError):
+            build_attach.attach(self.origin, dest + '2', 'overlay')
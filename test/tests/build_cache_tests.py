@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pavilion import build_cache
+from pavilion import config
+from pavilion import hash_cache
+from pavilion import utils
+
+
+class BuildCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.builds_dir = os.path.join(self.working_dir, 'builds')
+        os.makedirs(self.builds_dir)
+        self.pav_cfg = config.PavilionConfigLoader().load_empty()
+        self.pav_cfg.working_dir = self.working_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def _make_build(self, name, mib, age):
+        """Make a build of the given size (in MiB), last used age seconds
+        ago."""
+
+        path = utils.make_build_path(self.builds_dir, name)
+        os.makedirs(os.path.join(path, 'sub'))
+        with open(os.path.join(path, 'sub', 'data'), 'wb') as data:
+            data.write(b'x' * mib * 1024**2)
+
+        used = time.time() - age
+        os.utime(path, (used, used))
+        return path
+
+    def test_evict(self):
+        """Check that builds are evicted in LRU order, but not when in use
+        or recently used."""
+
+        day = 24*60*60
+        oldest = self._make_build('a0000001', 2, 10*day)
+        in_use = self._make_build('a0000002', 2, 9*day)
+        finished = self._make_build('a0000003', 2, 8*day)
+        newer = self._make_build('a0000004', 2, 7*day)
+        recent = self._make_build('a0000005', 2, 60)
+
+        cache = build_cache.BuildCache(self.pav_cfg)
+        cache.lease('a0000002', 1)
+        # Finished tests release their leases.
+        cache.lease('a0000003', 2)
+        cache.release('a0000003', 2)
+        # Abandoned leases don't count.
+        cache.lease('a0000004', 3)
+        lease_path = cache._lease_path('a0000004', 3)
+        abandoned = time.time() - cache.LEASE_MAX_AGE - 60
+        os.utime(lease_path, (abandoned, abandoned))
+
+        self.assertFalse(cache.limited)
+        self.assertEqual(cache.evict(), [])
+
+        builds = cache.builds()
+        self.assertEqual([b.name for b in builds],
+                         ['a0000001', 'a0000002', 'a0000003', 'a0000004',
+                          'a0000005'])
+        self.assertGreaterEqual(builds[0].size, 2*1024**2)
+        self.assertEqual(cache.in_use(), {'a0000002'})
+
+        # Get down to about 5MiB. The in use and recently used builds
+        # have to stay. A build a test is about to use is kept too.
+        self.pav_cfg.build_cache_max_size = 5
+        cache = build_cache.BuildCache(self.pav_cfg)
+        self.assertEqual([b.name for b in cache.evict(dry_run=True)],
+                         ['a0000001', 'a0000003', 'a0000004'])
+        self.assertEqual(
+            [b.name for b in cache.evict(dry_run=True,
+                                         pending=['a0000001'])],
+            ['a0000003', 'a0000004'])
+        self.assertTrue(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(lease_path))
+
+        evicted = cache.evict()
+        self.assertEqual([b.name for b in evicted],
+                         ['a0000001', 'a0000003', 'a0000004'])
+        for path in oldest, finished, newer:
+            self.assertFalse(os.path.exists(path))
+            self.assertFalse(os.path.exists(path + cache.EVICTING_EXT))
+        for path in in_use, recent:
+            self.assertTrue(os.path.exists(path))
+        # Abandoned leases are cleaned up.
+        self.assertFalse(os.path.exists(os.path.dirname(lease_path)))
+
+        # Sizes of evicted builds are forgotten.
+        self.assertEqual(sorted(cache._load_sizes().keys()),
+                         ['a0000002', 'a0000005'])
+
+    def test_evict_age(self):
+        """Builds past the max age are evicted, even if the cache is small."""
+
+        day = 24*60*60
+        old = self._make_build('b0000001', 1, 40*day)
+        young = self._make_build('b0000002', 1, 20*day)
+
+        # Hash cache entries are pruned by the same age.
+        hashes = hash_cache.get_cache(self.working_dir)
+        src_path = os.path.join(self.working_dir, 'src.tar')
+        entries = []
+        for i, age in enumerate((40*day, 20*day)):
+            with open(src_path, 'w') as src:
+                src.write(str(i))
+            os.utime(src_path, (time.time() - 60,)*2)
+            hashes.add(src_path, b'digest')
+            key, _ = hashes._key(src_path)
+            entries.append(hashes._entry_path(key))
+            os.utime(entries[-1], (time.time() - age,)*2)
+
+        self.pav_cfg.build_cache_max_age = 30
+        cache = build_cache.BuildCache(self.pav_cfg)
+        self.assertEqual([b.name for b in cache.evict()], ['b0000001'])
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(young))
+        self.assertFalse(os.path.exists(entries[0]))
+        self.assertTrue(os.path.exists(entries[1]))
+
+    def test_locked_build(self):
+        """A build whose lock is held isn't evicted."""
+
+        path = self._make_build('c0000001', 1, 40*24*60*60)
+        self.pav_cfg.build_cache_max_age = 1
+        cache = build_cache.BuildCache(self.pav_cfg)
+
+        with open(path + '.lock', 'w') as lock_file:
+            lock_file.write('someone else\n')
+
+        self.assertEqual(cache.evict(), [])
+        self.assertTrue(os.path.exists(path))
+
+    def test_evict_sources(self):
+        """Cached sources are evicted along with the builds, in LRU order."""
+
+        day = 24*60*60
+        old_build = self._make_build('d0000001', 2, 10*day)
+        new_build = self._make_build('d0000002', 2, 5*day)
+
+        src_dir = os.path.join(self.working_dir, 'src_cache')
+        old_src = os.path.join(src_dir, 'ab' * 32)
+        os.makedirs(os.path.join(old_src, 'sub'))
+        with open(os.path.join(old_src, 'sub', 'data'), 'wb') as data:
+            data.write(b'x' * 2 * 1024**2)
+        used = time.time() - 8*day
+        os.utime(old_src, (used, used))
+        # Incomplete entries are ignored.
+        os.makedirs(os.path.join(src_dir, 'cd' * 32 + '.tmp'))
+
+        cache = build_cache.BuildCache(self.pav_cfg)
+        self.assertEqual([s.name for s in cache.sources()], ['ab' * 32])
+        self.assertTrue(cache.sources()[0].source)
+
+        self.pav_cfg.build_cache_max_size = 3
+        cache = build_cache.BuildCache(self.pav_cfg)
+        evicted = cache.evict()
+        self.assertEqual([b.name for b in evicted], ['d0000001', 'ab' * 32])
+        self.assertFalse(os.path.exists(old_build))
+        self.assertFalse(os.path.exists(old_src))
+        self.assertTrue(os.path.exists(new_build))
+        self.assertEqual(cache._load_sizes(src_dir), {})
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pavilion import config_cache
+
+
+class ConfigCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'config_cache')
+        self.cfg_path = os.path.join(self.tmp_dir, 'suite.yaml')
+        self.builds = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, data, age=60):
+        """Write the config file, with an mtime age seconds in the past."""
+
+        with open(self.cfg_path, 'w') as cfg_file:
+            cfg_file.write(data)
+        when = time.time() - age
+        os.utime(self.cfg_path, (when, when))
+
+    def _build(self):
+        self.builds += 1
+        with open(self.cfg_path) as cfg_file:
+            return {'data': cfg_file.read(), 'list': [1, 2]}
+
+    def test_config_cache(self):
+        """Configs should only be built once per change to their files or
+        schema, across cache instances (processes)."""
+
+        self._write('a')
+
+        cache = config_cache.ConfigCache(self.cache_dir)
+        cfg = cache.get('suite', [self.cfg_path], 'schema', self._build)
+        self.assertEqual(cfg['data'], 'a')
+        self.assertEqual(self.builds, 1)
+
+        # Hits come from a new cache instance too, and are fresh copies.
+        cfg['list'].append(3)
+        cache2 = config_cache.ConfigCache(self.cache_dir)
+        cfg2 = cache2.get('suite', [self.cfg_path], 'schema', self._build)
+        self.assertEqual(cfg2, {'data': 'a', 'list': [1, 2]})
+        self.assertEqual(self.builds, 1)
+
+        # Different kinds and schemas are different entries.
+        cache2.get('base', [self.cfg_path], 'schema', self._build)
+        cache2.get('suite', [self.cfg_path], 'schema2', self._build)
+        self.assertEqual(self.builds, 3)
+
+        # As are changed files.
+        self._write('bb', age=30)
+        cfg = cache2.get('suite', [self.cfg_path], 'schema', self._build)
+        self.assertEqual(cfg['data'], 'bb')
+        self.assertEqual(self.builds, 4)
+
+        # Bad entries are rebuilt.
+        for dir_path, _, files in os.walk(self.cache_dir):
+            for name in files:
+                with open(os.path.join(dir_path, name), 'wb') as entry:
+                    entry.write(b'garbage')
+        cfg = cache2.get('suite', [self.cfg_path], 'schema', self._build)
+        self.assertEqual(cfg['data'], 'bb')
+        self.assertEqual(self.builds, 5)
+
+        # Recently changed files aren't cached.
+        self._write('c', age=0)
+        cache2.get('suite', [self.cfg_path], 'schema', self._build)
+        cache2.get('suite', [self.cfg_path], 'schema', self._build)
+        self.assertEqual(self.builds, 7)
+
+        # Missing files aren't cached (build reports the problem).
+        missing = os.path.join(self.tmp_dir, 'missing.yaml')
+        with self.assertRaises(OSError):
+            cache2.get('suite', [missing], 'schema', lambda: open(missing))
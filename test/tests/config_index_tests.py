@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from pavilion import config_index
+
+
+class ConfigIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.tmp_dir, 'config_index.json')
+        self.conf_dirs = [os.path.join(self.tmp_dir, 'conf1'),
+                          os.path.join(self.tmp_dir, 'conf2')]
+
+        self._touch('conf1/hosts/host1.yaml')
+        self._touch('conf1/tests/suite1.yaml')
+        self._touch('conf1/tests/notes.txt')
+        self._touch('conf2/tests/suite1.yaml')
+        self._touch('conf2/tests/suite2.yaml')
+        self._touch('conf2/modes/mode1.yaml')
+        self._touch('conf2/plugins/sched/foo.yapsy-plugin')
+        self._touch('conf2/plugins/sched/foo.py')
+        self._touch('conf2/plugins/empty/readme')
+
+        # Make everything old enough to be saved.
+        when = time.time() - 60
+        for dir_path, _, _ in os.walk(self.tmp_dir):
+            os.utime(dir_path, (when, when))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _touch(self, path):
+        path = os.path.join(self.tmp_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w'):
+            pass
+
+    def test_config_index(self):
+        """The index should find configs in precedence order, and reuse saved
+        scans of unchanged directories."""
+
+        index = config_index.ConfigIndex(self.conf_dirs, self.index_path)
+
+        conf1, conf2 = self.conf_dirs
+        self.assertEqual(index.find('hosts', 'host1'),
+                         os.path.join(conf1, 'hosts', 'host1.yaml'))
+        self.assertEqual(index.find('tests', 'suite1'),
+                         os.path.join(conf1, 'tests', 'suite1.yaml'))
+        self.assertEqual(index.find('modes', 'mode1'),
+                         os.path.join(conf2, 'modes', 'mode1.yaml'))
+        self.assertIsNone(index.find('tests', 'notes'))
+        self.assertIsNone(index.find('hosts', 'nope'))
+        self.assertEqual(
+            index.names('tests'),
+            {'suite1': os.path.join(conf1, 'tests', 'suite1.yaml'),
+             'suite2': os.path.join(conf2, 'tests', 'suite2.yaml')})
+        self.assertEqual(index.plugin_dirs,
+                         [os.path.join(conf2, 'plugins', 'sched')])
+
+        # A second index shouldn't need to scan anything.
+        with mock.patch('os.scandir') as scandir:
+            index2 = config_index.ConfigIndex(self.conf_dirs, self.index_path)
+            self.assertFalse(scandir.called)
+        self.assertEqual(index2.configs, index.configs)
+        self.assertEqual(index2.plugin_dirs, index.plugin_dirs)
+
+        # Changed directories are scanned again.
+        self._touch('conf1/tests/suite2.yaml')
+        index3 = config_index.ConfigIndex(self.conf_dirs, self.index_path)
+        self.assertEqual(index3.find('tests', 'suite2'),
+                         os.path.join(conf1, 'tests', 'suite2.yaml'))
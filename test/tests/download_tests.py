@@ -0,0 +1,318 @@
+import email.utils
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+
+from pavilion import config
+from pavilion import hash_cache
+from pavilion import wget
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    """Serves files from the server's directory, slowly, while counting
+    requests."""
+
+    def do_GET(self):
+        with self.server.counts_lock:
+            self.server.counts['GET ' + self.path] += 1
+            count = self.server.counts['GET ' + self.path]
+        time.sleep(0.2)
+
+        if self.path.startswith('/flaky'):
+            self._ranged_get(truncate=count <= 2)
+        elif self.path.startswith('/ranged'):
+            self._ranged_get(truncate=False)
+        else:
+            super().do_GET()
+
+    def _ranged_get(self, truncate):
+        """Serve a file with range request support, optionally dropping the
+        connection half way through."""
+
+        path = self.translate_path(self.path)
+        with open(path, 'rb') as file:
+            data = file.read()
+        last_mod = self.date_time_string(int(os.stat(path).st_mtime))
+
+        start = 0
+        range_hdr = self.headers.get('Range')
+        if range_hdr is not None and self.headers.get('If-Range') == last_mod:
+            start = int(range_hdr.split('=')[1].rstrip('-'))
+            self.server.ranges.append(start)
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.send_header('Last-Modified', last_mod)
+        self.end_headers()
+
+        body = data[start:]
+        if truncate:
+            body = body[:len(body)//2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        with self.server.counts_lock:
+            self.server.counts['HEAD ' + self.path] += 1
+        super().do_HEAD()
+
+    def translate_path(self, path):
+        return os.path.join(self.server.root, path.lstrip('/'))
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'www')
+        os.mkdir(self.root)
+        for i in range(4):
+            with open(os.path.join(self.root, 'file{}'.format(i)), 'wb') as f:
+                f.write(str(i).encode() * 100000)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      Handler)
+        self.server.root = self.root
+        self.server.counts = Counter()
+        self.server.counts_lock = threading.Lock()
+        self.server.ranges = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+        self.pav_cfg = config.PavilionConfigLoader().load_empty()
+        self.pav_cfg.working_dir = os.path.join(self.tmp_dir, 'working_dir')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_prefetch(self):
+        """Downloads should run concurrently, and each url should only be
+        downloaded once."""
+
+        downloads = []
+        for i in range(4):
+            url = self.base_url + 'file{}'.format(i)
+            dest = wget.download_path(self.pav_cfg, url)
+            # Every url is asked for several times.
+            downloads.extend([(url, dest)] * 3)
+
+        with wget.DownloadManager(self.pav_cfg, max_workers=4) as manager:
+            start = time.time()
+            self.assertEqual(manager.prefetch(downloads), {})
+            # Each GET takes 0.2s, so doing them one at a time would take
+            # at least 0.8s.
+            self.assertLess(time.time() - start, 0.7)
+
+            for i in range(4):
+                self.assertEqual(self.server.counts['GET /file{}'.format(i)],
+                                 1)
+                path = os.path.join(self.pav_cfg.working_dir, 'downloads',
+                                    'file{}'.format(i))
+                with open(path, 'rb') as dl_file:
+                    self.assertEqual(dl_file.read(), str(i).encode() * 100000)
+
+            # Asking again gives the same, finished, download.
+            url, dest = downloads[0]
+            self.assertEqual(manager.fetch(url, dest).result(), dest)
+            self.assertEqual(self.server.counts['GET /file0'], 1)
+
+            # Failures are reported, and tried again on the next fetch.
+            url = self.base_url + 'missing'
+            dest = wget.download_path(self.pav_cfg, url)
+            failed = manager.prefetch([(url, dest)])
+            self.assertEqual(list(failed.keys()), [url])
+            self.assertIsInstance(failed[url], wget.WGetError)
+            with self.assertRaises(wget.WGetError):
+                manager.fetch(url, dest).result()
+            self.assertEqual(self.server.counts['GET /missing'], 2)
+
+    def test_get_manager(self):
+        """Each pavilion config should get its own download manager."""
+
+        other_cfg = config.PavilionConfigLoader().load_empty()
+        other_cfg.working_dir = os.path.join(self.tmp_dir, 'other')
+
+        manager = wget.get_manager(self.pav_cfg)
+        other = wget.get_manager(other_cfg)
+        try:
+            self.assertIs(wget.get_manager(self.pav_cfg), manager)
+            self.assertIsNot(other, manager)
+            self.assertIs(manager.pav_cfg, self.pav_cfg)
+            self.assertIs(other.pav_cfg, other_cfg)
+        finally:
+            for key in list(wget._MANAGERS):
+                wget._MANAGERS.pop(key)[1].close()
+
+    def test_resume(self):
+        """Interrupted downloads should be resumed where they left off, and
+        hashed as they're written."""
+
+        data = os.urandom(400000)
+        with open(os.path.join(self.root, 'flaky'), 'wb') as flaky_file:
+            flaky_file.write(data)
+        expected = hashlib.sha256(data).digest()
+
+        url = self.base_url + 'flaky'
+        dest = wget.download_path(self.pav_cfg, url)
+        os.makedirs(os.path.dirname(dest))
+
+        self.assertEqual(wget.get(self.pav_cfg, url, dest,
+                                  sha256=expected.hex()), expected)
+        with open(dest, 'rb') as dl_file:
+            self.assertEqual(dl_file.read(), data)
+        self.assertEqual(self.server.counts['GET /flaky'], 3)
+        # Each retry picked up (more or less) where the last one left off,
+        # rather than starting over.
+        self.assertEqual(len(self.server.ranges), 2)
+        self.assertTrue(0 < self.server.ranges[0] < self.server.ranges[1])
+        self.assertFalse(os.path.exists(dest + wget.PARTIAL_EXT))
+        self.assertFalse(os.path.exists(dest + wget.PARTIAL_STATE_EXT))
+
+        # The digest should be in the hash cache, so the file is never
+        # hashed again.
+        def no_hash(_):
+            self.fail("The download was hashed again.")
+        cache = hash_cache.get_cache(self.pav_cfg.working_dir)
+        self.assertEqual(cache.hash_file(dest, no_hash), expected)
+
+    def test_resume_complete(self):
+        """A partial download that was already complete (so resuming it
+        gets a 416) should be downloaded again from the start."""
+
+        data = os.urandom(1000)
+        src_path = os.path.join(self.root, 'ranged')
+        with open(src_path, 'wb') as src_file:
+            src_file.write(data)
+        last_mod = email.utils.formatdate(int(os.stat(src_path).st_mtime),
+                                          usegmt=True)
+
+        url = self.base_url + 'ranged'
+        dest = wget.download_path(self.pav_cfg, url)
+        os.makedirs(os.path.dirname(dest))
+        with open(dest + wget.PARTIAL_EXT, 'wb') as part_file:
+            part_file.write(data)
+        with open(dest + wget.PARTIAL_STATE_EXT, 'w') as state_file:
+            json.dump({'url': url, 'validator': last_mod}, state_file)
+
+        self.assertEqual(wget.get(self.pav_cfg, url, dest),
+                         hashlib.sha256(data).digest())
+        with open(dest, 'rb') as dl_file:
+            self.assertEqual(dl_file.read(), data)
+        self.assertEqual(self.server.ranges, [1000])
+        self.assertEqual(self.server.counts['GET /ranged'], 2)
+        self.assertFalse(os.path.exists(dest + wget.PARTIAL_EXT))
+        self.assertFalse(os.path.exists(dest + wget.PARTIAL_STATE_EXT))
+
+    def test_concurrent_get(self):
+        """Downloads of the same file outside of a download manager should
+        take turns, rather than mixing their writes."""
+
+        url = self.base_url + 'file2'
+        dest = wget.download_path(self.pav_cfg, url)
+        expected = hashlib.sha256(b'2' * 100000).digest()
+
+        results = []
+
+        def get():
+            try:
+                results.append(wget.get(self.pav_cfg, url, dest))
+            except wget.WGetError as err:
+                results.append(err)
+
+        threads = [threading.Thread(target=get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [expected]*4)
+        with open(dest, 'rb') as dl_file:
+            self.assertEqual(dl_file.read(), b'2' * 100000)
+        self.assertFalse(os.path.exists(dest + wget.PARTIAL_EXT))
+
+    def test_checksum_mismatch(self):
+        """Downloads with the wrong checksum should be discarded."""
+
+        url = self.base_url + 'file0'
+        dest = wget.download_path(self.pav_cfg, url)
+        os.makedirs(os.path.dirname(dest))
+
+        with self.assertRaises(wget.WGetError):
+            wget.get(self.pav_cfg, url, dest, sha256='0'*64)
+        self.assertFalse(os.path.exists(dest))
+        self.assertFalse(os.path.exists(dest + wget.PARTIAL_EXT))
+
+        good = hashlib.sha256(b'0' * 100000).hexdigest()
+        with wget.DownloadManager(self.pav_cfg) as manager:
+            self.assertEqual(manager.fetch(url, dest, good).result(), dest)
+
+    def test_conditional_update(self):
+        """Updates should check for changes with a single conditional GET,
+        and not at all within the freshness TTL."""
+
+        url = self.base_url + 'file1'
+        dest = wget.download_path(self.pav_cfg, url)
+        os.makedirs(os.path.dirname(dest))
+
+        wget.update(self.pav_cfg, url, dest)
+        index = wget.DownloadIndex(os.path.dirname(dest))
+        entry = index.get(dest)
+        self.assertEqual(entry['url'], url)
+        self.assertEqual(entry['size'], 100000)
+        self.assertEqual(entry['sha256'],
+                         hashlib.sha256(b'1' * 100000).hexdigest())
+        self.assertIsNotNone(entry['last_modified'])
+
+        # Unchanged files get a 304, and the file is left alone.
+        mtime = os.stat(dest).st_mtime_ns
+        wget.update(self.pav_cfg, url, dest)
+        self.assertEqual(self.server.counts['GET /file1'], 2)
+        self.assertEqual(os.stat(dest).st_mtime_ns, mtime)
+        self.assertGreater(index.get(dest)['checked'], entry['checked'])
+        self.assertEqual(self.server.counts['HEAD /file1'], 0)
+
+        # Within the TTL, there's no request at all.
+        self.pav_cfg.download_ttl = 60
+        wget.update(self.pav_cfg, url, dest)
+        self.assertEqual(self.server.counts['GET /file1'], 2)
+
+        # Changes on the server are picked up once the TTL passes.
+        self.pav_cfg.download_ttl = 0
+        src_path = os.path.join(self.root, 'file1')
+        with open(src_path, 'wb') as src_file:
+            src_file.write(b'new')
+        when = time.time() + 10
+        os.utime(src_path, (when, when))
+        wget.update(self.pav_cfg, url, dest)
+        with open(dest, 'rb') as dl_file:
+            self.assertEqual(dl_file.read(), b'new')
+        self.assertEqual(index.get(dest)['size'], 3)
+
+        # As are local changes to the file, no matter the TTL.
+        self.pav_cfg.download_ttl = 60
+        with open(dest, 'ab') as dl_file:
+            dl_file.write(b'junk')
+        wget.update(self.pav_cfg, url, dest)
+        with open(dest, 'rb') as dl_file:
+            self.assertEqual(dl_file.read(), b'new')
+        self.assertEqual(self.server.counts['GET /file1'], 4)
@@ -0,0 +1,113 @@
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from pavilion import extract
+
+
+class ExtractTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self._decompressors = extract.DECOMPRESSORS
+
+    def tearDown(self):
+        extract.DECOMPRESSORS = self._decompressors
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_tar(self, name, mode, top_dir):
+        """Make a tar archive with a few files, under a single top level
+        directory if top_dir is given."""
+
+        path = os.path.join(self.tmp_dir, name)
+        with tarfile.open(path, mode) as tar:
+            for fn in 'a', os.path.join('sub', 'b'):
+                data = (fn * 1000).encode()
+                info = tarfile.TarInfo(os.path.join(top_dir or '', fn))
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+        return path
+
+    def _check_tree(self, path):
+        self.assertEqual(sorted(os.listdir(path)), ['a', 'sub'])
+        with open(os.path.join(path, 'sub', 'b')) as b_file:
+            self.assertEqual(b_file.read(), os.path.join('sub', 'b') * 1000)
+
+    def test_extract_tar(self):
+        """Check extraction of each compression type, with and without
+        external decompressors."""
+
+        for use_tools in True, False:
+            if not use_tools:
+                extract.DECOMPRESSORS = {}
+
+            for mode, subtype in (('w:gz', 'gzip'), ('w:bz2', 'x-bzip2'),
+                                  ('w:xz', 'x-xz'), ('w', 'x-tar')):
+                for top_dir in 'top', None:
+                    src = self._make_tar('src.tar', mode, top_dir)
+                    dest = os.path.join(self.tmp_dir, 'dest')
+
+                    self.assertTrue(extract.is_tar(src, subtype))
+                    stats = extract.extract_tar(src, subtype, dest)
+
+                    # Either way, the files should end up directly in dest.
+                    self._check_tree(dest)
+                    self.assertFalse(os.path.exists(dest + '.extract'))
+                    self.assertEqual(stats.bytes_out, 1000 + 5*1000)
+                    self.assertIn('MiB/s', str(stats))
+
+                    shutil.rmtree(dest)
+                    os.unlink(src)
+
+    def test_extract_failure(self):
+        """Failed extractions shouldn't leave anything behind to break the
+        next attempt."""
+
+        src = self._make_tar('src.tar.gz', 'w:gz', 'top')
+        with open(src, 'rb') as src_file:
+            data = src_file.read()
+        bad_src = os.path.join(self.tmp_dir, 'bad.tar.gz')
+        with open(bad_src, 'wb') as bad_file:
+            bad_file.write(data[:len(data)//2])
+
+        dest = os.path.join(self.tmp_dir, 'dest')
+        with self.assertRaises(extract.ExtractError):
+            extract.extract_tar(bad_src, 'gzip', dest)
+        self.assertFalse(os.path.exists(dest + '.extract'))
+
+        # Even a partial extraction left by a killed process is cleaned up.
+        os.makedirs(os.path.join(dest + '.extract', 'top'))
+        extract.extract_tar(src, 'gzip', dest)
+        self._check_tree(dest)
+        self.assertFalse(os.path.exists(dest + '.extract'))
+
+    def test_decompress(self):
+        """Check plain (non-archive) decompression, and bad archives."""
+
+        src = os.path.join(self.tmp_dir, 'data.gz')
+        with gzip.open(src, 'wb') as gz_file:
+            gz_file.write(b'not a tar file\n' * 1000)
+
+        self.assertFalse(extract.is_tar(src, 'gzip'))
+
+        dest = os.path.join(self.tmp_dir, 'data')
+        stats = extract.decompress(src, 'gzip', dest)
+        self.assertEqual(stats.bytes_out, 15000)
+        with open(dest, 'rb') as data:
+            self.assertEqual(data.read(), b'not a tar file\n' * 1000)
+
+        # A truncated archive should fail cleanly.
+        tar_path = self._make_tar('src.tgz', 'w:gz', 'top')
+        with open(tar_path, 'rb') as tar_file:
+            data = tar_file.read()
+        with open(tar_path, 'wb') as tar_file:
+            tar_file.write(data[:len(data)//2])
+
+        with self.assertRaises(extract.ExtractError):
+            extract.extract_tar(tar_path, 'gzip',
+                                os.path.join(self.tmp_dir, 'bad'))
@@ -0,0 +1,238 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pavilion import hash_cache
+
+
+def sha256_file(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).digest()
+
+
+class HashCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'hash_cache')
+        self.file_path = os.path.join(self.tmp_dir, 'src.tar')
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _hash(self, path):
+        self.calls.append(path)
+        return sha256_file(path)
+
+    def _write(self, data, age=60):
+        """Write the test file, with an mtime age seconds in the past."""
+
+        with open(self.file_path, 'wb') as file:
+            file.write(data)
+        when = time.time() - age
+        os.utime(self.file_path, (when, when))
+
+    def test_hash_cache(self):
+        """Files should only be hashed once per change, across cache
+        instances (processes)."""
+
+        self._write(b'a' * 1000)
+
+        cache = hash_cache.HashCache(self.cache_dir)
+        digest = cache.hash_file(self.file_path, self._hash)
+        self.assertEqual(digest, sha256_file(self.file_path))
+        self.assertEqual(cache.hash_file(self.file_path, self._hash), digest)
+        self.assertEqual(len(self.calls), 1)
+
+        # A new cache (as in another process) should use the saved entry,
+        # including through a symlink.
+        link_path = os.path.join(self.tmp_dir, 'link.tar')
+        os.symlink(self.file_path, link_path)
+        cache2 = hash_cache.HashCache(self.cache_dir)
+        self.assertEqual(cache2.hash_file(link_path, self._hash), digest)
+        self.assertEqual(len(self.calls), 1)
+
+        # Changing the file means hashing it again.
+        self._write(b'b' * 1000, age=30)
+        digest2 = cache2.hash_file(self.file_path, self._hash)
+        self.assertEqual(digest2, sha256_file(self.file_path))
+        self.assertNotEqual(digest, digest2)
+        self.assertEqual(len(self.calls), 2)
+
+        # Garbage entries are ignored (and replaced).
+        key, _ = hash_cache.HashCache._key(self.file_path)
+        entry_path = cache2._entry_path(key)
+        with open(entry_path, 'w') as entry:
+            entry.write('garbage')
+        cache3 = hash_cache.HashCache(self.cache_dir)
+        self.assertEqual(cache3.hash_file(self.file_path, self._hash), digest2)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_racy_files(self):
+        """Files modified very recently aren't saved to the cache."""
+
+        self._write(b'c' * 100, age=0)
+
+        cache = hash_cache.HashCache(self.cache_dir)
+        cache.hash_file(self.file_path, self._hash)
+        hash_cache.HashCache(self.cache_dir).hash_file(self.file_path,
+                                                       self._hash)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_add(self):
+        """Hashes computed elsewhere should be usable without rehashing
+        the file, but only saved when they aren't racy."""
+
+        self._write(b'd' * 100)
+        digest = sha256_file(self.file_path)
+
+        cache = hash_cache.HashCache(self.cache_dir)
+        cache.add(self.file_path, digest)
+        self.assertEqual(cache.hash_file(self.file_path, self._hash), digest)
+        cache2 = hash_cache.HashCache(self.cache_dir)
+        self.assertEqual(cache2.hash_file(self.file_path, self._hash), digest)
+        self.assertEqual(self.calls, [])
+
+        self._write(b'e' * 100, age=0)
+        digest = sha256_file(self.file_path)
+        cache.add(self.file_path, digest)
+        self.assertEqual(cache.hash_file(self.file_path, self._hash), digest)
+        self.assertEqual(self.calls, [])
+        hash_cache.HashCache(self.cache_dir).hash_file(self.file_path,
+                                                       self._hash)
+        self.assertEqual(len(self.calls), 1)
+
+    def _make_tree(self, root):
+        """Make a small tree with a few levels, files and a symlink."""
+
+        for sub in 'a', 'b', os.path.join('b', 'c'):
+            os.makedirs(os.path.join(root, sub))
+        for name in 'x', os.path.join('a', 'y'), os.path.join('b', 'c', 'z'):
+            with open(os.path.join(root, name), 'w') as file:
+                file.write(name * 100)
+            when = time.time() - 60
+            os.utime(os.path.join(root, name), (when, when))
+        os.symlink('x', os.path.join(root, 'b', 'link'))
+
+    def test_hash_dir(self):
+        """Directory hashes should depend only on content, and only re-read
+        changed files."""
+
+        tree1 = os.path.join(self.tmp_dir, 'tree1')
+        tree2 = os.path.join(self.tmp_dir, 'tree2')
+        self._make_tree(tree1)
+        self._make_tree(tree2)
+
+        cache = hash_cache.HashCache(self.cache_dir)
+        digest = cache.hash_dir(tree1, self._hash, max_workers=4)
+        self.assertEqual(len(self.calls), 3)
+
+        # The same content elsewhere gets the same hash.
+        self.assertEqual(cache.hash_dir(tree2, self._hash), digest)
+        self.assertEqual(len(self.calls), 6)
+
+        # Nothing changed, so nothing should be re-read, even by a new
+        # cache instance.
+        self.calls = []
+        cache2 = hash_cache.HashCache(self.cache_dir)
+        self.assertEqual(cache2.hash_dir(tree1, self._hash), digest)
+        self.assertEqual(self.calls, [])
+
+        # Only the changed file is re-read.
+        z_path = os.path.join(tree1, 'b', 'c', 'z')
+        with open(z_path, 'w') as file:
+            file.write('changed')
+        when = time.time() - 30
+        os.utime(z_path, (when, when))
+        digest2 = cache2.hash_dir(tree1, self._hash)
+        self.assertNotEqual(digest, digest2)
+        self.assertEqual(self.calls, [z_path])
+
+        # Renames, new empty directories and symlink changes all matter.
+        os.rename(os.path.join(tree2, 'x'), os.path.join(tree2, 'w'))
+        self.assertNotEqual(cache2.hash_dir(tree2, self._hash), digest)
+        os.rename(os.path.join(tree2, 'w'), os.path.join(tree2, 'x'))
+        self.assertEqual(cache2.hash_dir(tree2, self._hash), digest)
+
+        os.mkdir(os.path.join(tree2, 'empty'))
+        self.assertNotEqual(cache2.hash_dir(tree2, self._hash), digest)
+        os.rmdir(os.path.join(tree2, 'empty'))
+
+        link = os.path.join(tree2, 'b', 'link')
+        os.unlink(link)
+        os.symlink('elsewhere', link)
+        self.assertNotEqual(cache2.hash_dir(tree2, self._hash), digest)
+
+    def test_alg(self):
+        """Entries for different hash algorithms shouldn't mix."""
+
+        self._write(b'f' * 100)
+        digest = sha256_file(self.file_path)
+
+        cache = hash_cache.HashCache(self.cache_dir)
+        cache.add(self.file_path, digest)
+
+        def md5(path):
+            self.calls.append(path)
+            with open(path, 'rb') as file:
+                return hashlib.md5(file.read()).digest()
+
+        md5_digest = cache.hash_file(self.file_path, md5, alg='md5')
+        self.assertNotEqual(md5_digest, digest)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(hash_cache.HashCache(self.cache_dir).hash_file(
+            self.file_path, md5, alg='md5'), md5_digest)
+        self.assertEqual(cache.hash_file(self.file_path, self._hash), digest)
+        self.assertEqual(len(self.calls), 1)
+
+        tree = os.path.join(self.tmp_dir, 'tree')
+        self._make_tree(tree)
+        self.assertNotEqual(cache.hash_dir(tree, md5, alg='md5'),
+                            cache.hash_dir(tree, self._hash))
+
+    def test_prune(self):
+        """Entries and manifests that haven't been used in a while should be
+        pruned, but not those in use."""
+
+        self._write(b'g' * 100)
+        tree = os.path.join(self.tmp_dir, 'tree')
+        self._make_tree(tree)
+
+        cache = hash_cache.HashCache(self.cache_dir)
+        cache.hash_file(self.file_path, self._hash)
+        cache.hash_dir(tree, self._hash)
+
+        def cache_files():
+            found = []
+            for path, _, files in os.walk(self.cache_dir):
+                found.extend(os.path.join(path, name) for name in files
+                             if name != hash_cache.PRUNED_FN)
+            return found
+
+        # Age everything, as if unused for a couple of days.
+        when = time.time() - 2*24*60*60
+        for path in cache_files():
+            os.utime(path, (when, when))
+
+        # Using an entry marks it as used.
+        self.assertEqual(hash_cache.HashCache(self.cache_dir).hash_file(
+            self.file_path, self._hash), sha256_file(self.file_path))
+        self.assertEqual(len(self.calls), 4)
+
+        total = len(cache_files())
+        self.assertEqual(cache.prune(24*60*60, force=True), total - 1)
+        self.assertEqual(len(cache_files()), 1)
+
+        # Pruning is only done periodically, unless forced.
+        self.assertEqual(cache.prune(0), 0)
+        self.assertEqual(len(cache_files()), 1)
+        self.assertEqual(cache.prune(0, force=True), 1)
+
+        # Nothing pruned means hashing again.
+        self.calls = []
+        hash_cache.HashCache(self.cache_dir).hash_dir(tree, self._hash)
+        self.assertEqual(len(self.calls), 3)
@@ -2,18 +2,24 @@
 # It acquires a lock (given by sys.arg[1]), and repeatedly tries to acquire the lock
 # and hold it for a moment.
 # It runs until killed.
+#
+# It can also be run as a lock contention benchmark, comparing the lock backends:
+#   python3 lock_fight.py --bench [lock_dir [procs [acquisitions]]]
+# Each backend is run with 'procs' processes, each of which acquire the lock 'acquisitions'
+# times.
 
 from __future__ import unicode_literals, print_function, division
 
+import getpass
+import json
 import logging
-
-
-
 import os
+import subprocess
 import sys
+import tempfile
 import time
 
-log_dir = '/tmp/{}'.format(os.getlogin())
+log_dir = '/tmp/{}'.format(getpass.getuser())
 if not os.path.exists(log_dir):
     os.makedirs(log_dir)
 logging.basicConfig(filename=os.path.join(log_dir, 'pavilion_tests.log'))
@@ -23,13 +29,93 @@ sys.path.append(os.path.join(package_root, 'lib'))
 
 from pavilion import lockfile
 
-while True:
-    try:
-        with lockfile.LockFile(sys.argv[1], timeout=0.5) as lock:
-            # print("Fight {} - got lock {}".format(os.getpid(), lock._id))
-            time.sleep(0.01)
-            # print("Fight {} - bye lock {}".format(os.getpid(), lock._id))
-        # If we don't sleep, the sem proc will probably get the lock right back.
-        time.sleep(0.2)
-    except lockfile.TimeoutError:
-        continue
+# How long each benchmark worker holds the lock.
+BENCH_HOLD = 0.001
+
+
+def fight(lock_path, backend=None):
+    """Repeatedly grab the lock until killed."""
+
+    while True:
+        try:
+            with lockfile.LockFile(lock_path, timeout=0.5, backend=backend) as lock:
+                # print("Fight {} - got lock {}".format(os.getpid(), lock._id))
+                time.sleep(0.01)
+                # print("Fight {} - bye lock {}".format(os.getpid(), lock._id))
+            # If we don't sleep, the sem proc will probably get the lock right back.
+            time.sleep(0.2)
+        except lockfile.TimeoutError:
+            continue
+
+
+def bench_worker(lock_path, backend, count):
+    """Acquire the lock count times, and print a json summary of the wait times."""
+
+    waits = []
+    timeouts = 0
+
+    for i in range(count):
+        start = time.time()
+        try:
+            with lockfile.LockFile(lock_path, timeout=30, backend=backend):
+                waits.append(time.time() - start)
+                time.sleep(BENCH_HOLD)
+        except lockfile.TimeoutError:
+            timeouts += 1
+
+    print(json.dumps({'waits': waits, 'timeouts': timeouts}))
+
+
+def bench(lock_dir, procs, count):
+    """Run the benchmark for each backend, returning the results by backend."""
+
+    results = {}
+
+    for backend in lockfile.BACKENDS:
+        lock_path = os.path.join(lock_dir, 'bench_{}.lock'.format(backend))
+
+        start = time.time()
+        workers = [subprocess.Popen([sys.executable, __file__, '--bench-worker',
+                                     lock_path, backend, str(count)],
+                                    stdout=subprocess.PIPE)
+                   for i in range(procs)]
+
+        waits = []
+        timeouts = 0
+        for worker in workers:
+            out, _ = worker.communicate()
+            data = json.loads(out.decode())
+            waits.extend(data['waits'])
+            timeouts += data['timeouts']
+
+        elapsed = time.time() - start
+        waits.sort()
+
+        results[backend] = {
+            'elapsed': elapsed,
+            'acquisitions': len(waits),
+            'timeouts': timeouts,
+            'per_sec': len(waits)/elapsed,
+            'mean_wait': sum(waits)/len(waits) if waits else None,
+            'p99_wait': waits[int(len(waits)*0.99)] if waits else None,
+        }
+
+    return results
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--bench-worker':
+        bench_worker(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    elif sys.argv[1] == '--bench':
+        args = sys.argv[2:]
+        bench_dir = args[0] if args else tempfile.mkdtemp()
+        bench_procs = int(args[1]) if len(args) > 1 else 8
+        bench_count = int(args[2]) if len(args) > 2 else 50
+
+        print("{:8s} {:>8s} {:>8s} {:>10s} {:>10s} {:>10s}"
+              .format('backend', 'locks', 'timeouts', 'locks/sec', 'mean wait', 'p99 wait'))
+        for name, res in bench(bench_dir, bench_procs, bench_count).items():
+            print("{:8s} {acquisitions:8d} {timeouts:8d} {per_sec:10.1f} "
+                  "{mean_wait:10.4f} {p99_wait:10.4f}".format(name, **res))
+    else:
+        fight(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -1,10 +1,13 @@
 from __future__ import print_function, unicode_literals, division
 
+import fcntl
 import grp
 from pavilion import lockfile
 import os
 import subprocess as sp
 import sys
+import tempfile
+import threading
 import time
 import unittest
 
@@ -99,6 +102,116 @@ class TestConfig(unittest.TestCase):
                 proc.terminate()
                 proc.kill()
 
+    def test_flock_backend(self):
+        """Check the flock backend."""
+
+        def _acquire_lock(*args, **kwargs):
+            with lockfile.LockFile(self.lock_path, *args, backend=lockfile.BACKEND_FLOCK,
+                                   **kwargs):
+                pass
+
+        lock = lockfile.LockFile(self.lock_path, backend=lockfile.BACKEND_FLOCK)
+        with lock:
+            self.assertTrue(os.path.exists(self.lock_path))
+            # The lockfile looks like a regular one.
+            host, user, expires, lock_id = lock.read_lockfile()
+            self.assertEqual(lock_id, lock._id)
+            # Other locks in this process are blocked.
+            self.assertRaises(lockfile.TimeoutError, _acquire_lock)
+            self.assertRaises(lockfile.TimeoutError, _acquire_lock, timeout=0.2)
+        self.assertFalse(os.path.exists(self.lock_path))
+
+        # Lock objects are reusable.
+        with lock:
+            pass
+
+        # Hold a kernel lock on the file without the lockfile class, and make sure we wait
+        # for it and time out.
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        start = time.time()
+        self.assertRaises(lockfile.TimeoutError, _acquire_lock, timeout=0.5)
+        self.assertGreaterEqual(time.time() - start, 0.5)
+        # Remove the file, and release the lock like the LockFile class would.
+        os.unlink(self.lock_path)
+        os.close(fd)
+
+        # A waiting thread should get the lock as soon as it's released.
+        got_lock = []
+
+        def _wait_for_lock():
+            with lockfile.LockFile(self.lock_path, timeout=5, backend=lockfile.BACKEND_FLOCK):
+                got_lock.append(time.time())
+
+        with lockfile.LockFile(self.lock_path, backend=lockfile.BACKEND_FLOCK):
+            thread = threading.Thread(target=_wait_for_lock)
+            thread.start()
+            time.sleep(0.5)
+            self.assertEqual(got_lock, [])
+            released = time.time()
+        thread.join()
+        self.assertEqual(len(got_lock), 1)
+        self.assertLess(got_lock[0] - released, lockfile.LockFile.SLEEP_PERIOD)
+        self.assertFalse(os.path.exists(self.lock_path))
+
+        self.assertRaises(ValueError, lockfile.LockFile, self.lock_path, backend='nope')
+
+    def test_lock_benchmark(self):
+        """Make sure the lock contention benchmark runs with every backend."""
+
+        fight_path = os.path.join(os.path.dirname(__file__), 'lock_fight.py')
+        out = sp.check_output([sys.executable, fight_path, '--bench',
+                               os.path.dirname(os.path.abspath(self.lock_path)), '3', '10'])
+        lines = out.decode().strip().split('\n')
+        self.assertEqual([line.split()[0] for line in lines[1:]],
+                         list(lockfile.BACKENDS))
+        for line in lines[1:]:
+            # Every acquisition succeeded.
+            self.assertEqual(line.split()[1:3], ['30', '0'])
+
+    def test_lock_stats(self):
+        """Make sure lock statistics are recorded and summarized."""
+
+        stats_path = tempfile.mktemp()
+        lockfile.enable_stats(stats_path)
+
+        try:
+            for backend in lockfile.BACKENDS:
+                with lockfile.LockFile(self.lock_path, backend=backend):
+                    time.sleep(0.05)
+
+            # A timeout should be recorded too.
+            lockfile.LockFile._create_lockfile(self.lock_path, 100, '1234')
+            self.assertRaises(lockfile.TimeoutError,
+                              lockfile.LockFile(self.lock_path, timeout=0.3).__enter__)
+            os.unlink(self.lock_path)
+
+            # So should breaking an expired lock.
+            lockfile.LockFile._create_lockfile(self.lock_path, -100, '1234')
+            with lockfile.LockFile(self.lock_path, timeout=1):
+                pass
+        finally:
+            lockfile.disable_stats()
+
+        records = lockfile.load_stats(stats_path)
+        os.unlink(stats_path)
+
+        # The last lock also records the '.expired' lock it used.
+        self.assertEqual(len(records), 5)
+        self.assertEqual([r['backend'] for r in records[:2]], list(lockfile.BACKENDS))
+        self.assertGreaterEqual(records[0]['hold'], 0.05)
+
+        summary = lockfile.summarize_stats(records)
+        self.assertEqual(set(summary.keys()),
+                         {self.lock_path, self.lock_path + '.expired'})
+        summ = summary[self.lock_path]
+        self.assertEqual(summ['count'], 4)
+        self.assertEqual(summ['timeouts'], 1)
+        self.assertEqual(summ['expired_broken'], 1)
+        self.assertGreater(summ['retries'], 0)
+        self.assertGreaterEqual(summ['max_wait'], 0.3)
+        self.assertEqual(sum(summ['histogram']), 4)
+
     def test_lock_errors(self):
 
         def _acquire_lock(*args, **kwargs):
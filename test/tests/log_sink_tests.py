@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pavilion import log_sink
+
+
+class LogSinkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'run.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_lines(self, sink, count):
+        for i in range(count):
+            sink.write('line {:05d}\n'.format(i).encode())
+
+    def test_unbounded(self):
+        """Plain and compressed logs should read back the same."""
+
+        for compress in False, True:
+            with log_sink.LogSink(self.path, compress=compress) as sink:
+                self._write_lines(sink, 1000)
+
+            self.assertEqual(log_sink.find_log(self.path), sink.log_path)
+            self.assertEqual(sink.log_path.endswith('.gz'), compress)
+            with log_sink.open_log(self.path) as log:
+                lines = log.readlines()
+            self.assertEqual(len(lines), 1000)
+            self.assertEqual(lines[-1], 'line 00999\n')
+
+            summary = log_sink.summary(self.path)
+            self.assertEqual(summary['lines'], 1000)
+            self.assertEqual(summary['bytes'], 11000)
+            self.assertEqual(summary['omitted_bytes'], 0)
+            os.unlink(sink.log_path)
+
+    def test_bounded(self):
+        """Only the head and tail of the output are kept."""
+
+        with log_sink.LogSink(self.path, compress=True, head=110,
+                              tail=220) as sink:
+            self._write_lines(sink, 10000)
+
+        with log_sink.open_log(self.path + '.gz') as log:
+            lines = log.read().split('\n')
+
+        self.assertEqual(lines[:10], ['line {:05d}'.format(i)
+                                      for i in range(10)])
+        self.assertEqual(lines[-21:-1], ['line {:05d}'.format(i)
+                                         for i in range(9980, 10000)])
+        self.assertIn('109670 bytes (9970 lines) of output omitted', lines[11])
+
+        summary = log_sink.summary(self.path)
+        self.assertEqual((summary['bytes'], summary['lines']), (110000, 10000))
+        self.assertEqual(summary['omitted_lines'], 9970)
+
+        # Missing logs raise an OSError, like open() would.
+        with self.assertRaises(OSError):
+            log_sink.open_log(os.path.join(self.tmp_dir, 'nope'))
+
+    def test_killed(self):
+        """Logs that were flushed but never closed (because the process
+        writing them was killed) should still read back in full."""
+
+        sink = log_sink.LogSink(self.path, compress=True, head=110, tail=220)
+        self._write_lines(sink, 10000)
+        sink.flush()
+
+        with log_sink.open_log(self.path) as log:
+            lines = log.read().split('\n')
+        self.assertEqual(lines[:10], ['line {:05d}'.format(i)
+                                      for i in range(10)])
+        self.assertIn('of output omitted', lines[11])
+        self.assertEqual(lines[-21:-1], ['line {:05d}'.format(i)
+                                         for i in range(9980, 10000)])
+        self.assertEqual(log_sink.summary(self.path)['bytes'], 110000)
+
+        # Closing the log folds the tail into it.
+        sink.close()
+        self.assertFalse(os.path.exists(self.path + log_sink.TAIL_EXT))
+        with log_sink.open_log(self.path) as log:
+            self.assertEqual(log.read().split('\n'), lines)
+
+        # Unfinished compressed logs read as far as they go.
+        other_path = os.path.join(self.tmp_dir, 'other.log')
+        sink = log_sink.LogSink(other_path, compress=True)
+        self._write_lines(sink, 1000)
+        sink.flush()
+        with log_sink.open_log(other_path, 'rb') as log:
+            self.assertEqual(len(log.readlines()), 1000)
+        sink.close()
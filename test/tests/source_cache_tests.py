@@ -0,0 +1,104 @@
+import io
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import unittest
+
+from pavilion import config
+from pavilion import source_cache
+
+
+class SourceCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pav_cfg = config.PavilionConfigLoader().load_empty()
+        self.pav_cfg.working_dir = self.tmp_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _make_tar(self):
+        path = os.path.join(self.tmp_dir, 'src.tar.gz')
+        with tarfile.open(path, 'w:gz') as tar:
+            for fn in 'a', 'sub/b':
+                data = (fn * 1000).encode()
+                info = tarfile.TarInfo('top/' + fn)
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+            info = tarfile.TarInfo('top/link')
+            info.type = tarfile.SYMTYPE
+            info.linkname = 'a'
+            tar.addfile(info)
+
+        return path
+
+    def _check_tree(self, path):
+        self.assertEqual(sorted(os.listdir(path)), ['a', 'link', 'sub'])
+        self.assertEqual(os.readlink(os.path.join(path, 'link')), 'a')
+        with open(os.path.join(path, 'sub', 'b')) as b_file:
+            self.assertEqual(b_file.read(), 'sub/b' * 1000)
+
+    def test_populate(self):
+        """Archives should only be extracted once, and each mode should
+        give an independent, complete tree."""
+
+        src = self._make_tar()
+        digest = b'\x01' * 32
+
+        self.pav_cfg.source_cache = 'reflink'
+        cache = source_cache.SourceCache(self.pav_cfg)
+        self.assertTrue(cache.enabled)
+
+        dest1 = os.path.join(self.tmp_dir, 'build1')
+        extract_stats, link_stats = cache.populate(src, 'gzip', digest, dest1)
+        self.assertIsNotNone(extract_stats)
+        self.assertEqual(link_stats.files, 2)
+        self.assertIn(str(link_stats.files), str(link_stats))
+        self._check_tree(dest1)
+
+        entry = cache.entry_path(digest)
+        self._check_tree(entry)
+        self.assertFalse(os.path.exists(entry + '.tmp'))
+        # Cached files are read only, but the build's copies aren't.
+        entry_a = os.path.join(entry, 'a')
+        dest_a = os.path.join(dest1, 'a')
+        self.assertFalse(os.stat(entry_a).st_mode & 0o222)
+        self.assertTrue(os.stat(dest_a).st_mode & stat.S_IWUSR)
+        self.assertNotEqual(os.stat(entry_a).st_ino, os.stat(dest_a).st_ino)
+
+        # The second time comes straight from the cache.
+        dest2 = os.path.join(self.tmp_dir, 'build2')
+        extract_stats, _ = cache.populate(src, 'gzip', digest, dest2)
+        self.assertIsNone(extract_stats)
+        self._check_tree(dest2)
+
+        # Hard links share the (read only) cached file.
+        self.pav_cfg.source_cache = 'hardlink'
+        cache = source_cache.SourceCache(self.pav_cfg)
+        dest3 = os.path.join(self.tmp_dir, 'build3')
+        _, link_stats = cache.populate(src, 'gzip', digest, dest3)
+        self._check_tree(dest3)
+        if link_stats.methods == {'hardlink'}:
+            self.assertEqual(os.stat(os.path.join(dest3, 'a')).st_ino,
+                             os.stat(entry_a).st_ino)
+
+        self.pav_cfg.source_cache = 'off'
+        self.assertFalse(source_cache.SourceCache(self.pav_cfg).enabled)
+
+    def test_bad_archive(self):
+        """Bad archives don't leave anything in the cache."""
+
+        src = os.path.join(self.tmp_dir, 'bad.tar.gz')
+        with open(src, 'wb') as bad_file:
+            bad_file.write(b'not a tar file')
+
+        cache = source_cache.SourceCache(self.pav_cfg)
+        with self.assertRaises(source_cache.SourceCacheError):
+            cache.populate(src, 'gzip', b'\x02' * 32,
+                           os.path.join(self.tmp_dir, 'build'))
+
+        self.assertFalse(os.path.exists(cache.entry_path(b'\x02' * 32)))
@@ -0,0 +1,57 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from pavilion import commands
+from pavilion import config
+from pavilion import status_index
+from pavilion import utils
+from pavilion.plugins.commands.status import StatusCommand
+from pavilion.status_file import StatusFile, STATES
+
+
+class StatusCmdTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.pav_cfg = config.PavilionConfigLoader().load_empty()
+        self.pav_cfg.working_dir = self.tmp_dir
+
+        self.cmd = StatusCommand()
+        self.parser = argparse.ArgumentParser()
+        self.cmd._setup_arguments(self.parser)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_update(self):
+        """The 'update' form (as used by pav-lib.bash) should set the status
+        of the test, in both its status file and the index."""
+
+        test_path = utils.make_id_path(os.path.join(self.tmp_dir, 'tests'), 7)
+        os.makedirs(test_path)
+        status_path = os.path.join(test_path, 'status')
+        StatusFile(status_path)
+
+        args = self.parser.parse_args(
+            ['7', 'update', STATES.RUN_ERROR, 'Module gcc was not loaded.'])
+        self.assertEqual(self.cmd.run(self.pav_cfg, args), 0)
+
+        status = StatusFile(status_path).current()
+        self.assertEqual(status.state, STATES.RUN_ERROR)
+        self.assertEqual(status.note, 'Module gcc was not loaded.')
+
+        index = status_index.StatusIndex.from_working_dir(self.tmp_dir)
+        self.assertEqual(index.current([7])[7].state, STATES.RUN_ERROR)
+
+        # Tests that don't exist can't be updated.
+        args = self.parser.parse_args(['8', 'update', STATES.RUN_ERROR, 'x'])
+        with self.assertRaises(commands.CommandError):
+            self.cmd.run(self.pav_cfg, args)
+
+        args = self.parser.parse_args(['7', 'bogus'])
+        with self.assertRaises(commands.CommandError):
+            self.cmd.run(self.pav_cfg, args)
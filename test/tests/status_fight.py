@@ -1,15 +1,24 @@
 # This file isn't a test, but is run as part of the status file tests.
 # It writes a whole bunch of status updates to a file over the period of a half
 # second, starting when the file is created.
+#
+# It can also be run as a status file throughput benchmark:
+#   python3 status_fight.py --bench [count]
+# This compares the old way of doing things (looking up the timezone for every status
+# file, reopening the file for every update, parsing timestamps with strptime, and rereading
+# the file for every current() call) with the new.
 
 from __future__ import unicode_literals, print_function, division
 
+import datetime
+import getpass
 import logging
 import os
 import sys
+import tempfile
 import time
 
-log_dir = '/tmp/{}'.format(os.getlogin())
+log_dir = '/tmp/{}'.format(getpass.getuser())
 if not os.path.exists(log_dir):
     os.makedirs(log_dir)
 logging.basicConfig(filename=os.path.join(log_dir, 'pavilion_tests.log'))
@@ -21,20 +30,91 @@ from pavilion import status_file
 
 TIME_LIMIT = 0.5
 
-# This takes a file name as a single argument.
-path = sys.argv[1]
 
-start_time = None
+def fight(path):
+    """Wait for the file to exist, then write to it as fast as possible for TIME_LIMIT
+    seconds."""
 
-while not os.path.exists(path):
-    continue
+    while not os.path.exists(path):
+        continue
 
-start_time = time.time()
-status = status_file.StatusFile(path)
+    start_time = time.time()
+    status = status_file.StatusFile(path)
 
-while True:
-    if time.time() - start_time > TIME_LIMIT:
-        break
+    while True:
+        if time.time() - start_time > TIME_LIMIT:
+            break
 
-    for i in range(100):
-        status.set(status_file.STATES.RUNNING, "Testing {}".format(os.getpid()))
+        for i in range(100):
+            status.set(status_file.STATES.RUNNING, "Testing {}".format(os.getpid()))
+
+
+def timed(func, count, reps=3):
+    """Return how many times per second func can be called (best of reps)."""
+
+    best = None
+    for rep in range(reps):
+        start = time.time()
+        for i in range(count):
+            func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return count/best
+
+
+def bench(bench_dir, count):
+    """Compare old and new status file operations.
+    :returns: A list of (operation, before, after) rates per second."""
+
+    import tzlocal
+
+    path = os.path.join(bench_dir, 'status')
+    status = status_file.StatusFile(path)
+    running = status_file.STATES.RUNNING
+
+    def set_status():
+        status.set(running, 'bench')
+
+    results = []
+
+    before = timed(set_status, count)
+    with status:
+        after = timed(set_status, count)
+    results.append(('set', before, after))
+
+    results.append(('current',
+                    timed(lambda: status_file.StatusFile(path).current(), count),
+                    timed(status.current, count)))
+
+    # The same history, with and without epochs (as written by older versions).
+    new_path = os.path.join(bench_dir, 'new_status')
+    legacy_path = os.path.join(bench_dir, 'legacy_status')
+    new_status = status_file.StatusFile(new_path)
+    tz = tzlocal.get_localzone()
+    with new_status, open(legacy_path, 'w') as legacy_file:
+        for i in range(count - 1):
+            new_status.set(running, 'bench')
+            when = tz.localize(datetime.datetime.now())
+            legacy_file.write('{} {} bench\n'.format(
+                when.strftime(status_file.StatusFile.TIME_FORMAT), running))
+    legacy_status = status_file.StatusFile(legacy_path)
+
+    results.append(('history (lines)',
+                    timed(legacy_status.history, 1)*count,
+                    timed(new_status.history, 1)*count))
+
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        bench_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+        tmp_dir = tempfile.mkdtemp()
+
+        print("{:16s} {:>12s} {:>12s} {:>8s}".format('op/sec', 'before', 'after', 'speedup'))
+        for name, before, after in bench(tmp_dir, bench_count):
+            print("{:16s} {:12.1f} {:12.1f} {:7.1f}x".format(name, before, after, after/before))
+    else:
+        # This takes a file name as a single argument.
+        fight(sys.argv[1])
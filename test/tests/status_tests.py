@@ -1,6 +1,10 @@
 from pavilion.status_file import StatusFile, STATES
+from pavilion import status_file
+from pavilion import status_index
+from pavilion import status_watch
 import datetime
 import os
+import shutil
 import subprocess
 import tempfile
 import time
@@ -59,6 +63,165 @@ class StatusTests(unittest.TestCase):
 
         os.unlink(fn)
 
+    def test_status_cache(self):
+        """Check the kept open mode, current() caching, and parsing of status lines
+        without epochs."""
+
+        fn = tempfile.mktemp()
+        status = StatusFile(fn)
+
+        with status:
+            status.set(STATES.RUNNING, 'kept open')
+            self.assertEqual(status.current().state, STATES.RUNNING)
+            status.set(STATES.COMPLETE, 'still open')
+        self.assertIsNone(status._fd)
+
+        current = status.current()
+        self.assertEqual(current.note, 'still open')
+        # Nothing changed, so we should get the cached result.
+        self.assertIs(status.current(), current)
+        status.set(STATES.FAILED, 'changed')
+        self.assertEqual(status.current().state, STATES.FAILED)
+
+        # Status lines from older versions don't have an epoch.
+        with open(fn, 'a') as status_file:
+            status_file.write('2019-01-02T03:04:05.000006-0700 RUNNING 1 2 3\n')
+        legacy = status.current()
+        self.assertEqual(legacy.state, STATES.RUNNING)
+        self.assertEqual(legacy.note, '1 2 3')
+        self.assertEqual(legacy.when.year, 2019)
+
+        history = status.history()
+        self.assertEqual([s.state for s in history],
+                         [STATES.CREATED, STATES.RUNNING, STATES.COMPLETE,
+                          STATES.FAILED, STATES.RUNNING])
+        self.assertIsNotNone(history[1].when.tzinfo)
+
+        os.unlink(fn)
+
+    def test_bulk_current(self):
+        """Check that bulk status queries get the right status for every file, and collect
+        errors rather than failing."""
+
+        status_dir = tempfile.mkdtemp()
+
+        paths = []
+        for i in range(100):
+            path = os.path.join(status_dir, str(i))
+            StatusFile(path).set(STATES.RUNNING, 'test {}'.format(i))
+            paths.append(path)
+
+        missing = [os.path.join(status_dir, 'missing{}'.format(i)) for i in range(3)]
+
+        errors = []
+        statuses = status_file.bulk_current(paths + missing, max_workers=8, errors=errors)
+
+        self.assertEqual(len(statuses), 103)
+        for i, path in enumerate(paths):
+            self.assertEqual(statuses[path].state, STATES.RUNNING)
+            self.assertEqual(statuses[path].note, 'test {}'.format(i))
+        for path in missing:
+            self.assertEqual(statuses[path].state, STATES.UNKNOWN)
+            # Reading the status shouldn't create it.
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(sorted(path for path, _ in errors), sorted(missing))
+
+        # The serial path should give the same answers.
+        serial = status_file.bulk_current(paths, max_workers=1)
+        self.assertEqual({p: s.note for p, s in serial.items()},
+                         {p: statuses[p].note for p in paths})
+
+        shutil.rmtree(status_dir)
+
+    def test_status_watch(self):
+        """Check that status changes are picked up, both with inotify and polling."""
+
+        status_dir = tempfile.mkdtemp()
+
+        status_files = {}
+        for i in range(5):
+            status_files[i] = os.path.join(status_dir, str(i))
+            StatusFile(status_files[i]).set(STATES.SCHEDULED, 'waiting')
+
+        for use_inotify in True, False:
+            with status_watch.StatusWatcher(status_files, poll_interval=0.1,
+                                            use_inotify=use_inotify) as watcher:
+                if not use_inotify:
+                    self.assertEqual(watcher.polled, 5)
+                self.assertEqual(watcher.counts[STATES.SCHEDULED], 5)
+                self.assertEqual(watcher.wait(timeout=0.2), [])
+
+                StatusFile(status_files[1]).set(STATES.BUILD_DONE, 'built')
+                StatusFile(status_files[1]).set(STATES.RUN_DONE, 'ran')
+                StatusFile(status_files[3]).set(STATES.RUN_FAILED, 'oops')
+
+                updates = []
+                end = time.time() + 5
+                while len(updates) < 3 and time.time() < end:
+                    updates.extend(watcher.wait(timeout=1))
+
+                self.assertEqual(sorted((key, status.state) for key, status in updates),
+                                 [(1, STATES.BUILD_DONE), (1, STATES.RUN_DONE),
+                                  (3, STATES.RUN_FAILED)])
+                self.assertEqual(dict(watcher.counts),
+                                 {STATES.SCHEDULED: 3, STATES.RUN_DONE: 1,
+                                  STATES.RUN_FAILED: 1})
+                self.assertFalse(watcher.done())
+
+            # Reset for the next round.
+            for i in 1, 3:
+                StatusFile(status_files[i]).set(STATES.SCHEDULED, 'waiting')
+
+        shutil.rmtree(status_dir)
+
+    def test_status_watch_index(self):
+        """Polled status files should be followed through the status index
+        where they can be, and polled directly otherwise."""
+
+        work_dir = tempfile.mkdtemp()
+        index = status_index.StatusIndex.from_working_dir(work_dir)
+
+        status_files = {}
+        for i in range(5):
+            status_files[i] = os.path.join(work_dir, str(i))
+            StatusFile(status_files[i], index=index, index_key=i).set(
+                STATES.SCHEDULED, 'waiting')
+        # This one changed without the index, so it has to be polled.
+        StatusFile(status_files[4]).set(STATES.SCHEDULED, 'not indexed')
+
+        def wait_for(watcher, count):
+            updates = []
+            end = time.time() + 5
+            while len(updates) < count and time.time() < end:
+                updates.extend(watcher.wait(timeout=1))
+            return sorted((key, status.state) for key, status in updates)
+
+        with status_watch.StatusWatcher(status_files, poll_interval=0.1,
+                                        use_inotify=False,
+                                        index=index) as watcher:
+            self.assertEqual((watcher.indexed, watcher.polled), (4, 1))
+            self.assertEqual(watcher.wait(timeout=0.2), [])
+
+            StatusFile(status_files[1], index=index, index_key=1).set(
+                STATES.RUN_DONE, 'ran')
+            StatusFile(status_files[4]).set(STATES.RUN_FAILED, 'oops')
+            self.assertEqual(wait_for(watcher, 2),
+                             [(1, STATES.RUN_DONE), (4, STATES.RUN_FAILED)])
+
+            # Changes are still noticed across compactions.
+            StatusFile(status_files[2], index=index, index_key=2).set(
+                STATES.RUN_DONE, 'ran')
+            index.compact()
+            StatusFile(status_files[3], index=index, index_key=3).set(
+                STATES.RUN_DONE, 'ran')
+            self.assertEqual(wait_for(watcher, 2),
+                             [(2, STATES.RUN_DONE), (3, STATES.RUN_DONE)])
+            self.assertEqual(dict(watcher.counts),
+                             {STATES.SCHEDULED: 1, STATES.RUN_DONE: 3,
+                              STATES.RUN_FAILED: 1})
+
+        shutil.rmtree(work_dir)
+
     def test_atomicity(self):
         """Making sure the status file can be written to atomically."""
 
@@ -99,3 +262,76 @@ class StatusTests(unittest.TestCase):
             self.assertIsNot(entry.when, None)
 
         os.unlink(fn)
+
+    def test_status_index(self):
+        """Check that the status index tracks the status files, compacts
+        properly, and that queries fall back to the status files."""
+
+        work_dir = tempfile.mkdtemp()
+        index = status_index.StatusIndex.from_working_dir(work_dir)
+
+        tests = {}
+        for test_id in range(1, 21):
+            test_path = os.path.join(work_dir, 'tests', str(test_id))
+            os.makedirs(test_path)
+            tests[test_id] = test_path
+
+            status = StatusFile(os.path.join(test_path, 'status'),
+                                index=index, index_key=test_id)
+            status.set(STATES.RUNNING, 'running {}'.format(test_id))
+            if test_id % 2:
+                status.set(STATES.COMPLETE, 'multi-line\nnote')
+
+        # This test isn't in the index, so its status comes from its file.
+        unindexed_path = os.path.join(work_dir, 'tests', '21')
+        os.makedirs(unindexed_path)
+        StatusFile(os.path.join(unindexed_path, 'status')).set(
+            STATES.BUILDING, 'unindexed')
+        tests[21] = unindexed_path
+
+        def check(statuses):
+            self.assertEqual(len(statuses), 21)
+            for test_id, status in statuses.items():
+                if test_id == 21:
+                    self.assertEqual(status.state, STATES.BUILDING)
+                elif test_id % 2:
+                    self.assertEqual(status.state, STATES.COMPLETE)
+                    self.assertEqual(status.note, 'multi-line note')
+                else:
+                    self.assertEqual(status.state, STATES.RUNNING)
+                    self.assertEqual(status.note,
+                                     'running {}'.format(test_id))
+                    file_status = StatusFile(
+                        os.path.join(tests[test_id], 'status')).current()
+                    self.assertEqual(status.when, file_status.when)
+
+        self.assertEqual(len(index.current()), 20)
+        self.assertEqual(set(index.current([1, 2, 21]).keys()), {1, 2})
+        check(status_index.get_current(index, tests))
+
+        # Compacting should leave just the snapshot, with the same results.
+        index.compact()
+        self.assertEqual(os.listdir(index.path), ['snapshot'])
+        check(status_index.get_current(index, tests))
+
+        # Updates after compaction land in a new log.
+        StatusFile(os.path.join(tests[2], 'status'),
+                   index=index, index_key=2).set(STATES.COMPLETE, 'done')
+        self.assertEqual(index.current([2])[2].state, STATES.COMPLETE)
+
+        # Status changes that never made it to the index are noticed, and
+        # read from the status file instead.
+        StatusFile(os.path.join(tests[4], 'status')).set(
+            STATES.RUN_FAILED, 'not indexed')
+        self.assertEqual(index.current([4])[4].state, STATES.RUNNING)
+        status_paths = {4: os.path.join(tests[4], 'status')}
+        self.assertEqual(index.current([4], status_paths), {})
+        stale = status_index.get_current(index, tests)[4]
+        self.assertEqual(stale.state, STATES.RUN_FAILED)
+        self.assertEqual(stale.note, 'not indexed')
+
+        # Without an index, everything comes from the status files.
+        self.assertEqual(status_index.get_current(None, tests)[2].state,
+                         STATES.COMPLETE)
+
+        shutil.rmtree(work_dir)
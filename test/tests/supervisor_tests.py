@@ -0,0 +1,127 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pavilion import supervisor
+
+
+class SupervisorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _script(self, body):
+        path = os.path.join(self.tmp_dir, 'script.sh')
+        with open(path, 'w') as script:
+            script.write('#!/bin/bash\n' + body + '\n')
+        os.chmod(path, 0o755)
+        return [path]
+
+    @staticmethod
+    def _alive(pid):
+        """Whether the given process is still running (and not just a
+        zombie waiting to be reaped)."""
+
+        try:
+            with open('/proc/{}/stat'.format(pid)) as stat_file:
+                return stat_file.read().rsplit(')', 1)[1].split()[0] != 'Z'
+        except FileNotFoundError:
+            return False
+
+    def _wait_gone(self, pid):
+        end = time.time() + 5
+        while self._alive(pid) and time.time() < end:
+            time.sleep(0.05)
+        self.assertFalse(self._alive(pid))
+
+    def test_output(self):
+        """Output from both stdout and stderr should end up in the log, in
+        order, along with the return code."""
+
+        log = io.BytesIO()
+        result = supervisor.supervise(
+            self._script('echo out; echo err >&2; pwd; exit 3'), log,
+            cwd=self.tmp_dir, silent_timeout=5, wall_timeout=10)
+
+        self.assertEqual(result.returncode, 3)
+        self.assertIsNone(result.timeout)
+        self.assertEqual(log.getvalue(),
+                         'out\nerr\n{}\n'.format(self.tmp_dir).encode())
+        self.assertEqual(result.output_bytes, len(log.getvalue()))
+
+    def test_large_output(self):
+        """Lots of output should be written in full."""
+
+        log = io.BytesIO()
+        result = supervisor.supervise(
+            self._script('head -c 5000000 /dev/zero'), log, silent_timeout=5)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(len(log.getvalue()), 5000000)
+
+    def test_timeouts(self):
+        """Silent and wall clock timeouts should be enforced promptly."""
+
+        log = io.BytesIO()
+        start = time.time()
+        result = supervisor.supervise(
+            self._script('echo start; sleep 30'), log, silent_timeout=0.5)
+        self.assertEqual(result.timeout, supervisor.TIMEOUT_SILENT)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(log.getvalue(), b'start\n')
+
+        # Everything the process started is killed with it.
+        pid_path = os.path.join(self.tmp_dir, 'pid')
+        result = supervisor.supervise(
+            self._script('sleep 30 & echo $! > {}; wait'.format(pid_path)),
+            log, silent_timeout=0.5)
+        self.assertEqual(result.timeout, supervisor.TIMEOUT_SILENT)
+        with open(pid_path) as pid_file:
+            self._wait_gone(int(pid_file.read()))
+
+        # Steady output doesn't trip the silent timeout, but the wall clock
+        # one still applies.
+        start = time.time()
+        result = supervisor.supervise(
+            self._script('while true; do echo tick; sleep 0.1; done'), log,
+            silent_timeout=0.5, wall_timeout=1)
+        self.assertEqual(result.timeout, supervisor.TIMEOUT_WALL)
+        self.assertLess(time.time() - start, 5)
+
+    def test_closed_output(self):
+        """A process that closes its output but keeps running should still
+        be killed when it goes silent too long."""
+
+        log = io.BytesIO()
+        start = time.time()
+        result = supervisor.supervise(
+            self._script('echo closing; exec >&- 2>&-; sleep 30'), log,
+            silent_timeout=0.5)
+        self.assertEqual(result.timeout, supervisor.TIMEOUT_SILENT)
+        self.assertIsNotNone(result.returncode)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(log.getvalue(), b'closing\n')
+
+    def test_background_child(self):
+        """A background process holding the output open shouldn't keep us
+        waiting once the main process is done."""
+
+        log = io.BytesIO()
+        start = time.time()
+        result = supervisor.supervise(
+            self._script('sleep 20 & echo $! > pid; echo done'), log,
+            cwd=self.tmp_dir, silent_timeout=10)
+        self.assertEqual(result.returncode, 0)
+        self.assertIsNone(result.timeout)
+        self.assertEqual(log.getvalue(), b'done\n')
+        self.assertLess(time.time() - start, 5)
+
+        # The left over process is killed, rather than left running with
+        # its output going nowhere.
+        with open(os.path.join(self.tmp_dir, 'pid')) as pid_file:
+            self._wait_gone(int(pid_file.read()))
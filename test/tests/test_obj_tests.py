@@ -1,9 +1,13 @@
 import os
 import shutil
 import tempfile
+import threading
+import time
 import unittest
 
 from pavilion import config
+from pavilion import lockfile
+from pavilion.status_file import STATES
 from pavilion.test_config import PavTest, variables
 from pavilion.test_config.test import PavTestError
 from pavilion.suite import Suite
@@ -324,6 +328,54 @@ class PavTestTests(unittest.TestCase):
 
         self.assertEqual(test.build_origin, test2.build_origin)
 
+    def test_build_lock(self):
+        """Builds locked by someone else should be waited for, up to the
+        build lock timeout."""
+
+        config = {
+            'name': 'build_test',
+            'build': {
+                'cmds': ['echo "contended"'],
+                'source_location': 'binfile.gz',
+            },
+        }
+
+        test = PavTest(self.pav_cfg, config)
+        if os.path.isdir(test.build_origin):
+            shutil.rmtree(test.build_origin)
+        lock_path = test.build_origin + '.lock'
+
+        orig_timeout = self.pav_cfg.build_lock_timeout
+        try:
+            # Someone else holds the build lock for too long.
+            self.pav_cfg.build_lock_timeout = 1
+            with lockfile.LockFile(lock_path, timeout=1):
+                self.assertFalse(test.build())
+            self.assertEqual(test.status.current().state, STATES.BUILD_ERROR)
+            self.assertTrue(test.status.current().note.startswith("Timed out"))
+            self.assertFalse(os.path.exists(test.build_path))
+
+            # When they finish in time, we wait for them and then build.
+            self.pav_cfg.build_lock_timeout = 30
+            locked = threading.Event()
+
+            def hold_lock():
+                with lockfile.LockFile(lock_path, timeout=1):
+                    locked.set()
+                    time.sleep(1)
+
+            holder = threading.Thread(target=hold_lock)
+            holder.start()
+            locked.wait()
+            start = time.time()
+            test2 = PavTest(self.pav_cfg, config)
+            self.assertTrue(test2.build())
+            self.assertGreater(time.time() - start, 0.5)
+            holder.join()
+            self.assertTrue(os.path.isdir(test2.build_path))
+        finally:
+            self.pav_cfg.build_lock_timeout = orig_timeout
+
     def test_run(self):
         config1 = {
             'name': 'run_test',
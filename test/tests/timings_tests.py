@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pavilion import timings
+
+
+class TimingsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_record(self):
+        """Timings from separate processes are merged in the file."""
+
+        times = timings.Timings(self.test_dir)
+        start = timings.now()
+        time.sleep(0.01)
+        times.record('id_alloc', start)
+        with self.assertRaises(ValueError):
+            with times.timer('build'):
+                raise ValueError()
+        times.save()
+
+        # Like a later process (the run) would.
+        times = timings.Timings(self.test_dir)
+        with times.timer('run'):
+            pass
+        times.save()
+
+        loaded = timings.load(self.test_dir)
+        self.assertEqual(sorted(loaded.keys()), ['build', 'id_alloc', 'run'])
+        self.assertGreaterEqual(loaded['id_alloc'][1], 0.01)
+        self.assertAlmostEqual(loaded['run'][0], time.time(), delta=5)
+
+        with open(os.path.join(self.test_dir, timings.TIMINGS_FN), 'w') as tf:
+            tf.write('garbage')
+        self.assertEqual(timings.load(self.test_dir), {})
+
+    def test_aggregate(self):
+        """Check the percentiles and phase ordering."""
+
+        all_times = [{'run': [0, i], 'build_hash': [0, i/10]}
+                     for i in range(1, 101)]
+        all_times.append({'custom': [0, 1]})
+
+        summary = timings.aggregate(all_times)
+        self.assertEqual(list(summary.keys()), ['build_hash', 'run', 'custom'])
+        self.assertEqual(summary['run']['count'], 100)
+        self.assertEqual(summary['run']['p50'], 50)
+        self.assertEqual(summary['run']['p90'], 90)
+        self.assertEqual(summary['run']['p99'], 99)
+        self.assertEqual(summary['run']['max'], 100)
+        self.assertEqual(summary['run']['total'], 5050)
+        self.assertEqual(timings.percentile([], 50), None)
+        self.assertEqual(timings.percentile([3], 1), 3)
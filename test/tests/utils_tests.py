@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pavilion import utils
+
+
+class UtilsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.id_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.id_dir)
+
+    def test_create_id_dir(self):
+        """Make sure ids are handed out in order, and persist across
+        counter loss."""
+
+        for i in range(1, 4):
+            id_, path = utils.create_id_dir(self.id_dir)
+            self.assertEqual(id_, i)
+            self.assertEqual(path, utils.make_id_path(self.id_dir, i))
+            self.assertTrue(os.path.isdir(path))
+
+        # Deleted ids aren't reused without a compaction.
+        os.rmdir(utils.make_id_path(self.id_dir, 2))
+        self.assertEqual(utils.create_id_dir(self.id_dir)[0], 4)
+
+        # Directories created behind the counter's back are skipped.
+        os.mkdir(utils.make_id_path(self.id_dir, 5))
+        self.assertEqual(utils.create_id_dir(self.id_dir)[0], 6)
+
+        # A missing counter is rebuilt from the directory contents.
+        os.unlink(os.path.join(self.id_dir, utils.ID_COUNTER_FN))
+        self.assertEqual(utils.create_id_dir(self.id_dir)[0], 7)
+
+        # Garbage in the counter is treated the same way.
+        with open(os.path.join(self.id_dir, utils.ID_COUNTER_FN), 'w') as cfile:
+            cfile.write('garbage')
+        self.assertEqual(utils.create_id_dir(self.id_dir)[0], 8)
+
+    def test_compact_id_dir(self):
+        """Make sure gaps are found and reused after a compaction."""
+
+        for i in range(10):
+            utils.create_id_dir(self.id_dir)
+
+        for id_ in 2, 3, 4, 7:
+            os.rmdir(utils.make_id_path(self.id_dir, id_))
+
+        self.assertEqual(utils.compact_id_dir(self.id_dir), 4)
+
+        ids = [utils.create_id_dir(self.id_dir)[0] for i in range(6)]
+        self.assertEqual(ids, [2, 3, 4, 7, 11, 12])
+
+    def test_reserve_ids(self):
+        """Make sure blocks of ids can be reserved and handed out."""
+
+        utils.create_id_dir(self.id_dir)
+
+        block = utils.reserve_ids(self.id_dir, 5)
+        self.assertEqual(len(block), 5)
+
+        # Individual allocations happen after the block.
+        self.assertEqual(utils.create_id_dir(self.id_dir)[0], 7)
+
+        for i in range(2, 5):
+            id_, path = block.take()
+            self.assertEqual(id_, i)
+            self.assertTrue(os.path.isdir(path))
+
+        # Unused ids have their directories removed.
+        block.release()
+        self.assertEqual(len(block), 0)
+        self.assertFalse(os.path.exists(utils.make_id_path(self.id_dir, 5)))
+        self.assertRaises(IndexError, block.take)
+
+        # Blocks skip over directories created behind the counter's back.
+        os.mkdir(utils.make_id_path(self.id_dir, 9))
+        block = utils.reserve_ids(self.id_dir, 3)
+        self.assertEqual([block.take()[0] for i in range(3)], [8, 10, 11])
+
+    def test_sharded_layout(self):
+        """Check id allocation and conversion between layouts."""
+
+        for i in range(3):
+            utils.create_id_dir(self.id_dir)
+
+        # Something outside the id dir that links to one of the tests.
+        link_dir = tempfile.mkdtemp()
+        link_path = os.path.join(link_dir, 'link')
+        os.symlink(os.path.join(utils.make_id_path(self.id_dir, 2), 'file'),
+                   link_path)
+        with open(os.path.join(utils.make_id_path(self.id_dir, 2), 'file'),
+                  'w') as file:
+            file.write('data')
+
+        moved = utils.convert_id_dir(self.id_dir, utils.LAYOUT_SHARDED)
+        self.assertEqual(len(moved), 3)
+        self.assertEqual(utils.get_layout(self.id_dir), utils.LAYOUT_SHARDED)
+
+        path = utils.make_id_path(self.id_dir, 2)
+        self.assertEqual(path, os.path.join(self.id_dir, '00', '00', '0000002'))
+        self.assertTrue(os.path.isdir(path))
+        self.assertEqual([id_ for id_, _ in utils.list_id_dirs(self.id_dir)],
+                         [1, 2, 3])
+
+        # Fix the link to the moved test.
+        self.assertEqual(utils.repoint_symlinks(link_dir, moved), 1)
+        with open(link_path) as file:
+            self.assertEqual(file.read(), 'data')
+
+        # New ids go into the sharded layout, including new shards.
+        block = utils.reserve_ids(self.id_dir, 1)
+        self.assertEqual(block.take(), (4, utils.make_id_path(self.id_dir, 4)))
+        os.mkdir(utils.make_id_path(self.id_dir, 5))
+        id_, path = utils.create_id_dir(self.id_dir)
+        self.assertEqual(id_, 6)
+        self.assertTrue(os.path.isdir(path))
+
+        # Converting back removes the shards.
+        moved = utils.convert_id_dir(self.id_dir, utils.LAYOUT_FLAT)
+        self.assertEqual(len(moved), 6)
+        self.assertFalse(os.path.exists(os.path.join(self.id_dir, '00')))
+        self.assertTrue(os.path.isdir(os.path.join(self.id_dir, '0000006')))
+
+        shutil.rmtree(link_dir)
+
+    def test_sharded_builds(self):
+        """Check build directory conversion."""
+
+        names = ['abcdef0123456789', '0123456789abcdef']
+        for name in names:
+            os.mkdir(utils.make_build_path(self.id_dir, name))
+        # Lock files and temp builds shouldn't be touched.
+        os.mkdir(os.path.join(self.id_dir, 'abcd.tmp'))
+
+        utils.convert_build_dir(self.id_dir, utils.LAYOUT_SHARDED)
+        self.assertEqual(utils.make_build_path(self.id_dir, names[0]),
+                         os.path.join(self.id_dir, 'ab', names[0]))
+        self.assertEqual(
+            sorted(name for name, _ in utils.list_build_dirs(self.id_dir)),
+            sorted(names))
+        self.assertTrue(os.path.isdir(os.path.join(self.id_dir, 'abcd.tmp')))
+
+    def test_mask_file_perms(self):
+        """Write bits are masked off of files, but not directories,
+        symlinks, or files that are already fine."""
+
+        for i in range(3):
+            sub_dir = os.path.join(self.id_dir, 'a', 'b{}'.format(i))
+            os.makedirs(sub_dir)
+            for name in 'rw', 'ro':
+                path = os.path.join(sub_dir, name)
+                with open(path, 'w'):
+                    pass
+                os.chmod(path, 0o4755 if name == 'rw' else 0o444)
+        os.symlink('a/b0/rw', os.path.join(self.id_dir, 'link'))
+        dir_mode = os.stat(os.path.join(self.id_dir, 'a')).st_mode
+
+        checked, changed = utils.mask_file_perms(self.id_dir, 0o7555,
+                                                 max_workers=2)
+        self.assertEqual((checked, changed), (6, 3))
+
+        for i in range(3):
+            sub_dir = os.path.join(self.id_dir, 'a', 'b{}'.format(i))
+            self.assertEqual(os.stat(sub_dir).st_mode, dir_mode)
+            self.assertEqual(os.stat(os.path.join(sub_dir, 'rw')).st_mode &
+                             0o7777, 0o4555)
+            self.assertEqual(os.stat(os.path.join(sub_dir, 'ro')).st_mode &
+                             0o7777, 0o444)
+
+        self.assertEqual(utils.mask_file_perms(self.id_dir, 0o7555), (6, 0))
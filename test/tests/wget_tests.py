@@ -1,7 +1,7 @@
-from hashlib import sha1
-import dbm
+from hashlib import sha1, sha256
 import logging
 import os
+import shutil
 import tempfile
 import unittest
 
@@ -69,34 +69,36 @@ class TestWGet(unittest.TestCase):
                                .format(self.PAV_CONFIG_PATH))
             pav_cfg = config.PavilionConfigLoader().load_empty()
 
-        dest_fn = tempfile.mktemp(dir='/tmp')
-        info_fn = '{}.info'.format(dest_fn)
+        dest_dir = tempfile.mkdtemp()
+        dest_fn = os.path.join(dest_dir, 'README.md')
+        index = wget.DownloadIndex(dest_dir)
 
-        self.assertFalse(os.path.exists(dest_fn))
-        self.assertFalse(os.path.exists(info_fn))
+        self.assertIsNone(index.get(dest_fn))
 
         # Update should get the file if it doesn't exist.
         wget.update(pav_cfg, self.GET_TARGET, dest_fn)
         self.assertTrue(os.path.exists(dest_fn))
-        self.assertTrue(os.path.exists(info_fn))
+        self.assertEqual(index.get(dest_fn)['sha256'],
+                         sha256(open(dest_fn, 'rb').read()).hexdigest())
 
-        # It should update the file if the info file isn't there and the sizes don't match.
+        # It should update the file if it was changed locally.
         ctime = os.stat(dest_fn).st_ctime
         with open(dest_fn, 'ab') as dest_file:
             dest_file.write(b'a')
-        os.unlink(info_fn)
         wget.update(pav_cfg, self.GET_TARGET, dest_fn)
         new_ctime = os.stat(dest_fn).st_ctime
         self.assertNotEqual(new_ctime, ctime)
+        self.assertEqual(get_hash(self.LOCAL_TARGET), get_hash(dest_fn))
         ctime = new_ctime
 
-        # We'll muck up the info file data, to force an update.
-        with dbm.open(info_fn, 'w') as db:
-            db['ETag'] = 'nope'
-            db['Content-Length'] = '-1'
+        # We'll muck up the index entry, to force an update.
+        entry = index.get(dest_fn)
+        entry['etag'] = '"nope"'
+        entry['last_modified'] = None
+        entry['size'] = -1
+        index.record(dest_fn, **entry)
         wget.update(pav_cfg, self.GET_TARGET, dest_fn)
         new_ctime = os.stat(dest_fn).st_ctime
         self.assertNotEqual(new_ctime, ctime)
 
-        os.unlink(dest_fn)
-        os.unlink(info_fn)
+        shutil.rmtree(dest_dir)